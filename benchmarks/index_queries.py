@@ -0,0 +1,161 @@
+"""
+索引前后各指标查询的耗时对比
+
+用法（在项目根目录执行）:
+    python -m benchmarks.index_queries --end-date 20250321
+    python -m benchmarks.index_queries --end-date 20250321 --drop-indexes   # 先删除已有索引和日线表唯一键，测量完整的前后对比
+"""
+import argparse
+import time
+from sqlalchemy import inspect, text
+from src.db.database import get_engine, get_session, get_storage_backend
+from src.db.migrations import add_daily_hq_unique_key, add_missing_indexes
+from src.entities.stock_daily_hq import StockDailyHQEntity
+from src.entities.temp_stock_hq import TempStockHQEntity
+from src.utils.data_processing import get_end_date
+from src.service.stock_service import get_latest_trade_dates_for_all_stocks, get_recent_history_for_all_stocks, MA_PERIODS
+from src.indicators.rps import calculate_rps_indicator
+from src.indicators.ma import calculate_ma_indicator
+from src.indicators.cross_ma import calculate_cross_ma_indicator
+from src.indicators.high_price import calculate_high_price_indicator
+from src.indicators.price_rise import calculate_price_rise_indicator
+
+
+def build_cases(session, end_date):
+    """
+    返回(名称, 调用函数)列表，每个函数执行一次对应的指标查询
+    """
+    temp_table = TempStockHQEntity.__tablename__
+    return [
+        ('get_end_date MAX(trade_date)', lambda: get_end_date(session, TempStockHQEntity.trade_date, None)),
+        ('latest trade dates GROUP BY ts_code', get_latest_trade_dates_for_all_stocks),
+        ('ma history ROW_NUMBER', lambda: get_recent_history_for_all_stocks(None, max(MA_PERIODS) - 1)),
+        ('init temp ROW_NUMBER window', lambda: session.execute(text(f"""
+            SELECT COUNT(*) FROM (
+                SELECT ts_code, ROW_NUMBER() OVER (PARTITION BY ts_code ORDER BY trade_date DESC) as row_num
+                FROM {StockDailyHQEntity.__tablename__}
+            ) subquery WHERE row_num <= 60
+        """)).scalar()),
+        ('rps self-join 3 days', lambda: calculate_rps_indicator(session, end_date, 3, 90)),
+        ('rps self-join 20 days', lambda: calculate_rps_indicator(session, end_date, 20, 90)),
+        ('bull ma', lambda: calculate_ma_indicator(session, end_date, 3)),
+        ('cross ma 4 days', lambda: calculate_cross_ma_indicator(session, end_date, 4)),
+        ('high price 60 days', lambda: calculate_high_price_indicator(session, end_date, 60)),
+        ('price rise 60 days', lambda: calculate_price_rise_indicator(session, end_date, 60)),
+        (f'{temp_table} row count', lambda: session.execute(text(f"SELECT COUNT(*) FROM {temp_table}")).scalar()),
+    ]
+
+
+def time_cases(session, cases, repeat):
+    """
+    每个用例执行repeat次，返回最短耗时（秒）
+    """
+    timings = {}
+    for name, func in cases:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            session.rollback()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+    return timings
+
+
+UNIQUE_KEY_NAME = 'uk_daily_hq_code_date'
+
+
+def describe_indexes():
+    """
+    返回日线表和临时表当前实际存在的索引和唯一键名称，用于标注每一轮测量的条件
+    """
+    inspector = inspect(get_engine())
+    described = {}
+    for entity in (StockDailyHQEntity, TempStockHQEntity):
+        table_name = entity.__tablename__
+        names = {index['name'] for index in inspector.get_indexes(table_name)}
+        names.update(constraint['name'] for constraint in inspector.get_unique_constraints(table_name))
+        described[table_name] = sorted(name for name in names if name)
+    return described
+
+
+def drop_daily_unique_key():
+    """
+    删除日线表的(ts_code, trade_date)唯一键，它与声明的索引一样覆盖按股票和日期的查询，
+    不删除时“索引前”的日线表查询实际上已经有索引
+
+    返回:
+    bool: 是否删除成功；SQLite中建表时声明的UNIQUE约束无法单独删除
+    """
+    table_name = StockDailyHQEntity.__tablename__
+    if UNIQUE_KEY_NAME not in describe_indexes()[table_name]:
+        return False
+    on_table = f" ON {table_name}" if get_storage_backend().name == 'mysql' else ''
+    try:
+        with get_engine().begin() as connection:
+            connection.execute(text(f"DROP INDEX {UNIQUE_KEY_NAME}{on_table}"))
+    except Exception as e:
+        print(f"无法删除唯一键 {table_name}.{UNIQUE_KEY_NAME}，索引前的日线表查询仍然使用该唯一键: {e}")
+        return False
+    print(f"已删除唯一键 {table_name}.{UNIQUE_KEY_NAME}，测量结束后重新添加")
+    return True
+
+
+def drop_declared_indexes():
+    """
+    删除实体中声明的普通索引以及日线表的唯一键，用于在已迁移的库上测量“索引前”的耗时
+
+    返回:
+    bool: 是否删除了日线表的唯一键
+    """
+    inspector = inspect(get_engine())
+    for entity in (StockDailyHQEntity, TempStockHQEntity):
+        table = entity.__table__
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                index.drop(bind=get_engine())
+                print(f"已删除索引 {table.name}.{index.name}")
+    return drop_daily_unique_key()
+
+
+def _print_indexes(label, described):
+    print(f"{label}的索引:")
+    for table_name, names in described.items():
+        print(f"  {table_name}: {', '.join(names) or '无'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='索引前后指标查询耗时对比')
+    parser.add_argument('--end-date', default=None, help='结束日期，格式为YYYYMMDD，默认使用临时表最新日期')
+    parser.add_argument('--repeat', type=int, default=3, help='每个查询重复执行的次数')
+    parser.add_argument('--drop-indexes', action='store_true', help='测量前先删除已有的声明索引和日线表唯一键')
+    args = parser.parse_args()
+
+    session = get_session()
+    end_date = args.end_date or get_end_date(session, TempStockHQEntity.trade_date, None).strftime('%Y%m%d')
+    cases = build_cases(session, end_date)
+
+    dropped_unique_key = drop_declared_indexes() if args.drop_indexes else False
+    # 不加--drop-indexes时，已迁移的库在两轮测量中都有索引，按实际存在的索引标注每一轮
+    before_indexes = describe_indexes()
+    before = time_cases(session, cases, args.repeat)
+    add_missing_indexes()
+    if dropped_unique_key:
+        add_daily_hq_unique_key()
+    after_indexes = describe_indexes()
+    after = time_cases(session, cases, args.repeat)
+
+    _print_indexes('\n第一轮（索引前）', before_indexes)
+    _print_indexes('第二轮（索引后）', after_indexes)
+    if before_indexes == after_indexes:
+        print("两轮测量的索引相同，耗时差异不代表索引的效果；请使用--drop-indexes测量完整的前后对比")
+    print(f"\n{'查询':<40}{'索引前(ms)':>12}{'索引后(ms)':>12}{'加速比':>10}")
+    for name, _ in cases:
+        speedup = before[name] / after[name] if after[name] > 0 else float('inf')
+        print(f"{name:<40}{before[name] * 1000:>12.1f}{after[name] * 1000:>12.1f}{speedup:>10.1f}x")
+
+
+if __name__ == '__main__':
+    main()
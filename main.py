@@ -2,12 +2,22 @@ import os
 import pandas as pd
 from src.service.stock_service import fetch_and_save_stock_basic_data, fetch_and_save_daily_trade_data, init_temp_stock_hq_data
 from src.service.stock_service import complete_stock_data
+from src.service.rps_service import backfill_stock_rps, update_stock_rps
 from src.db.database import initialize_database, get_connection
+from src.db.migrations import add_daily_hq_unique_key, add_missing_indexes
 
 
 # 初始化数据库
+# 默认连接本机MySQL，设置环境变量 STOCKS_DB_URL=sqlite:///data/stocks.db 即可改用嵌入式SQLite文件
 initialize_database()
 
+# 旧库升级：删除重复的日线记录并为日线表添加(ts_code, trade_date)唯一键，会删除数据，只需手动执行一次
+# 批量写入依赖该唯一键实现幂等更新，缺少唯一键时写入会直接报错并提示执行此迁移
+# add_daily_hq_unique_key()
+
+# 旧库升级：为日线表和临时表补充(ts_code, trade_date)和(trade_date, ts_code)索引，只需执行一次
+# add_missing_indexes()
+
 # 示例用法
 # 获取股票基本信息
 # fetch_and_save_stock_basic_data()
@@ -23,4 +33,11 @@ end_date = '20250321'    # 修改为你的结束日期
 # complete_stock_data(min_records=5, start_date=start_date, end_date=end_date)
 
 # 初始化临时表数据用于计算，规则是从日线表中对每一个股票选取n条记录，n默认为30
-init_temp_stock_hq_data(60)
+# incremental=True时只追加新交易日并淘汰窗口外的记录，已有记录与日线表不一致时自动改为全量重建
+init_temp_stock_hq_data(60, incremental=True)
+
+# 首次使用时从日线表回填全部历史RPS，只需执行一次
+# backfill_stock_rps()
+
+# 每日更新日线数据后，只计算最新交易日的RPS
+# update_stock_rps()
@@ -1,19 +1,28 @@
 from re import S
 from requests import get
 from src.indicators.rps import calculate_rps_indicator
-from src.db.database import session
+from src.db.database import get_session
 from src.indicators.ma import calculate_ma_indicator
-from src.indicators.ma import get_stock_ma_by_date
+from src.indicators.ma import get_stock_ma_by_date, get_stock_ma_by_dates
 from src.indicators.cross_ma import calculate_cross_ma_indicator
 from src.indicators.price_rise import calculate_price_rise_indicator
 from src.indicators.high_price import calculate_high_price_indicator
 from src.indicators.cross_ma_analysis import analyze_cross_ma_failure
 from src.analysis.rps_analysis import generate_rps_industry_report
 
-from src.strategy.trend_strategy import calculate_trend_strategy
+from src.strategy.trend_strategy import calculate_trend_strategy, calculate_trend_strategy_history
+from src.strategy.backtest import backtest_trend_strategy
+from src.strategy.sweep import sweep_trend_strategy
+from src.strategy.advanced_strategy import screen_stocks
+from src.panel.market_panel import MarketPanel
+from src.panel.snapshot import load_market_panel
+from src.indicators.registry import run_indicators
+from src.utils.result_cache import get_result_cache
 
 
 
+session = get_session()
+
 end_date = '20250321'    # 修改为你的结束日期
 rps_interval = 1
 rps_threshold = 90
@@ -27,6 +36,9 @@ generate_rps_industry_report(session=session, end_date=end_date, rps_interval=rp
 
 # get_stock_ma_by_date(session=session,end_date=end_date,ts_code='002105.SZ')
 
+# 自选股批量查询均线：一次查询返回所有(股票, 交易日)组合，只输出一个CSV文件
+# get_stock_ma_by_dates(session=session, ts_codes=['002105.SZ', '000001.SZ'], dates=['20250320', end_date])
+
 # calculate_cross_ma_indicator(session=session,end_date=end_date,lookback_days=3)
 
 
@@ -38,3 +50,26 @@ generate_rps_industry_report(session=session, end_date=end_date, rps_interval=rp
 
 # analyze_cross_ma_failure(session=session,ts_code='002105.SZ',end_date=end_date,lookback_days=4)
 
+# 一次性加载临时表面板，各指标的 *_from_panel 版本只做内存计算，不再重复查询数据库
+# panel = MarketPanel.load(session)
+# 临时表未变化时直接内存映射init_temp_stock_hq_data生成的快照
+# panel = load_market_panel(session)
+# calculate_trend_strategy(session=session, end_date=end_date, panel=panel)
+
+# 通过指标注册表一次加载所需数据并并行运行多个指标，按需增删列表中的指标，结果以指标名称为键
+# results = run_indicators(session, end_date, ['rps', 'ma', 'cross_ma', 'high_price', ('price_rise', {'rise_interval': 60, 'min_rise': 20, 'max_rise': 40})])
+
+# 调整阈值反复生成报告时复用缓存的指标结果，数据未更新时不再查询数据库
+# cache = get_result_cache()
+# generate_rps_industry_report(session=session, end_date=end_date, rps_interval=rps_interval, rps_threshold=rps_threshold, cache=cache)
+# calculate_trend_strategy(session=session, end_date=end_date, cache=cache)
+# 临时表中每个交易日的趋势策略选股及与前一交易日相比的新入选和移出，一次计算
+# calculate_trend_strategy_history(session=session, end_date=end_date)
+# results = run_indicators(session, end_date, ['rps', 'ma', 'cross_ma', 'high_price'], cache=cache)
+
+# 趋势策略历史回测：一次加载日线面板，整面板计算每日选股并按持有规则模拟交易
+# backtest_trend_strategy(session=session, start_date='20220101', end_date=end_date, hold_days=5, stop_loss=8, take_profit=20)
+# sweep_trend_strategy(session=session, grid={'rps_interval': [3, 5, 10], 'rps_threshold': [85, 90, 95], 'hold_days': [5, 10]}, start_date='20220101', end_date=end_date)
+
+# 选股表达式：多个表达式共用一次面板加载，公共的条件只计算一次
+# screen_stocks(session, {'trend': 'rps(3) >= 90 & bull_ma & cross_ma(4) & new_high(60)', 'pullback': 'rps(20) >= 90 & bull_ma & crossed(close, ma10, within=4) & ~new_high(60)'}, end_date=end_date)
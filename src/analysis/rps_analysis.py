@@ -2,12 +2,15 @@ import os
 import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
-from src.indicators.rps import calculate_rps_indicator
+from src.entities.stock_rps import StockRPSEntity
+from src.entities.temp_stock_hq import TempStockHQEntity
+from src.indicators.rps import calculate_rps_indicator, calculate_rps_indicator_from_table
+from src.utils.data_processing import get_data_version
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
-def generate_rps_industry_report(session, end_date, rps_interval=3, rps_threshold=90, use_pre_close=True):
+def generate_rps_industry_report(session, end_date, rps_interval=3, rps_threshold=90, use_pre_close=True, use_rps_table=False, cache=None):
     """
     Generate an HTML report analyzing RPS data by industry.
     
@@ -17,12 +20,30 @@ def generate_rps_industry_report(session, end_date, rps_interval=3, rps_threshol
         rps_interval: Interval in days
         rps_threshold: RPS threshold percentage
         use_pre_close: If True, use end.close - start.pre_close for calculation; otherwise use default calculation
+        use_rps_table: If True, read the persisted RPS from t_stock_rps instead of recalculating
+        cache: Optional ResultCache; when the source table's data version is unchanged, the RPS results
+            for the same parameters are reused instead of being queried again
         
     Returns:
         Path to the generated HTML report
     """
     # Get RPS data using the existing function with modified calculation method
-    rps_results = calculate_rps_indicator(session, end_date, rps_interval, rps_threshold, use_pre_close=use_pre_close)
+    if use_rps_table:
+        compute = lambda: calculate_rps_indicator_from_table(session, end_date, rps_interval, rps_threshold, use_pre_close=use_pre_close)
+    else:
+        compute = lambda: calculate_rps_indicator(session, end_date, rps_interval, rps_threshold, use_pre_close=use_pre_close)
+    if cache is not None:
+        if use_rps_table:
+            # t_stock_rps is upserted, so recomputing or backfilling existing dates changes rps values
+            # without changing the latest date or row count; the rps checksum catches those rewrites
+            data_version = get_data_version(session, StockRPSEntity, [StockRPSEntity.rps])
+        else:
+            data_version = get_data_version(session, TempStockHQEntity)
+        params = {'rps_interval': rps_interval, 'rps_threshold': rps_threshold,
+                  'use_pre_close': use_pre_close, 'use_rps_table': use_rps_table}
+        rps_results = cache.get_or_compute('rps_report', params, end_date, data_version, compute)
+    else:
+        rps_results = compute()
     
     # Convert to DataFrame for easier manipulation - use only the columns that are actually returned
     df = pd.DataFrame(rps_results, columns=['股票代码', '股票名称', '区间涨跌幅', 'RPS值', '所属行业'])
@@ -0,0 +1,160 @@
+import os
+from abc import ABC, abstractmethod
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+class StorageBackend(ABC):
+    """
+    存储后端的差异点：建库、引擎参数、清空表和upsert语句
+    其余查询均使用MySQL和SQLite都支持的标准SQL（CTE、窗口函数等）
+    子类必须实现upsert_sql，未实现的后端在创建时即报错
+
+    参数:
+    url: SQLAlchemy数据库连接URL
+    """
+    name = None
+
+    def __init__(self, url):
+        self.url = make_url(url)
+
+    def prepare(self):
+        """
+        创建引擎之前的准备工作（如创建数据库）
+        """
+
+    def engine_options(self, settings):
+        """
+        根据数据库配置返回create_engine的参数
+        """
+        return {'echo': settings['echo'], 'future': True}
+
+    def configure_engine(self, engine):
+        """
+        引擎创建之后的额外配置
+        """
+
+    def truncate_table_sql(self, table_name):
+        """
+        返回清空表的SQL
+        """
+        return f"DELETE FROM {table_name}"
+
+    @abstractmethod
+    def upsert_sql(self, table_name, columns, key_columns, quote):
+        """
+        返回使用:列名占位符的批量upsert语句
+
+        参数:
+        table_name: 表名
+        columns: 写入的列名列表
+        key_columns: 唯一键列，冲突时更新其余列；为空时退化为普通INSERT
+        quote: 标识符转义函数
+        """
+
+    @staticmethod
+    def _insert_sql(table_name, columns, quote):
+        quoted_columns = ', '.join(quote(col) for col in columns)
+        placeholders = ', '.join(f":{col}" for col in columns)
+        return f"INSERT INTO {quote(table_name)} ({quoted_columns}) VALUES ({placeholders})"
+
+
+class MySQLBackend(StorageBackend):
+    """
+    MySQL服务端存储
+    """
+    name = 'mysql'
+
+    def prepare(self):
+        import pymysql
+        connection = pymysql.connect(
+            host=self.url.host or '127.0.0.1',
+            port=self.url.port or 3306,
+            user=self.url.username,
+            password=self.url.password or '',
+            charset='utf8mb4',
+        )
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{self.url.database}`")
+            connection.commit()
+        finally:
+            connection.close()
+
+    def engine_options(self, settings):
+        options = super().engine_options(settings)
+        options.update(
+            pool_size=settings['pool_size'],
+            max_overflow=settings['max_overflow'],
+            pool_recycle=settings['pool_recycle'],
+            pool_pre_ping=settings['pool_pre_ping'],
+        )
+        return options
+
+    def truncate_table_sql(self, table_name):
+        return f"TRUNCATE TABLE {table_name}"
+
+    def upsert_sql(self, table_name, columns, key_columns, quote):
+        update_columns = [col for col in columns if col not in key_columns] or list(columns)
+        update_clause = ', '.join(f"{quote(col)} = VALUES({quote(col)})" for col in update_columns)
+        return f"{self._insert_sql(table_name, columns, quote)} ON DUPLICATE KEY UPDATE {update_clause}"
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    嵌入式SQLite文件存储，不需要数据库服务即可运行全部指标
+    """
+    name = 'sqlite'
+
+    def prepare(self):
+        database = self.url.database
+        if database and database != ':memory:':
+            directory = os.path.dirname(os.path.abspath(database))
+            os.makedirs(directory, exist_ok=True)
+
+    def engine_options(self, settings):
+        options = super().engine_options(settings)
+        # 数据获取使用多线程写入，连接需要允许跨线程使用
+        options['connect_args'] = {'check_same_thread': False, 'timeout': 60}
+        if self.url.database and self.url.database != ':memory:':
+            options.update(pool_size=settings['pool_size'], max_overflow=settings['max_overflow'])
+        return options
+
+    def configure_engine(self, engine):
+        @event.listens_for(engine, 'connect')
+        def _set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            # WAL模式下读写互不阻塞，批量写入时性能也更好
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+    def upsert_sql(self, table_name, columns, key_columns, quote):
+        insert_sql = self._insert_sql(table_name, columns, quote)
+        if not key_columns:
+            return insert_sql
+        update_columns = [col for col in columns if col not in key_columns]
+        conflict_columns = ', '.join(quote(col) for col in key_columns)
+        if not update_columns:
+            return f"{insert_sql} ON CONFLICT ({conflict_columns}) DO NOTHING"
+        update_clause = ', '.join(f"{quote(col)} = excluded.{quote(col)}" for col in update_columns)
+        return f"{insert_sql} ON CONFLICT ({conflict_columns}) DO UPDATE SET {update_clause}"
+
+
+BACKENDS = {
+    MySQLBackend.name: MySQLBackend,
+    SQLiteBackend.name: SQLiteBackend,
+}
+
+
+def get_backend(url):
+    """
+    根据URL的方言选择存储后端
+
+    参数:
+    url: SQLAlchemy数据库连接URL，例如 mysql+pymysql://... 或 sqlite:///data/stocks.db
+    """
+    backend_name = make_url(url).get_backend_name()
+    if backend_name not in BACKENDS:
+        raise ValueError(f"不支持的数据库类型 '{backend_name}'，可选值为: {', '.join(BACKENDS)}")
+    return BACKENDS[backend_name](url)
@@ -0,0 +1,81 @@
+from sqlalchemy import inspect, text
+from src.db.database import get_engine
+from src.entities.stock_daily_hq import StockDailyHQEntity
+from src.entities.temp_stock_hq import TempStockHQEntity
+
+
+def remove_duplicate_daily_hq_rows():
+    """
+    删除日线表中(ts_code, trade_date)重复的记录，每组只保留id最大（最后写入）的一条
+
+    返回:
+    删除的记录数
+    """
+    table_name = StockDailyHQEntity.__tablename__
+    # 外层再包一层派生表，MySQL才允许在DELETE的子查询中引用同一张表
+    query = f"""
+    DELETE FROM {table_name}
+    WHERE id NOT IN (
+        SELECT id FROM (
+            SELECT MAX(id) as id FROM {table_name} GROUP BY ts_code, trade_date
+        ) keep_rows
+    )
+    """
+    with get_engine().begin() as connection:
+        result = connection.execute(text(query))
+    print(f"已删除 {table_name} 中 {result.rowcount} 条重复记录")
+    return result.rowcount
+
+
+def add_daily_hq_unique_key():
+    """
+    为已存在的日线表补充(ts_code, trade_date)唯一键，添加前先清理重复记录
+    create_all不会修改已存在的表，旧库升级时需要执行一次
+    """
+    table_name = StockDailyHQEntity.__tablename__
+    inspector = inspect(get_engine())
+    if not inspector.has_table(table_name):
+        print(f"表 {table_name} 不存在，跳过")
+        return False
+
+    # MySQL把唯一索引当作唯一约束返回，SQLite则只出现在索引列表中
+    existing = {constraint['name'] for constraint in inspector.get_unique_constraints(table_name)}
+    existing.update(index['name'] for index in inspector.get_indexes(table_name) if index.get('unique'))
+    if 'uk_daily_hq_code_date' in existing:
+        print(f"表 {table_name} 已存在唯一键 uk_daily_hq_code_date")
+        return False
+
+    remove_duplicate_daily_hq_rows()
+    with get_engine().begin() as connection:
+        connection.execute(text(
+            f"CREATE UNIQUE INDEX uk_daily_hq_code_date ON {table_name} (ts_code, trade_date)"
+        ))
+    print(f"已为表 {table_name} 添加唯一键 uk_daily_hq_code_date")
+    return True
+
+
+def add_missing_indexes(entities=(StockDailyHQEntity, TempStockHQEntity)):
+    """
+    为已存在的表补充实体中声明但数据库中缺失的索引
+
+    参数:
+    entities: 需要检查的实体类列表，默认为日线表和临时表
+
+    返回:
+    list: 新创建的索引名列表
+    """
+    inspector = inspect(get_engine())
+    created = []
+    for entity in entities:
+        table = entity.__table__
+        if not inspector.has_table(table.name):
+            print(f"表 {table.name} 不存在，跳过")
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            index.create(bind=get_engine())
+            created.append(index.name)
+            print(f"已为表 {table.name} 创建索引 {index.name}")
+    return created
@@ -1,8 +1,14 @@
-from sqlalchemy import Column, String, Float, Integer, Date, VARCHAR
+from sqlalchemy import Column, String, Float, Integer, Date, VARCHAR, UniqueConstraint, Index
 from src.entities.base import Base
 
 class StockDailyHQEntity(Base):
     __tablename__ = 't_stock_daily_hq'
+    __table_args__ = (
+        # 每只股票每个交易日只保留一条记录，批量写入时依赖该唯一键实现幂等更新
+        UniqueConstraint('ts_code', 'trade_date', name='uk_daily_hq_code_date'),
+        # 按交易日筛选全市场数据（RPS自连接、MAX(trade_date)等）
+        Index('idx_daily_hq_date_code', 'trade_date', 'ts_code'),
+    )
     
     # 自增ID
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Float, Integer, Date, VARCHAR, UniqueConstraint, Index
+from src.entities.base import Base
+
+class StockRPSEntity(Base):
+    __tablename__ = 't_stock_rps'
+    __table_args__ = (
+        # 每只股票每个交易日、每个周期和计算方式只保留一条记录，增量更新时依赖该唯一键实现幂等写入
+        UniqueConstraint('ts_code', 'trade_date', 'rps_interval', 'method', name='uk_stock_rps'),
+        # 按交易日和周期筛选全市场的RPS排名
+        Index('idx_stock_rps_date_interval', 'trade_date', 'rps_interval', 'method', 'rps'),
+    )
+    
+    # 自增ID
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    
+    # 股票代码
+    ts_code = Column(VARCHAR(20))
+    
+    # 交易日期（RPS统计区间的结束日期）
+    trade_date = Column(Date)
+    
+    # RPS统计周期（交易日数）
+    rps_interval = Column(Integer)
+    
+    # 计算方式：open为区间首日开盘价，pre_close为区间首日前收盘价
+    method = Column(VARCHAR(20))
+    
+    # 区间涨跌幅（%）
+    price_change = Column(Float)
+    
+    # RPS值
+    rps = Column(Float)
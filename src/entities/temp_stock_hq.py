@@ -1,8 +1,14 @@
-from sqlalchemy import Column, String, Float, Integer, Date, VARCHAR
+from sqlalchemy import Column, String, Float, Integer, Date, VARCHAR, Index
 from src.entities.base import Base
 
 class TempStockHQEntity(Base):
     __tablename__ = 'temp_stock_hq'
+    __table_args__ = (
+        # 按股票取时间序列（窗口函数、GROUP BY ts_code）
+        Index('idx_temp_hq_code_date', 'ts_code', 'trade_date'),
+        # 按交易日筛选全市场数据（RPS自连接、MAX(trade_date)等）
+        Index('idx_temp_hq_date_code', 'trade_date', 'ts_code'),
+    )
     
     # 自增ID
     id = Column(Integer, primary_key=True, autoincrement=True)
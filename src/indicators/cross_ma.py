@@ -1,9 +1,11 @@
 import os
+import numpy as np
 import pandas as pd
 from sqlalchemy import text
 from src.entities.temp_stock_hq import TempStockHQEntity
 from src.entities.stock_entity import StockEntity
-from src.utils.data_processing import get_end_date
+from src.indicators.result import IndicatorResult
+from src.utils.data_processing import get_end_date, to_sql_date
 
 def calculate_cross_ma_indicator(session, end_date, lookback_days=3):
     """
@@ -40,7 +42,7 @@ def calculate_cross_ma_indicator(session, end_date, lookback_days=3):
     """
     
     result = session.execute(text(sql), {
-        'end_date': end_date,
+        'end_date': to_sql_date(end_date),
         'lookback_days': lookback_days
     }).fetchall()
     
@@ -105,20 +107,140 @@ def calculate_cross_ma_indicator(session, end_date, lookback_days=3):
         
         # 整理输出数据
         output_data = []
-        for ts_code, cross_count in cross_ma_stocks:
+        for ts_code, crossed in cross_ma_stocks:
             name, industry = code_info_map.get(ts_code, ('', ''))
             pure_code = ts_code.split('.')[0]
-            output_data.append((pure_code, name, crossed_ma, industry))
+            output_data.append((pure_code, name, crossed, industry))
         
-        # 创建输出目录
-        output_dir = os.path.join(os.getcwd(), 'res')
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # 输出结果到CSV文件
-        df = pd.DataFrame(output_data, columns=['股票代码', '股票名称', '上穿均线', '所属行业'])
-        output_file = os.path.join(output_dir, f"{end_date}-cross-ma.csv")
-        df.to_csv(output_file, index=False, encoding='utf-8-sig')
+        _write_cross_ma_csv(output_data, end_date)
         
         return output_data
     
-    return []
\ No newline at end of file
+    return []
+
+def _write_cross_ma_csv(output_data, end_date):
+    # 创建输出目录
+    output_dir = os.path.join(os.getcwd(), 'res')
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # 输出结果到CSV文件
+    df = pd.DataFrame(output_data, columns=['股票代码', '股票名称', '上穿均线', '所属行业'])
+    output_file = os.path.join(output_dir, f"{end_date}-cross-ma.csv")
+    df.to_csv(output_file, index=False, encoding='utf-8-sig')
+
+# 默认检测的交叉组合：(快线字段, 慢线字段)
+DEFAULT_CROSS_PAIRS = [('close', 'ma5'), ('close', 'ma10'), ('ma5', 'ma10'), ('ma5', 'ma20'), ('ma10', 'ma20')]
+
+def cross_signals(fast, slow, direction='up'):
+    """
+    用错位数组比较检测交叉：前一日快线在慢线下方、当日在上方为上穿，反之为下穿（NaN比较结果为False）
+    
+    参数:
+    fast: 快线，形状为(股票数, 交易日数)
+    slow: 慢线，形状与fast相同
+    direction: 'up'为上穿（金叉），'down'为下穿（死叉）
+    
+    返回:
+    形状为(股票数, 交易日数-1)的布尔数组，第j列表示第j+1个交易日是否发生交叉
+    """
+    with np.errstate(invalid='ignore'):
+        if direction == 'up':
+            return (fast[:, :-1] < slow[:, :-1]) & (fast[:, 1:] > slow[:, 1:])
+        if direction == 'down':
+            return (fast[:, :-1] > slow[:, :-1]) & (fast[:, 1:] < slow[:, 1:])
+    raise ValueError(f"不支持的交叉方向 '{direction}'，请使用 'up' 或 'down'")
+
+def detect_crosses(panel, end_date=None, lookback_days=3, pairs=DEFAULT_CROSS_PAIRS, directions=('up',)):
+    """
+    检测全市场在回看期内任意价格/均线组合的交叉，窗口内第一天只作为比较基准，与calculate_cross_ma_indicator一致
+    
+    参数:
+    panel: 包含pairs中各字段的MarketPanel
+    end_date: 结束日期，为空时使用面板中最新日期
+    lookback_days: 回看的天数
+    pairs: (快线字段, 慢线字段)列表，例如('close', 'ma5')或('ma5', 'ma10')
+    directions: 检测的交叉方向，'up'和/或'down'
+    
+    返回:
+    DataFrame: 每次交叉一行，包含ts_code, name, industry, fast, slow, direction, trade_date列，
+               按股票代码和交易日排序
+    """
+    end_pos = panel.date_position(end_date)
+    start_pos = panel.window_start(end_pos, lookback_days)
+    window = slice(start_pos, end_pos + 1)
+    exclude_mask = panel.exclude_mask()[:, np.newaxis]
+    
+    # 先只收集整数下标，最后一次性转换为代码、名称和日期
+    rows, days, pair_ids, direction_ids = [], [], [], []
+    for pair_id, (fast_field, slow_field) in enumerate(pairs):
+        fast, slow = panel[fast_field][:, window], panel[slow_field][:, window]
+        for direction_id, direction in enumerate(directions):
+            cross_rows, cross_days = np.nonzero(cross_signals(fast, slow, direction) & exclude_mask)
+            rows.append(cross_rows)
+            days.append(cross_days)
+            pair_ids.append(np.full(len(cross_rows), pair_id))
+            direction_ids.append(np.full(len(cross_rows), direction_id))
+    columns = ['ts_code', 'name', 'industry', 'fast', 'slow', 'direction', 'trade_date']
+    if not rows:
+        return pd.DataFrame(columns=columns)
+    
+    rows, days = np.concatenate(rows), np.concatenate(days)
+    pair_ids, direction_ids = np.concatenate(pair_ids), np.concatenate(direction_ids)
+    order = np.lexsort((days, rows))
+    rows, days, pair_ids, direction_ids = rows[order], days[order], pair_ids[order], direction_ids[order]
+    return pd.DataFrame({
+        'ts_code': panel.codes[rows].astype(str),
+        'name': panel.stock_info['name'].values[rows],
+        'industry': panel.stock_info['industry'].values[rows],
+        'fast': np.array([pair[0] for pair in pairs], dtype=object)[pair_ids],
+        'slow': np.array([pair[1] for pair in pairs], dtype=object)[pair_ids],
+        'direction': np.array(directions, dtype=object)[direction_ids],
+        'trade_date': panel.dates[start_pos + 1 + days],
+    }, columns=columns)
+
+def calculate_cross_ma_result(panel, end_date, lookback_days=3):
+    """
+    基于行情面板筛选指定周期内股价上穿MA5或MA10的股票
+    
+    参数:
+    panel: 包含close、ma5和ma10字段的MarketPanel
+    end_date: 结束日期，为空时使用面板中最新日期
+    lookback_days: 回看的天数
+    
+    返回:
+    IndicatorResult: 名称为'cross_ma'，包含cross_ma5、cross_ma10（布尔）和crossed（如'MA5,MA10'）列
+    """
+    end_pos = panel.date_position(end_date)
+    start_pos = panel.window_start(end_pos, lookback_days)
+    window = slice(start_pos, end_pos + 1)
+    close, ma5, ma10 = panel['close'][:, window], panel['ma5'][:, window], panel['ma10'][:, window]
+    
+    # 上穿MA10时还要求当日收盘在MA5之上
+    cross_ma5 = cross_signals(close, ma5)
+    with np.errstate(invalid='ignore'):
+        cross_ma10 = cross_signals(close, ma10) & (close[:, 1:] > ma5[:, 1:])
+    # 至少需要两天的数据来判断上穿
+    enough_rows = (~np.isnan(close)).sum(axis=1) >= 2
+    has_ma5 = cross_ma5.any(axis=1) & enough_rows & panel.exclude_mask()
+    has_ma10 = cross_ma10.any(axis=1) & enough_rows & panel.exclude_mask()
+    
+    rows = np.flatnonzero(has_ma5 | has_ma10)
+    crossed = np.where(has_ma5[rows] & has_ma10[rows], 'MA5,MA10', np.where(has_ma5[rows], 'MA5', 'MA10'))
+    values = {'cross_ma5': has_ma5[rows], 'cross_ma10': has_ma10[rows], 'crossed': crossed.astype(object)}
+    return IndicatorResult.from_panel('cross_ma', panel, rows, values, panel.trade_date(end_pos), {'lookback_days': lookback_days})
+
+def calculate_cross_ma_indicator_from_panel(panel, end_date, lookback_days=3):
+    """
+    基于行情面板计算股价在指定周期内上穿MA5或MA10的指标，不访问数据库
+    
+    参数:
+    panel: 包含close、ma5和ma10字段的MarketPanel
+    end_date: 结束日期，为空时使用面板中最新日期
+    lookback_days: 回看的天数
+    """
+    result = calculate_cross_ma_result(panel, end_date, lookback_days)
+    output_data = result.to_rows(['code', 'name', 'crossed', 'industry'])
+    
+    if output_data:
+        _write_cross_ma_csv(output_data, end_date or result.end_date)
+    return output_data
@@ -1,6 +1,6 @@
 from sqlalchemy import text
 from ..entities.temp_stock_hq import TempStockHQEntity
-from ..utils.data_processing import get_end_date
+from ..utils.data_processing import get_end_date, to_sql_date
 import os
 
 def analyze_cross_ma_failure(session, ts_code, end_date, lookback_days=3):
@@ -39,7 +39,7 @@ def analyze_cross_ma_failure(session, ts_code, end_date, lookback_days=3):
     """
     
     result = session.execute(text(sql), {
-        'end_date': end_date,
+        'end_date': to_sql_date(end_date),
         'lookback_days': lookback_days,
         'ts_code': ts_code
     }).fetchall()
@@ -1,9 +1,11 @@
 from sqlalchemy import text
 import os
+import numpy as np
 import pandas as pd
 from src.entities.stock_entity import StockEntity
+from src.indicators.result import IndicatorResult
 from src.entities.temp_stock_hq import TempStockHQEntity
-from src.utils.data_processing import get_end_date, get_trade_date_list
+from src.utils.data_processing import get_end_date, get_trade_date_list, to_sql_date
 
 def calculate_high_price_indicator(session, end_date, interval):
     """计算指定周期内收盘价创新高的股票
@@ -39,7 +41,7 @@ def calculate_high_price_indicator(session, end_date, interval):
     
     high_result = session.execute(
         text(high_sql),
-        {'start_date': start_date, 'end_date': end_date, 'exclude_pattern': '%BJ%'}
+        {'start_date': to_sql_date(start_date), 'end_date': to_sql_date(end_date), 'exclude_pattern': '%BJ%'}
     ).fetchall()
     
     # 获取股票基本信息
@@ -54,6 +56,10 @@ def calculate_high_price_indicator(session, end_date, interval):
         pure_code = ts_code.split('.')[0]
         high_output.append((pure_code, name, close, industry))
     
+    _write_high_price_csv(high_output, end_date, interval)
+    return high_output
+
+def _write_high_price_csv(high_output, end_date, interval):
     # 创建输出目录
     output_dir = os.path.join(os.getcwd(), 'res')
     os.makedirs(output_dir, exist_ok=True)
@@ -65,4 +71,105 @@ def calculate_high_price_indicator(session, end_date, interval):
     )
     output_file = os.path.join(output_dir, f"{end_date}-high-price-{interval}days.csv")
     df.to_csv(output_file, index=False, encoding='utf-8-sig')
-    return high_output
\ No newline at end of file
+
+# 新高检测默认使用的周期
+HIGH_WINDOWS = [20, 60, 120, 250]
+
+def detect_highs(panel, end_date=None, windows=HIGH_WINDOWS, near_pct=5.0, consolidation_days=20, consolidation_range=15.0,
+                 partial_windows=False):
+    """基于行情面板一次计算多个周期的新高、接近新高、距最高点天数以及平台突破
+    
+    对最长周期的收盘价窗口倒序做一次np.fmax.accumulate，第k列即为最近k+1个交易日的最高价，
+    各周期的最高价都从这一次累积中取得；周期超过面板中截至结束日期的交易日数时，
+    该周期的high、pct_from_high和days_since_high为NaN，new_high和near_high为False
+    
+    参数:
+    panel: 包含close字段的MarketPanel
+    end_date: 结束日期，为空时使用面板中最新日期
+    windows: 周期列表
+    near_pct: 收盘价距周期最高价在该百分比以内视为接近新高
+    consolidation_days: 平台整理的天数（不含当日）
+    consolidation_range: 平台期内最高价相对最低价的最大振幅（%）
+    partial_windows: 为True时周期超过面板长度也按面板内的数据计算，与calculate_high_price_indicator的SQL一致
+    
+    返回:
+    DataFrame: 每只当日有收盘价的股票一行，包含ts_code, name, industry, close，每个周期n的
+               high_n, pct_from_high_n, new_high_n, near_high_n, days_since_high_n列，
+               以及breakout（收盘价突破平台期最高价且平台振幅不超过consolidation_range）
+    """
+    end_pos = panel.date_position(end_date)
+    longest = max(max(windows), consolidation_days + 1)
+    start_pos = panel.window_start(end_pos, longest)
+    # 倒序后第0列为结束日期
+    recent = panel['close'][:, start_pos:end_pos + 1][:, ::-1]
+    rows = np.flatnonzero(panel.exclude_mask() & ~np.isnan(recent[:, 0]))
+    recent = recent[rows]
+    close = recent[:, 0]
+    running_max = np.fmax.accumulate(recent, axis=1)
+    
+    result = pd.DataFrame({
+        'ts_code': panel.codes[rows].astype(str),
+        'name': panel.stock_info['name'].values[rows],
+        'industry': panel.stock_info['industry'].values[rows],
+        'close': close,
+    })
+    with np.errstate(invalid='ignore'):
+        for window in windows:
+            if window > end_pos + 1 and not partial_windows:
+                # 面板中的历史不足一个周期，不能把较短周期的结果当作该周期的结果
+                result[f'high_{window}'] = np.nan
+                result[f'pct_from_high_{window}'] = np.nan
+                result[f'new_high_{window}'] = False
+                result[f'near_high_{window}'] = False
+                result[f'days_since_high_{window}'] = np.nan
+                continue
+            length = min(window, recent.shape[1])
+            high = running_max[:, length - 1]
+            pct_from_high = (close / high - 1) * 100
+            result[f'high_{window}'] = high
+            result[f'pct_from_high_{window}'] = pct_from_high
+            result[f'new_high_{window}'] = close == high
+            result[f'near_high_{window}'] = pct_from_high >= -near_pct
+            # 最近一次达到周期最高价距今的交易日数
+            result[f'days_since_high_{window}'] = np.argmax(recent[:, :length] == high[:, np.newaxis], axis=1)
+        
+        platform = recent[:, 1:consolidation_days + 1]
+        enough_days = (~np.isnan(platform)).sum(axis=1) >= consolidation_days
+        platform_high = np.fmax.reduce(platform, axis=1) if platform.shape[1] else np.full(len(rows), np.nan)
+        platform_low = np.fmin.reduce(platform, axis=1) if platform.shape[1] else np.full(len(rows), np.nan)
+        platform_range = (platform_high / platform_low - 1) * 100
+        result['breakout'] = enough_days & (close > platform_high) & (platform_range <= consolidation_range)
+    return result
+
+def calculate_high_price_result(panel, end_date, interval):
+    """基于行情面板筛选指定周期内收盘价创新高的股票
+    
+    参数:
+    panel: 包含close字段的MarketPanel
+    end_date: 结束日期，为空时使用面板中最新日期
+    interval: 周期天数
+    
+    返回:
+    IndicatorResult: 名称为'high_price'，包含close和high列
+    """
+    end_pos = panel.date_position(end_date)
+    # 与SQL版本一致，面板不足一个周期时按已有的交易日计算
+    frame = detect_highs(panel, end_date, [interval], partial_windows=True)
+    frame = frame[frame[f'new_high_{interval}']].rename(columns={f'high_{interval}': 'high'})
+    frame[['name', 'industry']] = frame[['name', 'industry']].fillna('')
+    return IndicatorResult.from_frame('high_price', frame[['ts_code', 'name', 'industry', 'close', 'high']],
+                                      panel.trade_date(end_pos), {'interval': interval})
+
+def calculate_high_price_indicator_from_panel(panel, end_date, interval):
+    """基于行情面板计算指定周期内收盘价创新高的股票，不访问数据库
+    
+    参数:
+    panel: 包含close字段的MarketPanel
+    end_date: 结束日期，为空时使用面板中最新日期
+    interval: 周期天数
+    """
+    result = calculate_high_price_result(panel, end_date, interval)
+    high_output = result.to_rows(['code', 'name', 'close', 'industry'])
+    
+    _write_high_price_csv(high_output, end_date or result.end_date, interval)
+    return high_output
@@ -1,9 +1,11 @@
 import os
+import numpy as np
 import pandas as pd
-from sqlalchemy import text
+from sqlalchemy import text, bindparam
 from src.entities.temp_stock_hq import TempStockHQEntity
 from src.entities.stock_entity import StockEntity
-from src.utils.data_processing import get_end_date
+from src.indicators.result import IndicatorResult
+from src.utils.data_processing import get_end_date, to_sql_date, parse_date
 
 def calculate_ma_indicator(session, end_date, ma_interval):
     # 处理日期格式
@@ -27,7 +29,7 @@ def calculate_ma_indicator(session, end_date, ma_interval):
       AND COALESCE(ma20, 0) >= COALESCE(ma30, 0)
       AND COALESCE(ma30, 0) >= COALESCE(ma120, 0)
     '''
-    ma_result = session.execute(text(ma_sql), {'end_date': end_date}).fetchall()
+    ma_result = session.execute(text(ma_sql), {'end_date': to_sql_date(end_date)}).fetchall()
     
     code_list = [value[0] for value in ma_result]
     base_entity_list = session.query(StockEntity).filter(StockEntity.ts_code.in_(code_list)).all()
@@ -42,14 +44,61 @@ def calculate_ma_indicator(session, end_date, ma_interval):
         pure_code = ts_code.split('.')[0]
         ma_output.append((pure_code, name, close, ma5, ma10, ma20, ma30, ma60, ma120, industry))
     
+    _write_ma_csv(ma_output, f"{end_date}-ma.csv")
+    
+    return ma_output
+
+
+def _write_ma_csv(ma_output, file_name):
     # 创建输出目录
     output_dir = os.path.join(os.getcwd(), 'res')
     os.makedirs(output_dir, exist_ok=True)
     
     # 输出结果到CSV文件
     df = pd.DataFrame(ma_output, columns=['股票代码', '股票名称', '收盘价', 'MA5', 'MA10', 'MA20', 'MA30', 'MA60', 'MA120', '所属行业'])
-    output_file = os.path.join(output_dir, f"{end_date}-ma.csv")
+    output_file = os.path.join(output_dir, file_name)
     df.to_csv(output_file, index=False, encoding='utf-8-sig')
+
+
+def calculate_ma_result(panel, end_date, ma_interval):
+    """
+    基于行情面板筛选均线多头排列的股票，与calculate_ma_indicator的筛选条件一致
+    
+    参数:
+    panel: 包含close和ma5~ma120字段的MarketPanel
+    end_date: 结束日期，为空时使用面板中最新日期
+    ma_interval: 保留参数，与calculate_ma_indicator保持一致
+    
+    返回:
+    IndicatorResult: 名称为'ma'，包含close和ma5~ma120列
+    """
+    end_pos = panel.date_position(end_date)
+    close = panel['close'][:, end_pos]
+    # 与SQL中的COALESCE(maN, 0)一致，缺失的均线按0处理
+    ma = {n: np.nan_to_num(panel[f'ma{n}'][:, end_pos], nan=0.0) for n in (5, 10, 20, 30, 60, 120)}
+    
+    with np.errstate(invalid='ignore'):
+        mask = (panel.exclude_mask() & (close > ma[5]) & (ma[5] >= ma[10]) & (ma[10] >= ma[20])
+                & (ma[20] >= ma[30]) & (ma[30] >= ma[120]))
+    
+    rows = np.flatnonzero(mask)
+    values = {'close': close[rows]}
+    values.update({f'ma{n}': ma[n][rows] for n in ma})
+    return IndicatorResult.from_panel('ma', panel, rows, values, panel.trade_date(end_pos), {'ma_interval': ma_interval})
+
+def calculate_ma_indicator_from_panel(panel, end_date, ma_interval):
+    """
+    基于行情面板计算均线多头排列指标，与calculate_ma_indicator的筛选条件一致，不访问数据库
+    
+    参数:
+    panel: 包含close和ma5~ma120字段的MarketPanel
+    end_date: 结束日期，为空时使用面板中最新日期
+    ma_interval: 保留参数，与calculate_ma_indicator保持一致
+    """
+    result = calculate_ma_result(panel, end_date, ma_interval)
+    ma_output = result.to_rows(['code', 'name', 'close', 'ma5', 'ma10', 'ma20', 'ma30', 'ma60', 'ma120', 'industry'])
+    
+    _write_ma_csv(ma_output, f"{end_date or result.end_date}-ma.csv")
     
     return ma_output
 
@@ -72,7 +121,7 @@ def get_stock_ma_by_date(session, ts_code, end_date):
       AND ts_code = :ts_code
       AND ts_code NOT LIKE '%BJ%'
     '''
-    ma_result = session.execute(text(ma_sql), {'end_date': end_date, 'ts_code': ts_code}).fetchone()
+    ma_result = session.execute(text(ma_sql), {'end_date': to_sql_date(end_date), 'ts_code': ts_code}).fetchone()
     
     if ma_result is None:
         return None
@@ -85,17 +134,11 @@ def get_stock_ma_by_date(session, ts_code, end_date):
     # 提取纯数字代码
     pure_code = ts_code.split('.')[0]
     
-    # 创建输出目录
-    output_dir = os.path.join(os.getcwd(), 'res')
-    os.makedirs(output_dir, exist_ok=True)
-    
     # 准备输出数据
     ma_output = [(pure_code, name, ma_result[1], ma_result[2], ma_result[3], ma_result[4], ma_result[5], ma_result[6], ma_result[7], industry)]
     
     # 输出结果到CSV文件
-    df = pd.DataFrame(ma_output, columns=['股票代码', '股票名称', '收盘价', 'MA5', 'MA10', 'MA20', 'MA30', 'MA60', 'MA120', '所属行业'])
-    output_file = os.path.join(output_dir, f"{end_date}-{pure_code}-ma.csv")
-    df.to_csv(output_file, index=False, encoding='utf-8-sig')
+    _write_ma_csv(ma_output, f"{end_date}-{pure_code}-ma.csv")
     
     return {
         'ts_code': ma_result[0],
@@ -107,3 +150,124 @@ def get_stock_ma_by_date(session, ts_code, end_date):
         'ma60': ma_result[6],
         'ma120': ma_result[7]
     }
+
+# 批量均线查询结果的列
+MA_LOOKUP_COLUMNS = ['ts_code', 'name', 'industry', 'trade_date', 'close', 'ma5', 'ma10', 'ma20', 'ma30', 'ma60', 'ma120']
+
+def get_stock_ma_by_dates(session, ts_codes, dates=None, file_name=None):
+    """
+    批量查询多只股票在多个交易日的收盘价和均线，一次查询同时关联股票基础信息，最多输出一个CSV文件
+    
+    参数:
+    session: 数据库会话
+    ts_codes: 股票代码列表（带交易所后缀）
+    dates: 交易日列表，为空时使用临时表中最新日期
+    file_name: 输出文件名，默认为“开始日期-结束日期-watchlist-ma.csv”，传入False时不输出文件
+    
+    返回:
+    DataFrame: 列为MA_LOOKUP_COLUMNS，按股票代码和交易日排序，没有行情的(股票, 交易日)组合和北交所股票不出现在结果中；
+               股票或交易日列表为空时返回空表，不输出文件
+    """
+    if dates is None:
+        dates = [get_end_date(session, TempStockHQEntity.trade_date, None)]
+    ts_codes, dates = list(dict.fromkeys(ts_codes)), list(dates)
+    if not ts_codes or not dates:
+        return pd.DataFrame(columns=MA_LOOKUP_COLUMNS)
+    table_name = TempStockHQEntity.__tablename__
+    ma_sql = text(f'''
+    SELECT hq.ts_code, basic.name, basic.industry, hq.trade_date, hq.close,
+           COALESCE(hq.ma5, 0) as ma5,
+           COALESCE(hq.ma10, 0) as ma10,
+           COALESCE(hq.ma20, 0) as ma20,
+           COALESCE(hq.ma30, 0) as ma30,
+           COALESCE(hq.ma60, 0) as ma60,
+           COALESCE(hq.ma120, 0) as ma120
+    FROM {table_name} hq
+    LEFT JOIN {StockEntity.__tablename__} basic ON basic.ts_code = hq.ts_code
+    WHERE hq.ts_code IN :ts_codes
+      AND hq.trade_date IN :dates
+      AND hq.ts_code NOT LIKE '%BJ%'
+    ORDER BY hq.ts_code, hq.trade_date
+    ''').bindparams(bindparam('ts_codes', expanding=True), bindparam('dates', expanding=True))
+    rows = session.execute(ma_sql, {
+        'ts_codes': ts_codes,
+        'dates': list(dict.fromkeys(to_sql_date(value) for value in dates)),
+    }).fetchall()
+    
+    result = pd.DataFrame(rows, columns=MA_LOOKUP_COLUMNS)
+    result['name'] = result['name'].fillna('')
+    result['industry'] = result['industry'].fillna('')
+    result['trade_date'] = result['trade_date'].map(parse_date)
+    _write_ma_lookup_csv(result, dates, file_name)
+    return result
+
+def get_stock_ma_by_dates_from_panel(panel, ts_codes, dates=None, file_name=None):
+    """
+    基于行情面板批量查询多只股票在多个交易日的收盘价和均线，对面板做一次花式索引，不访问数据库
+    
+    参数:
+    panel: 包含close和ma5~ma120字段的MarketPanel
+    ts_codes: 股票代码列表（带交易所后缀）
+    dates: 交易日列表，为空时使用面板中最新日期
+    file_name: 输出文件名，参见get_stock_ma_by_dates
+    
+    返回:
+    DataFrame: 与get_stock_ma_by_dates相同
+    """
+    if dates is None:
+        dates = [panel.trade_date(panel.date_position())]
+    ts_codes, dates = list(dict.fromkeys(ts_codes)), list(dates)
+    if not ts_codes or not dates:
+        return pd.DataFrame(columns=MA_LOOKUP_COLUMNS)
+    # 与指标计算一致，排除北交所股票
+    included = panel.exclude_mask()
+    positions = {code: panel.code_position(code) for code in ts_codes}
+    codes = np.array(sorted(code for code, position in positions.items() if position is not None and included[position]), dtype=object)
+    targets = np.unique(np.array([parse_date(value) for value in dates], dtype='datetime64[D]'))
+    date_positions = np.searchsorted(panel.dates, targets)
+    # 只保留面板中存在的交易日
+    date_positions = date_positions[date_positions < len(panel.dates)]
+    date_positions = date_positions[panel.dates[date_positions] == targets[:len(date_positions)]]
+    
+    rows = np.repeat(np.array([panel.code_position(code) for code in codes], dtype=int), len(date_positions))
+    columns = np.tile(date_positions, len(codes))
+    close = panel['close'][rows, columns]
+    # 没有行情的组合不出现在结果中，与按交易日查询的结果一致
+    has_quote = ~np.isnan(close)
+    rows, columns = rows[has_quote], columns[has_quote]
+    
+    result = pd.DataFrame({
+        'ts_code': panel.codes[rows].astype(str),
+        'name': panel.stock_info['name'].fillna('').values[rows],
+        'industry': panel.stock_info['industry'].fillna('').values[rows],
+        'trade_date': [value.item() for value in panel.dates[columns]],
+        'close': close[has_quote],
+    }, columns=MA_LOOKUP_COLUMNS[:5])
+    for n in (5, 10, 20, 30, 60, 120):
+        result[f'ma{n}'] = np.nan_to_num(panel[f'ma{n}'][rows, columns], nan=0.0)
+    _write_ma_lookup_csv(result, dates, file_name)
+    return result
+
+def _write_ma_lookup_csv(result, dates, file_name=None):
+    if file_name is False:
+        return
+    if file_name is None:
+        sorted_dates = sorted(parse_date(value) for value in dates)
+        file_name = f"{sorted_dates[0].strftime('%Y%m%d')}-{sorted_dates[-1].strftime('%Y%m%d')}-watchlist-ma.csv"
+    output_dir = os.path.join(os.getcwd(), 'res')
+    os.makedirs(output_dir, exist_ok=True)
+    
+    df = pd.DataFrame({
+        '股票代码': result['ts_code'].str.split('.').str[0],
+        '股票名称': result['name'],
+        '交易日期': result['trade_date'],
+        '收盘价': result['close'],
+        'MA5': result['ma5'],
+        'MA10': result['ma10'],
+        'MA20': result['ma20'],
+        'MA30': result['ma30'],
+        'MA60': result['ma60'],
+        'MA120': result['ma120'],
+        '所属行业': result['industry'],
+    })
+    df.to_csv(os.path.join(output_dir, file_name), index=False, encoding='utf-8-sig')
@@ -1,9 +1,11 @@
 import os
+import numpy as np
 import pandas as pd
 from sqlalchemy import text
 from src.entities.temp_stock_hq import TempStockHQEntity
 from src.entities.stock_entity import StockEntity
-from src.utils.data_processing import get_end_date, get_trade_date_list
+from src.indicators.result import IndicatorResult
+from src.utils.data_processing import get_end_date, get_trade_date_list, to_sql_date
 
 def calculate_price_rise_indicator(session, end_date, rise_interval, min_rise=None, max_rise=None):
     """
@@ -41,7 +43,7 @@ def calculate_price_rise_indicator(session, end_date, rise_interval, min_rise=No
     
     rise_result = session.execute(
         text(rise_sql),
-        {'start_date': start_date, 'end_date': end_date, 'exclude_pattern': '%BJ%'}
+        {'start_date': to_sql_date(start_date), 'end_date': to_sql_date(end_date), 'exclude_pattern': '%BJ%'}
     ).fetchall()
     
     # 计算涨幅并排序
@@ -69,6 +71,12 @@ def calculate_price_rise_indicator(session, end_date, rise_interval, min_rise=No
         pure_code = ts_code.split('.')[0]
         rise_output.append((pure_code, name, close, min_price, rise_percent, industry))
     
+    _write_price_rise_csv(rise_output, end_date, rise_interval, min_rise, max_rise)
+    
+    print(f"已生成涨幅报告，共有{len(rise_output)}只股票在指定范围内")
+    return rise_output
+
+def _write_price_rise_csv(rise_output, end_date, rise_interval, min_rise, max_rise):
     # 创建输出目录
     output_dir = os.path.join(os.getcwd(), 'res')
     os.makedirs(output_dir, exist_ok=True)
@@ -87,6 +95,140 @@ def calculate_price_rise_indicator(session, end_date, rise_interval, min_rise=No
     )
     output_file = os.path.join(output_dir, f"{end_date}-price-rise-{rise_interval}days{range_info}.csv")
     df.to_csv(output_file, index=False, encoding='utf-8-sig')
+
+# 涨幅统计默认使用的周期
+RISE_INTERVALS = [5, 10, 20, 60, 120, 250]
+
+def calculate_price_range_frame(panel, end_date=None, intervals=RISE_INTERVALS, partial_windows=False):
+    """
+    基于行情面板一次计算多个周期的区间最低价涨幅和区间最高价回撤
+    
+    对最长周期的最低价和最高价窗口倒序分别做一次累积最小值和累积最大值，
+    第k列即为最近k+1个交易日的最低价和最高价，各周期都从这一次累积中取得
+    
+    参数:
+    panel: 包含low、high和close字段的MarketPanel
+    end_date: 结束日期，为空时使用面板中最新日期
+    intervals: 统计周期列表
+    partial_windows: 为True时周期超过面板长度也按面板内的数据计算，与calculate_price_rise_indicator的SQL一致
+    
+    返回:
+    DataFrame: 每只当日有收盘价的股票一行，包含ts_code, name, industry, close，每个周期n的
+               low_n, rise_n（相对区间最低价的涨幅%）, high_n, drawdown_n（相对区间最高价的回撤%）列，
+               涨幅和回撤保留两位小数，区间最低价不大于0时涨幅为NaN；
+               周期超过面板中截至结束日期的交易日数时该周期的各列均为NaN
+    """
+    end_pos = panel.date_position(end_date)
+    start_pos = panel.window_start(end_pos, max(intervals))
+    close = panel['close'][:, end_pos]
+    rows = np.flatnonzero(panel.exclude_mask() & ~np.isnan(close))
+    close = close[rows]
+    running_low = np.fmin.accumulate(panel['low'][rows, start_pos:end_pos + 1][:, ::-1], axis=1)
+    running_high = np.fmax.accumulate(panel['high'][rows, start_pos:end_pos + 1][:, ::-1], axis=1)
+    
+    result = pd.DataFrame({
+        'ts_code': panel.codes[rows].astype(str),
+        'name': panel.stock_info['name'].values[rows],
+        'industry': panel.stock_info['industry'].values[rows],
+        'close': close,
+    })
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for interval in intervals:
+            if interval > end_pos + 1 and not partial_windows:
+                # 面板中的历史不足一个周期，不能把较短周期的结果当作该周期的结果
+                for column in ('low', 'rise', 'high', 'drawdown'):
+                    result[f'{column}_{interval}'] = np.nan
+                continue
+            length = min(interval, running_low.shape[1])
+            low, high = running_low[:, length - 1], running_high[:, length - 1]
+            result[f'low_{interval}'] = low
+            result[f'rise_{interval}'] = np.where(low > 0, np.round((close - low) / low * 100, 2), np.nan)
+            result[f'high_{interval}'] = high
+            result[f'drawdown_{interval}'] = np.where(high > 0, np.round((close - high) / high * 100, 2), np.nan)
+    return result
+
+def _rise_range_mask(rise, min_rise=None, max_rise=None):
+    with np.errstate(invalid='ignore'):
+        mask = ~np.isnan(rise)
+        if min_rise is not None:
+            mask &= rise >= min_rise
+        if max_rise is not None:
+            mask &= rise <= max_rise
+    return mask
+
+def scan_price_rise_grid(panel, end_date, grid):
+    """
+    对(周期, 最小涨幅, 最大涨幅)组合网格批量筛选，所有周期共用一次calculate_price_range_frame计算，
+    每个组合只做一次数组比较
+    
+    参数:
+    panel: 包含low、high和close字段的MarketPanel
+    end_date: 结束日期，为空时使用面板中最新日期
+    grid: (rise_interval, min_rise, max_rise)列表，min_rise/max_rise可以为None
+    
+    返回:
+    DataFrame: 每个组合命中的每只股票一行，包含rise_interval, min_rise, max_rise, ts_code, name, close,
+               min_price, rise_percent, industry列，组合内按涨幅从高到低排列
+    """
+    # 与SQL版本的calculate_price_rise_indicator一致，面板不足一个周期时按已有的交易日计算
+    frame = calculate_price_range_frame(panel, end_date, sorted({int(interval) for interval, _, _ in grid}), partial_windows=True)
+    frames = []
+    for rise_interval, min_rise, max_rise in grid:
+        rise = frame[f'rise_{int(rise_interval)}'].values
+        selected = np.flatnonzero(_rise_range_mask(rise, min_rise, max_rise))
+        selected = selected[np.argsort(-rise[selected], kind='stable')]
+        frames.append(pd.DataFrame({
+            'rise_interval': rise_interval,
+            'min_rise': min_rise,
+            'max_rise': max_rise,
+            'ts_code': frame['ts_code'].values[selected],
+            'name': frame['name'].values[selected],
+            'close': frame['close'].values[selected],
+            'min_price': frame[f'low_{int(rise_interval)}'].values[selected],
+            'rise_percent': rise[selected],
+            'industry': frame['industry'].values[selected],
+        }))
+    columns = ['rise_interval', 'min_rise', 'max_rise', 'ts_code', 'name', 'close', 'min_price', 'rise_percent', 'industry']
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)[columns]
+
+def calculate_price_rise_result(panel, end_date, rise_interval, min_rise=None, max_rise=None):
+    """
+    基于行情面板筛选指定周期内涨幅在范围内的股票
+    
+    参数:
+    panel: 包含low、high和close字段的MarketPanel
+    end_date: 结束日期，为空时使用面板中最新日期
+    rise_interval: 统计周期天数
+    min_rise: 最小涨幅百分比
+    max_rise: 最大涨幅百分比
+    
+    返回:
+    IndicatorResult: 名称为'price_rise'，包含close、min_price和rise_percent列，按涨幅从高到低排列
+    """
+    end_pos = panel.date_position(end_date)
+    frame = scan_price_rise_grid(panel, end_date, [(rise_interval, min_rise, max_rise)])
+    frame[['name', 'industry']] = frame[['name', 'industry']].fillna('')
+    params = {'rise_interval': rise_interval, 'min_rise': min_rise, 'max_rise': max_rise}
+    return IndicatorResult.from_frame('price_rise', frame[['ts_code', 'name', 'industry', 'close', 'min_price', 'rise_percent']],
+                                      panel.trade_date(end_pos), params)
+
+def calculate_price_rise_indicator_from_panel(panel, end_date, rise_interval, min_rise=None, max_rise=None):
+    """
+    基于行情面板计算指定周期内的价格涨幅指标，不访问数据库
+    
+    参数:
+    panel: 包含low和close字段的MarketPanel
+    end_date: 结束日期，为空时使用面板中最新日期
+    rise_interval: 统计周期天数
+    min_rise: 最小涨幅百分比
+    max_rise: 最大涨幅百分比
+    """
+    result = calculate_price_rise_result(panel, end_date, rise_interval, min_rise, max_rise)
+    rise_output = result.to_rows(['code', 'name', 'close', 'min_price', 'rise_percent', 'industry'])
+    
+    _write_price_rise_csv(rise_output, end_date or result.end_date, rise_interval, min_rise, max_rise)
     
     print(f"已生成涨幅报告，共有{len(rise_output)}只股票在指定范围内")
-    return df
\ No newline at end of file
+    return rise_output
@@ -0,0 +1,282 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from src.entities.temp_stock_hq import TempStockHQEntity
+from src.indicators.rps import calculate_rps_result, calculate_rps_frame, RPS_HORIZONS
+from src.indicators.ma import calculate_ma_result
+from src.indicators.cross_ma import calculate_cross_ma_result, detect_crosses, DEFAULT_CROSS_PAIRS
+from src.indicators.high_price import calculate_high_price_result, detect_highs, HIGH_WINDOWS
+from src.indicators.price_rise import calculate_price_rise_result, calculate_price_range_frame, RISE_INTERVALS
+from src.indicators.vol import calculate_vol_result, scan_volume
+from src.panel.market_panel import MarketPanel
+from src.panel.snapshot import load_market_panel
+from src.utils.data_processing import get_data_version
+from src.utils.result_cache import make_cache_key, CACHE_MISS
+
+
+class IndicatorSpec:
+    """
+    指标的声明：计算函数、需要的面板字段、需要的交易日窗口长度以及默认参数
+
+    参数:
+    name: 指标名称
+    func: 计算函数，调用方式为func(panel, end_date=end_date, **params)
+    fields: 需要的面板字段列表，或根据参数返回字段列表的函数
+    window: 需要的交易日数（含结束日期），或根据参数返回交易日数的函数
+    defaults: 默认参数
+    description: 指标说明
+    """
+
+    def __init__(self, name, func, fields, window=1, defaults=None, description=''):
+        self.name = name
+        self.func = func
+        self._fields = fields
+        self._window = window
+        self.defaults = dict(defaults or {})
+        self.description = description
+
+    def resolve_params(self, params=None):
+        resolved = dict(self.defaults)
+        resolved.update(params or {})
+        return resolved
+
+    def fields(self, params):
+        fields = self._fields(params) if callable(self._fields) else self._fields
+        return list(fields)
+
+    def window(self, params):
+        return int(self._window(params) if callable(self._window) else self._window)
+
+
+class IndicatorTask:
+    """
+    一次运行中的单个指标任务，同一指标使用不同参数时通过label区分结果
+
+    参数:
+    name: 注册表中的指标名称
+    params: 覆盖默认值的参数
+    label: 结果字典中的键，默认为指标名称
+    """
+
+    def __init__(self, name, params=None, label=None):
+        self.name = name
+        self.params = dict(params or {})
+        self.label = label or name
+
+    def __repr__(self):
+        return f"IndicatorTask({self.name!r}, {self.params!r}, label={self.label!r})"
+
+
+# 指标注册表，键为指标名称
+INDICATORS = {}
+
+def register_indicator(spec):
+    """
+    注册指标，同名指标会被覆盖
+    """
+    INDICATORS[spec.name] = spec
+    return spec
+
+def get_indicator(name):
+    if name not in INDICATORS:
+        raise KeyError(f"未注册的指标: {name}，可用的指标: {', '.join(sorted(INDICATORS))}")
+    return INDICATORS[name]
+
+def _as_task(item):
+    if isinstance(item, IndicatorTask):
+        return item
+    if isinstance(item, str):
+        return IndicatorTask(item)
+    return IndicatorTask(*item)
+
+def plan_run(tasks):
+    """
+    规划一次运行：合并默认参数，汇总所有任务需要的字段并集和最长窗口
+
+    参数:
+    tasks: 任务列表，元素为指标名称、(名称, 参数[, label])元组或IndicatorTask
+
+    返回:
+    dict: 包含tasks（(label, spec, params)列表）、fields（字段并集，按首次出现的顺序）和window
+    """
+    planned = []
+    fields = {}
+    window = 1
+    for task in map(_as_task, tasks):
+        spec = get_indicator(task.name)
+        params = spec.resolve_params(task.params)
+        if any(label == task.label for label, _, _ in planned):
+            raise ValueError(f"任务标识重复: {task.label}，同一指标使用多组参数时请指定label")
+        planned.append((task.label, spec, params))
+        fields.update(dict.fromkeys(spec.fields(params)))
+        window = max(window, spec.window(params))
+    return {'tasks': planned, 'fields': list(fields), 'window': window}
+
+def load_plan_panel(session, plan, end_date=None, entity=TempStockHQEntity):
+    """
+    按规划一次加载所有任务需要的数据：临时表优先使用快照，其他行情表只加载所需的字段和窗口
+    """
+    if entity is TempStockHQEntity:
+        return load_market_panel(session, entity, end_date=end_date, fields=plan['fields'])
+    return MarketPanel.load(session, entity, fields=plan['fields'], end_date=end_date, window=plan['window'])
+
+# 进程池中每个工作进程持有一份面板，避免每个任务重复序列化
+_worker_panel = None
+
+def _init_worker(panel):
+    global _worker_panel
+    _worker_panel = panel
+
+def _run_in_worker(func, end_date, params):
+    return func(_worker_panel, end_date=end_date, **params)
+
+def run_indicators(session, end_date, tasks, panel=None, entity=TempStockHQEntity, max_workers=None, use_processes=False,
+                   cache=None, data_version=None):
+    """
+    一次加载所需数据后并行运行多个指标：各指标只读共享同一个面板，互不依赖，
+    总耗时约为一次加载加上最慢的指标
+
+    参数:
+    session: 数据库会话，仅在未提供panel时用于加载数据
+    end_date: 结束日期
+    tasks: 任务列表，元素为指标名称、(名称, 参数[, label])元组或IndicatorTask
+    panel: 已加载的MarketPanel，提供时不再访问数据库，需要包含所有任务的字段
+    entity: 未提供panel时加载的行情表实体
+    max_workers: 最大并发数，默认为任务数
+    use_processes: 为True时使用进程池，面板在每个工作进程初始化时传入一次；默认使用线程池，
+                   numpy的数组运算会释放GIL
+    cache: ResultCache，提供时按(指标, 参数, 结束日期, 数据版本)复用已计算的结果，全部命中时不加载数据
+           （命中的指标不会重新写出CSV文件）；提供panel而没有提供data_version时不使用缓存
+    data_version: 缓存使用的数据版本，默认通过session查询entity的数据版本
+
+    返回:
+    dict: 以任务label为键、指标计算结果为值的字典，顺序与tasks一致；rps、ma、cross_ma、high_price、price_rise
+          和vol的结果为以完整ts_code为索引的IndicatorResult，不写出CSV文件
+    """
+    plan = plan_run(tasks)
+    order = [label for label, _, _ in plan['tasks']]
+    results = {}
+    keys = {}
+    if cache is not None and panel is not None and data_version is None:
+        # 提供的面板不一定来自entity表，无法用entity的数据版本判断缓存是否失效
+        cache = None
+    if cache is not None:
+        data_version = data_version or get_data_version(session, entity)
+        for label, spec, params in plan['tasks']:
+            # 键中使用计算函数的名称，函数替换后旧的缓存结果不再命中
+            keys[label] = make_cache_key(f"{spec.func.__module__}.{spec.func.__name__}", params, end_date, data_version)
+            value = cache.get(keys[label], CACHE_MISS)
+            if value is not CACHE_MISS:
+                results[label] = value
+        # 只为未命中的任务规划字段和窗口
+        plan = plan_run([IndicatorTask(spec.name, params, label) for label, spec, params in plan['tasks'] if label not in results])
+    if not plan['tasks']:
+        return {label: results[label] for label in order}
+    if panel is None:
+        panel = load_plan_panel(session, plan, end_date, entity)
+    missing = [field for field in plan['fields'] if field not in panel]
+    if missing:
+        raise ValueError(f"面板缺少指标需要的字段: {', '.join(missing)}")
+
+    max_workers = max_workers or len(plan['tasks'])
+    if use_processes:
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(panel,))
+        futures = {label: executor.submit(_run_in_worker, spec.func, end_date, params) for label, spec, params in plan['tasks']}
+    else:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {label: executor.submit(spec.func, panel, end_date=end_date, **params) for label, spec, params in plan['tasks']}
+    with executor:
+        for label, future in futures.items():
+            results[label] = future.result()
+            if cache is not None:
+                cache.put(keys[label], results[label])
+    # 按任务的原始顺序返回
+    return {label: results[label] for label in order}
+
+def list_indicators():
+    """
+    返回已注册指标的名称、字段、默认参数和说明
+    """
+    return [
+        {'name': spec.name, 'fields': spec.fields(spec.defaults), 'defaults': spec.defaults, 'description': spec.description}
+        for spec in INDICATORS.values()
+    ]
+
+
+MA_FIELDS = ['close', 'ma5', 'ma10', 'ma20', 'ma30', 'ma60', 'ma120']
+
+register_indicator(IndicatorSpec(
+    'rps', calculate_rps_result,
+    fields=['open', 'pre_close', 'close'],
+    window=lambda params: params['rps_interval'],
+    defaults={'rps_interval': 3, 'rps_threshold': 90, 'use_pre_close': False},
+    description='区间涨幅相对强度RPS不低于阈值的股票',
+))
+register_indicator(IndicatorSpec(
+    'rps_frame', calculate_rps_frame,
+    fields=['open', 'pre_close', 'close'],
+    window=lambda params: max(params['horizons']),
+    defaults={'horizons': RPS_HORIZONS, 'use_pre_close': False, 'rps_threshold': None},
+    description='多周期涨幅与RPS',
+))
+register_indicator(IndicatorSpec(
+    'ma', calculate_ma_result,
+    fields=MA_FIELDS,
+    defaults={'ma_interval': 3},
+    description='均线多头排列',
+))
+register_indicator(IndicatorSpec(
+    'cross_ma', calculate_cross_ma_result,
+    fields=['close', 'ma5', 'ma10'],
+    window=lambda params: params['lookback_days'] + 1,
+    defaults={'lookback_days': 3},
+    description='近期收盘价上穿5日和10日均线',
+))
+register_indicator(IndicatorSpec(
+    'crosses', detect_crosses,
+    fields=lambda params: dict.fromkeys(field for pair in params['pairs'] for field in pair),
+    window=lambda params: params['lookback_days'] + 1,
+    defaults={'lookback_days': 3, 'pairs': DEFAULT_CROSS_PAIRS, 'directions': ('up',)},
+    description='任意价格/均线组合的金叉死叉',
+))
+register_indicator(IndicatorSpec(
+    'high_price', calculate_high_price_result,
+    fields=['close'],
+    window=lambda params: params['interval'],
+    defaults={'interval': 60},
+    description='收盘价创阶段新高',
+))
+register_indicator(IndicatorSpec(
+    'highs', detect_highs,
+    fields=['close'],
+    window=lambda params: max(max(params['windows']), params['consolidation_days'] + 1),
+    defaults={'windows': HIGH_WINDOWS, 'near_pct': 5.0, 'consolidation_days': 20, 'consolidation_range': 15.0},
+    description='多周期新高、接近新高与平台突破',
+))
+register_indicator(IndicatorSpec(
+    'price_rise', calculate_price_rise_result,
+    fields=['low', 'high', 'close'],
+    window=lambda params: params['rise_interval'],
+    defaults={'rise_interval': 60, 'min_rise': None, 'max_rise': None},
+    description='区间最低价以来的涨幅',
+))
+register_indicator(IndicatorSpec(
+    'price_range', calculate_price_range_frame,
+    fields=['low', 'high', 'close'],
+    window=lambda params: max(params['intervals']),
+    defaults={'intervals': RISE_INTERVALS},
+    description='多周期距最低价涨幅与距最高价回撤',
+))
+register_indicator(IndicatorSpec(
+    'vol', calculate_vol_result,
+    fields=['vol'],
+    window=lambda params: params['lookback_days'] + params['sustained_days'],
+    defaults={'lookback_days': 5, 'vol_surge_ratio': 2.0, 'max_vol_ratio': 5.0, 'max_daily_vol_increase': 3.0,
+              'sustained_days': 1, 'start_date': None},
+    description='放量股票',
+))
+register_indicator(IndicatorSpec(
+    'volume_scan', scan_volume,
+    fields=['vol'],
+    window=lambda params: params['lookback_days'] + params['sustained_days'],
+    defaults={'lookback_days': 5, 'vol_surge_ratio': 2.0, 'max_vol_ratio': None, 'max_daily_vol_increase': None, 'sustained_days': 1},
+    description='全市场放量扫描（支持持续放量）',
+))
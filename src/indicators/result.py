@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+# 每个结果都带有的股票信息列，其余列为指标的数值列
+META_COLUMNS = ['name', 'industry']
+
+
+class IndicatorResult:
+    """
+    指标结果的统一列式表示：以带交易所后缀的完整ts_code为索引，包含name、industry以及指标的数值列，
+    不同指标的结果之间按索引做向量化的交集、连接和排序，不需要去掉或补回代码后缀
+
+    参数:
+    name: 指标名称，连接其他结果时作为其数值列的前缀
+    frame: 以ts_code为索引的DataFrame，必须包含name和industry列
+    end_date: 结果对应的交易日
+    params: 计算参数
+    """
+
+    def __init__(self, name, frame, end_date=None, params=None):
+        frame = frame.copy()
+        frame.index = pd.Index(frame.index.astype(str), name='ts_code')
+        for column in META_COLUMNS:
+            if column not in frame.columns:
+                frame[column] = ''
+        self.name = name
+        self.frame = frame[META_COLUMNS + [column for column in frame.columns if column not in META_COLUMNS]]
+        self.end_date = end_date
+        self.params = dict(params or {})
+
+    @classmethod
+    def from_panel(cls, name, panel, rows, values=None, end_date=None, params=None, default_meta=('', '')):
+        """
+        由面板中的行下标构建结果，股票名称和行业取自面板的stock_info
+
+        参数:
+        name: 指标名称
+        panel: MarketPanel
+        rows: 选中股票在面板中的行下标
+        values: 数值列字典，每个值与rows等长
+        end_date: 结果对应的交易日
+        params: 计算参数
+        default_meta: 缺少基础信息时使用的(名称, 行业)
+        """
+        rows = np.asarray(rows, dtype=int)
+        frame = pd.DataFrame({
+            'name': pd.Series(panel.stock_info['name'].values[rows]).fillna(default_meta[0]).values,
+            'industry': pd.Series(panel.stock_info['industry'].values[rows]).fillna(default_meta[1]).values,
+        }, index=pd.Index(panel.codes[rows].astype(str), name='ts_code'))
+        for column, column_values in (values or {}).items():
+            frame[column] = np.asarray(column_values)
+        return cls(name, frame, end_date, params)
+
+    @classmethod
+    def from_frame(cls, name, df, end_date=None, params=None):
+        """
+        由包含ts_code列的DataFrame构建结果
+        """
+        return cls(name, df.set_index('ts_code'), end_date, params)
+
+    @classmethod
+    def empty(cls, name, columns=(), end_date=None, params=None):
+        return cls(name, pd.DataFrame(columns=META_COLUMNS + list(columns), index=pd.Index([], name='ts_code')), end_date, params)
+
+    @property
+    def codes(self):
+        return self.frame.index.values
+
+    @property
+    def value_columns(self):
+        return [column for column in self.frame.columns if column not in META_COLUMNS]
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __contains__(self, ts_code):
+        return ts_code in self.frame.index
+
+    def __getitem__(self, column):
+        return self.frame[column]
+
+    def __repr__(self):
+        return f"IndicatorResult({self.name!r}, rows={len(self)}, columns={self.value_columns})"
+
+    def _with_frame(self, frame, name=None):
+        return IndicatorResult(name or self.name, frame, self.end_date, self.params)
+
+    def filter(self, mask):
+        """
+        按布尔掩码筛选行
+        """
+        return self._with_frame(self.frame[np.asarray(mask, dtype=bool)])
+
+    def rank(self, column, ascending=False):
+        """
+        按指定列排序（稳定排序），缺失值排在最后
+        """
+        return self._with_frame(self.frame.sort_values(column, ascending=ascending, kind='stable', na_position='last'))
+
+    def join(self, other, columns=None, how='left', prefix=None):
+        """
+        按ts_code连接另一个结果的数值列，列名加上“指标名称_”前缀
+
+        参数:
+        other: IndicatorResult
+        columns: 要连接的数值列，默认为other的全部数值列
+        how: 连接方式，'left'、'inner'、'outer'或'right'
+        prefix: 列名前缀，默认为other.name
+        """
+        columns = other.value_columns if columns is None else list(columns)
+        right = other.frame[columns].add_prefix(f"{prefix or other.name}_")
+        frame = self.frame.join(right, how=how)
+        if how in ('outer', 'right'):
+            # 只在other中出现的股票使用other的基础信息
+            for column in META_COLUMNS:
+                frame[column] = frame[column].fillna(other.frame[column].reindex(frame.index))
+        return self._with_frame(frame)
+
+    def intersect(self, *others, name=None, columns=None):
+        """
+        与其他结果取交集（保持本结果的行顺序），并连接其他结果的数值列
+
+        参数:
+        others: IndicatorResult
+        name: 交集结果的名称，默认为本结果的名称
+        columns: {指标名称: 数值列列表}，指定需要连接的列，未指定的指标连接全部数值列
+        """
+        codes = self.frame.index
+        for other in others:
+            codes = codes[codes.isin(other.frame.index)]
+        result = self._with_frame(self.frame.loc[codes], name)
+        for other in others:
+            result = result.join(other, (columns or {}).get(other.name), how='left')
+        return result
+
+    def to_frame(self):
+        """
+        返回以ts_code为普通列的DataFrame
+        """
+        return self.frame.reset_index()
+
+    def to_rows(self, columns):
+        """
+        转换为元组列表，columns中可以使用'ts_code'（完整代码）和'code'（去掉交易所后缀的代码）
+        """
+        frame = self.to_frame()
+        frame['code'] = frame['ts_code'].str.split('.').str[0]
+        return list(frame[list(columns)].itertuples(index=False, name=None))
@@ -1,10 +1,13 @@
 import os
+import numpy as np
 import pandas as pd
 from sqlalchemy import text
 from datetime import datetime
 from src.entities.temp_stock_hq import TempStockHQEntity
 from src.entities.stock_entity import StockEntity
-from src.utils.data_processing import get_end_date, get_trade_date_list
+from src.entities.stock_rps import StockRPSEntity
+from src.indicators.result import IndicatorResult
+from src.utils.data_processing import get_end_date, get_trade_date_list, parse_date, to_sql_date
 
 def _format_date(date_str):
     """Convert date from YYYYMMDD to YYYY-MM-DD format if needed."""
@@ -37,24 +40,24 @@ def calculate_rps_indicator(session, end_date, rps_interval, rps_threshold, use_
     # Choose which calculation method to use based on use_pre_close parameter
     if use_pre_close:
         rps_sql = f'''
-        SELECT start.ts_code, ((end.close - start.pre_close) / start.pre_close) as price_change 
-        FROM (SELECT * FROM {table_name} WHERE trade_date = :start_date) start, 
-             (SELECT * FROM {table_name} WHERE trade_date = :end_date) end 
-        WHERE start.ts_code = end.ts_code 
-          AND start.ts_code NOT LIKE :exclude_pattern 
+        SELECT start_hq.ts_code, ((end_hq.close - start_hq.pre_close) / start_hq.pre_close) as price_change 
+        FROM (SELECT * FROM {table_name} WHERE trade_date = :start_date) start_hq, 
+             (SELECT * FROM {table_name} WHERE trade_date = :end_date) end_hq 
+        WHERE start_hq.ts_code = end_hq.ts_code 
+          AND start_hq.ts_code NOT LIKE :exclude_pattern 
         ORDER BY price_change DESC
         '''
     else:
         rps_sql = f'''
-        SELECT start.ts_code, ((end.close - start.open) / start.open) as price_change 
-        FROM (SELECT * FROM {table_name} WHERE trade_date = :start_date) start, 
-             (SELECT * FROM {table_name} WHERE trade_date = :end_date) end 
-        WHERE start.ts_code = end.ts_code 
-          AND start.ts_code NOT LIKE :exclude_pattern 
+        SELECT start_hq.ts_code, ((end_hq.close - start_hq.open) / start_hq.open) as price_change 
+        FROM (SELECT * FROM {table_name} WHERE trade_date = :start_date) start_hq, 
+             (SELECT * FROM {table_name} WHERE trade_date = :end_date) end_hq 
+        WHERE start_hq.ts_code = end_hq.ts_code 
+          AND start_hq.ts_code NOT LIKE :exclude_pattern 
         ORDER BY price_change DESC
         '''
     
-    rps_result = session.execute(text(rps_sql), {'start_date': start_date, 'end_date': end_date, 'exclude_pattern': '%BJ%'}).fetchall()
+    rps_result = session.execute(text(rps_sql), {'start_date': to_sql_date(start_date), 'end_date': to_sql_date(end_date), 'exclude_pattern': '%BJ%'}).fetchall()
     count = len(rps_result)
 
     code_list = [value[0] for value in rps_result]
@@ -85,6 +88,12 @@ def calculate_rps_indicator(session, end_date, rps_interval, rps_threshold, use_
         pure_code = ts_code.split('.')[0]
         rps_output.append((pure_code, name, change * 100, rps, industry))
     
+    _write_rps_csv(rps_output, end_date, rps_interval)
+    
+    return rps_output
+
+def _write_rps_csv(rps_output, end_date, rps_interval):
+    """Write RPS results to res/<end_date>-rps-<interval>days.csv."""
     # 创建输出目录
     output_dir = os.path.join(os.getcwd(), 'res')
     os.makedirs(output_dir, exist_ok=True)
@@ -93,5 +102,268 @@ def calculate_rps_indicator(session, end_date, rps_interval, rps_threshold, use_
     df = pd.DataFrame(rps_output, columns=['股票代码', '股票名称', '区间涨跌幅', 'RPS值', '所属行业'])
     output_file = os.path.join(output_dir, f"{end_date}-rps-{rps_interval}days.csv")
     df.to_csv(output_file, index=False, encoding='utf-8-sig')
+
+# 常用的RPS统计周期
+RPS_HORIZONS = [1, 3, 5, 20, 60, 120, 250]
+
+def _rank_rps(change, valid, rps_threshold=None):
+    """Rank price changes column by column into RPS values.
+    
+    Matches the SQL version: stocks are ranked by change descending (NULL changes last),
+    rank r (1-based) among count joined stocks gives RPS (1 - r / count) * 100.
+    
+    Args:
+        change: (stocks, horizons) array of price changes, NaN where the ratio is undefined
+        valid: (stocks, horizons) mask of stocks that have both the start and end rows
+        rps_threshold: If given, only stocks reaching the threshold are ranked (partial
+            selection with argpartition), all others are left as NaN
+    
+    Returns:
+        (stocks, horizons) array of RPS values, NaN for stocks not ranked
+    """
+    # 排序键：涨跌幅降序，无法计算涨跌幅的排在其后，不参与连接的股票为NaN排在最后
+    key = np.where(np.isnan(change), np.inf, -change)
+    key[~valid] = np.nan
+    counts = valid.sum(axis=0)
+    
+    if rps_threshold is None:
+        # 需要完整排名时所有列一次排序
+        order = np.argsort(key, axis=0, kind='stable')
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.arange(1, key.shape[0] + 1)[:, np.newaxis], axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rps = (1 - ranks / counts) * 100
+        rps[~valid] = np.nan
+        return rps
+    
+    rps = np.full(change.shape, np.nan)
+    for column, count in enumerate(counts):
+        if count == 0:
+            continue
+        column_key = key[:, column]
+        # RPS不低于阈值的最大名次，多取一名以免浮点误差漏掉边界
+        top = min(count, int(count * (1 - rps_threshold / 100)) + 1)
+        if top < count:
+            kth = column_key[np.argpartition(column_key, top - 1)[top - 1]]
+            candidates = np.flatnonzero(column_key <= kth)
+        else:
+            candidates = np.flatnonzero(valid[:, column])
+        order = candidates[np.argsort(column_key[candidates], kind='stable')][:top]
+        values = (1 - np.arange(1, len(order) + 1) / count) * 100
+        keep = values >= rps_threshold
+        rps[order[keep], column] = values[keep]
+    return rps
+
+def calculate_rps_frame(panel, end_date=None, horizons=RPS_HORIZONS, use_pre_close=False, rps_threshold=None):
+    """Calculate RPS for several horizons at once from a MarketPanel.
+    
+    The start prices of all horizons are gathered with one fancy-indexing step and the
+    changes for every horizon are computed as one (stocks, horizons) array.
+    
+    Args:
+        panel: MarketPanel containing open, pre_close and close
+        end_date: End date in YYYYMMDD or YYYY-MM-DD format, None for the latest date in the panel
+        horizons: Intervals in days
+        use_pre_close: If True, use pre_close instead of open price for calculation
+        rps_threshold: If given, only keep stocks reaching the threshold in at least one horizon;
+            RPS values below the threshold are NaN
+    
+    Returns:
+        DataFrame with ts_code, name, industry and change_<n> (percent), rps_<n> columns per horizon;
+        horizons without a complete window in the panel are NaN, as in calculate_rps_matrix
+    """
+    formatted_end_date = _format_date(end_date) if end_date else None
+    end_pos = panel.date_position(formatted_end_date)
+    horizons = [int(horizon) for horizon in horizons]
+    start_positions = [panel.window_start(end_pos, horizon) for horizon in horizons]
+    
+    # Horizons longer than the history in the panel are left as NaN instead of being clamped
+    # to the first date, which would silently report a shorter horizon under a longer name
+    complete = np.array([end_pos - horizon + 1 >= 0 for horizon in horizons], dtype=bool)
+    
+    base = panel['pre_close' if use_pre_close else 'open'][:, start_positions]
+    close = panel['close'][:, end_pos][:, np.newaxis]
+    valid = panel.exclude_mask()[:, np.newaxis] & complete[np.newaxis, :] & ~np.isnan(base) & ~np.isnan(close)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = (close - base) / base
+    change[~np.isfinite(change)] = np.nan
+    rps = _rank_rps(change, valid, rps_threshold)
+    
+    rows = np.flatnonzero(~np.isnan(rps).all(axis=1))
+    result = pd.DataFrame({
+        'ts_code': panel.codes[rows].astype(str),
+        'name': panel.stock_info['name'].values[rows],
+        'industry': panel.stock_info['industry'].values[rows],
+    })
+    for column, horizon in enumerate(horizons):
+        result[f'change_{horizon}'] = np.where(valid[rows, column], change[rows, column] * 100, np.nan)
+        result[f'rps_{horizon}'] = rps[rows, column]
+    return result
+
+def calculate_rps_result(panel, end_date, rps_interval, rps_threshold, use_pre_close=False):
+    """Select stocks whose RPS reaches the threshold from a MarketPanel.
+    
+    Args:
+        panel: MarketPanel containing open, pre_close and close
+        end_date: End date in YYYYMMDD or YYYY-MM-DD format, None for the latest date in the panel
+        rps_interval: Interval in days
+        rps_threshold: RPS threshold percentage
+        use_pre_close: If True, use pre_close instead of open price for calculation
+    
+    Returns:
+        IndicatorResult named 'rps' keyed by full ts_code with change (percent) and rps columns,
+        sorted by rps in descending order
+    """
+    formatted_end_date = _format_date(end_date) if end_date else None
+    end_pos = panel.date_position(formatted_end_date)
+    frame = calculate_rps_frame(panel, formatted_end_date, [rps_interval], use_pre_close, rps_threshold)
+    frame = frame.sort_values(f'rps_{rps_interval}', ascending=False, kind='stable')
+    frame = frame.rename(columns={f'change_{rps_interval}': 'change', f'rps_{rps_interval}': 'rps'})
+    frame[['name', 'industry']] = frame[['name', 'industry']].fillna('未知')
+    params = {'rps_interval': rps_interval, 'rps_threshold': rps_threshold, 'use_pre_close': use_pre_close}
+    return IndicatorResult.from_frame('rps', frame, panel.trade_date(end_pos), params)
+
+def calculate_rps_indicator_from_panel(panel, end_date, rps_interval, rps_threshold, use_pre_close=False):
+    """Calculate RPS indicator from a MarketPanel without touching the database.
+    
+    Args:
+        panel: MarketPanel containing open, pre_close and close
+        end_date: End date in YYYYMMDD or YYYY-MM-DD format, None for the latest date in the panel
+        rps_interval: Interval in days
+        rps_threshold: RPS threshold percentage
+        use_pre_close: If True, use pre_close instead of open price for calculation
+    """
+    result = calculate_rps_result(panel, end_date, rps_interval, rps_threshold, use_pre_close)
+    rps_output = result.to_rows(['code', 'name', 'change', 'rps', 'industry'])
+    
+    _write_rps_csv(rps_output, _format_date(end_date) if end_date else result.end_date, rps_interval)
+    return rps_output
+
+def calculate_rps_matrix(panel, horizon, use_pre_close=False, start_date=None):
+    """Calculate the RPS of every stock on every trade date of a MarketPanel for one horizon.
+    
+    The changes of all end dates are computed as one (stocks, dates) array and ranked in one
+    sort. End dates without a complete horizon inside the panel are left as NaN, so that every
+    value matches a calculation on the full history.
+    
+    Args:
+        panel: MarketPanel containing open, pre_close and close
+        horizon: Interval in days
+        use_pre_close: If True, use pre_close instead of open price for calculation
+        start_date: Only calculate end dates on or after this date, None for the whole panel
+    
+    Returns:
+        (change, rps) arrays shaped like the panel, change in percent, NaN where not ranked
+    """
+    horizon = int(horizon)
+    first_pos = 0
+    if start_date:
+        first_pos = int(np.searchsorted(panel.dates, np.datetime64(parse_date(start_date), 'D')))
+    change_matrix = np.full(panel.shape, np.nan)
+    rps_matrix = np.full(panel.shape, np.nan)
+    end_positions = np.arange(max(first_pos, horizon - 1), len(panel.dates))
+    if len(end_positions) == 0:
+        return change_matrix, rps_matrix
+    
+    base = panel['pre_close' if use_pre_close else 'open'][:, end_positions - horizon + 1]
+    end_close = panel['close'][:, end_positions]
+    valid = panel.exclude_mask()[:, np.newaxis] & ~np.isnan(base) & ~np.isnan(end_close)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = (end_close - base) / base
+    change[~np.isfinite(change)] = np.nan
+    change_matrix[:, end_positions] = np.where(valid, change * 100, np.nan)
+    rps_matrix[:, end_positions] = _rank_rps(change, valid)
+    return change_matrix, rps_matrix
+
+def calculate_rps_history(panel, horizons=RPS_HORIZONS, use_pre_close=False, start_date=None):
+    """Calculate full RPS rankings for every trade date in a MarketPanel.
+    
+    Only end dates with a complete horizon inside the panel are included, see calculate_rps_matrix.
+    
+    Args:
+        panel: MarketPanel containing open, pre_close and close
+        horizons: Intervals in days
+        use_pre_close: If True, use pre_close instead of open price for calculation
+        start_date: Only calculate end dates on or after this date, None for the whole panel
+    
+    Returns:
+        Long DataFrame with ts_code, trade_date, rps_interval, price_change (percent) and rps columns
+    """
+    frames = []
+    for horizon in horizons:
+        change, rps = calculate_rps_matrix(panel, horizon, use_pre_close, start_date)
+        # 参与排名的股票都有RPS值（涨跌幅可能无法计算）
+        rows, columns = np.nonzero(~np.isnan(rps))
+        if len(rows) == 0:
+            continue
+        frames.append(pd.DataFrame({
+            'ts_code': panel.codes[rows].astype(str),
+            'trade_date': panel.dates[columns],
+            'rps_interval': int(horizon),
+            'price_change': change[rows, columns],
+            'rps': rps[rows, columns],
+        }))
+    if not frames:
+        return pd.DataFrame(columns=['ts_code', 'trade_date', 'rps_interval', 'price_change', 'rps'])
+    return pd.concat(frames, ignore_index=True)
+
+def calculate_rps_result_from_table(session, end_date, rps_interval, rps_threshold, use_pre_close=False):
+    """Read the stocks whose persisted RPS reaches the threshold from t_stock_rps.
+    
+    The table is filled by backfill_stock_rps/update_stock_rps in src.service.rps_service.
+    
+    Args:
+        session: Database session
+        end_date: End date in YYYYMMDD or YYYY-MM-DD format, None for the latest date in the table;
+            the latest stored date on or before it is used
+        rps_interval: Interval in days
+        rps_threshold: RPS threshold percentage
+        use_pre_close: If True, read values calculated with pre_close instead of open price
+    
+    Returns:
+        IndicatorResult named 'rps' with change and rps columns sorted by rps in descending order,
+        empty when the table has no data for the interval
+    """
+    method = 'pre_close' if use_pre_close else 'open'
+    table_name = StockRPSEntity.__tablename__
+    params = {'rps_interval': int(rps_interval), 'method': method}
+    result_params = {'rps_interval': rps_interval, 'rps_threshold': rps_threshold, 'use_pre_close': use_pre_close}
+    date_sql = f"SELECT MAX(trade_date) FROM {table_name} WHERE rps_interval = :rps_interval AND method = :method"
+    if end_date:
+        date_sql += " AND trade_date <= :end_date"
+        params['end_date'] = to_sql_date(end_date)
+    trade_date = parse_date(session.execute(text(date_sql), params).scalar())
+    if trade_date is None:
+        print(f"表 {table_name} 中没有 {rps_interval} 日RPS数据，请先执行回填")
+        return IndicatorResult.empty('rps', ['change', 'rps'], params=result_params)
+    
+    rps_sql = f'''
+    SELECT rps.ts_code, basic.name, basic.industry, rps.price_change, rps.rps
+    FROM {table_name} rps
+    LEFT JOIN {StockEntity.__tablename__} basic ON basic.ts_code = rps.ts_code
+    WHERE rps.trade_date = :trade_date AND rps.rps_interval = :rps_interval
+      AND rps.method = :method AND rps.rps >= :rps_threshold
+    ORDER BY rps.rps DESC
+    '''
+    params.update(trade_date=to_sql_date(trade_date), rps_threshold=rps_threshold)
+    frame = pd.DataFrame(session.execute(text(rps_sql), params).fetchall(), columns=['ts_code', 'name', 'industry', 'change', 'rps'])
+    frame[['name', 'industry']] = frame[['name', 'industry']].fillna('未知')
+    return IndicatorResult.from_frame('rps', frame, trade_date, result_params)
+
+def calculate_rps_indicator_from_table(session, end_date, rps_interval, rps_threshold, use_pre_close=False):
+    """Read RPS indicator results from the persisted t_stock_rps table instead of recalculating.
+    
+    Args:
+        session: Database session
+        end_date: End date in YYYYMMDD or YYYY-MM-DD format, None for the latest date in the table
+        rps_interval: Interval in days
+        rps_threshold: RPS threshold percentage
+        use_pre_close: If True, read values calculated with pre_close instead of open price
+    """
+    result = calculate_rps_result_from_table(session, end_date, rps_interval, rps_threshold, use_pre_close)
+    if result.end_date is None:
+        return []
+    rps_output = result.to_rows(['code', 'name', 'change', 'rps', 'industry'])
     
+    _write_rps_csv(rps_output, end_date or to_sql_date(result.end_date), rps_interval)
     return rps_output
@@ -1,30 +1,143 @@
+import numpy as np
+import pandas as pd
 from sqlalchemy import text
 from src.entities.temp_stock_hq import TempStockHQEntity
 from src.entities.stock_entity import StockEntity
+from src.indicators.result import IndicatorResult
+from src.utils.data_processing import to_sql_date, parse_date
+from src.utils.moving_average import rolling_mean
 
 def calculate_vol_indicator(session, start_date, end_date, lookback_days, vol_surge_ratio, max_vol_ratio, max_daily_vol_increase):
     table_name = TempStockHQEntity.__tablename__
     vol_sql = f'''
-    SELECT ts_code, trade_date, vol, AVG(vol) OVER (PARTITION BY ts_code ORDER BY trade_date ROWS BETWEEN {lookback_days} PRECEDING AND 1 PRECEDING) as avg_vol
+    SELECT ts_code, trade_date, vol, AVG(vol) OVER (PARTITION BY ts_code ORDER BY trade_date ROWS BETWEEN :lookback_days PRECEDING AND 1 PRECEDING) as avg_vol
     FROM {table_name}
     WHERE trade_date BETWEEN :start_date AND :end_date
+    ORDER BY ts_code, trade_date
     '''
-    vol_result = session.execute(text(vol_sql), {'start_date': start_date, 'end_date': end_date}).fetchall()
+    vol_result = session.execute(text(vol_sql), {
+        'lookback_days': int(lookback_days),
+        'start_date': to_sql_date(start_date),
+        'end_date': to_sql_date(end_date),
+    }).fetchall()
 
-    vol_code_list = list(set([value[0] for value in vol_result]))
-    vol_base_entity_list = session.query(StockEntity).filter(StockEntity.ts_code.in_(vol_code_list)).all()
+    # 结果已按股票和日期排序，一次遍历即可按股票分组
+    stock_rows = {}
+    for row in vol_result:
+        stock_rows.setdefault(row[0], []).append(row)
+
+    vol_base_entity_list = session.query(StockEntity).filter(StockEntity.ts_code.in_(list(stock_rows))).all()
     vol_code_name_map = {entity.ts_code: entity.name for entity in vol_base_entity_list}
 
     vol_output = []
-    for ts_code in vol_code_list:
-        stock_data = [value for value in vol_result if value[0] == ts_code]
-        vol_values = [value[2] for value in stock_data]
-        avg_vol_values = [value[3] for value in stock_data]
+    for ts_code, stock_data in stock_rows.items():
+        if len(stock_data) < 2:
+            continue
+        vol_today, avg_vol = stock_data[-1][2], stock_data[-1][3]
+        vol_yesterday = stock_data[-2][2]
 
         # 筛选满足成交量条件的股票
-        if vol_values[-1] is not None and avg_vol_values[-1] is not None and vol_values[-2] is not None:
-            if vol_values[-1] > vol_surge_ratio * avg_vol_values[-1] and vol_values[-1] < max_vol_ratio * avg_vol_values[-1] and vol_values[-1] < max_daily_vol_increase * vol_values[-2]:
+        if vol_today is not None and avg_vol is not None and vol_yesterday is not None:
+            if vol_today > vol_surge_ratio * avg_vol and vol_today < max_vol_ratio * avg_vol and vol_today < max_daily_vol_increase * vol_yesterday:
                 name = vol_code_name_map.get(ts_code, '')
                 vol_output.append((name, ts_code))
     
     return vol_output
+
+
+def scan_volume(panel, end_date=None, lookback_days=5, vol_surge_ratio=2.0, max_vol_ratio=None, max_daily_vol_increase=None,
+                sustained_days=1, start_date=None):
+    """
+    全市场放量扫描：对面板的成交量一次计算每个交易日之前lookback_days日的滚动均量，
+    要求最近sustained_days个交易日每天都满足放量条件（持续放量），结果按当日量比降序排列
+
+    参数:
+    panel: 包含vol字段的MarketPanel
+    end_date: 结束日期，为空时使用面板中最新日期
+    lookback_days: 计算均量的天数（不含当日），均量忽略缺失值
+    vol_surge_ratio: 当日成交量相对均量的最小倍数
+    max_vol_ratio: 当日成交量相对均量的最大倍数，为空时不限制
+    max_daily_vol_increase: 当日成交量相对前一日的最大倍数，为空时不限制
+    sustained_days: 需要连续满足条件的交易日数
+    start_date: 开始日期，均量只统计该日期之后的数据
+
+    返回:
+    DataFrame: 包含ts_code, name, industry, vol, avg_vol, vol_ratio, daily_increase, surge_days列，
+               surge_days为截至结束日期连续满足条件的天数
+    """
+    end_pos = panel.date_position(end_date)
+    start_pos = int(np.searchsorted(panel.dates, np.datetime64(parse_date(start_date), 'D'))) if start_date else 0
+    columns = ['ts_code', 'name', 'industry', 'vol', 'avg_vol', 'vol_ratio', 'daily_increase', 'surge_days']
+    if end_pos - start_pos < 1:
+        return pd.DataFrame(columns=columns)
+
+    vol = panel['vol'][:, start_pos:end_pos + 1]
+    # 第t列的均量为第t-lookback_days到t-1列的平均值，与SQL中ROWS BETWEEN n PRECEDING AND 1 PRECEDING一致
+    avg_vol = np.full(vol.shape, np.nan)
+    avg_vol[:, 1:] = rolling_mean(vol[:, :-1], lookback_days, min_periods=1)
+    previous = np.full(vol.shape, np.nan)
+    previous[:, 1:] = vol[:, :-1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vol_ratio = vol / avg_vol
+        daily_increase = vol / previous
+        surge = vol > vol_surge_ratio * avg_vol
+        if max_vol_ratio is not None:
+            surge &= vol < max_vol_ratio * avg_vol
+        if max_daily_vol_increase is not None:
+            surge &= vol < max_daily_vol_increase * previous
+    surge[:, 0] = False
+
+    # 截至最后一个交易日连续满足条件的天数
+    positions = np.arange(surge.shape[1])
+    last_miss = np.where(~surge, positions, -1).max(axis=1)
+    surge_days = surge.shape[1] - 1 - last_miss
+    selected = np.flatnonzero((surge_days >= max(sustained_days, 1)) & panel.exclude_mask())
+    selected = selected[np.argsort(-vol_ratio[selected, -1], kind='stable')]
+
+    return pd.DataFrame({
+        'ts_code': panel.codes[selected].astype(str),
+        'name': panel.stock_info['name'].values[selected],
+        'industry': panel.stock_info['industry'].values[selected],
+        'vol': vol[selected, -1],
+        'avg_vol': avg_vol[selected, -1],
+        'vol_ratio': vol_ratio[selected, -1],
+        'daily_increase': daily_increase[selected, -1],
+        'surge_days': surge_days[selected],
+    }, columns=columns)
+
+
+def calculate_vol_result(panel, end_date, lookback_days=5, vol_surge_ratio=2.0, max_vol_ratio=None, max_daily_vol_increase=None,
+                         sustained_days=1, start_date=None):
+    """
+    基于行情面板筛选放量股票，参数同scan_volume
+
+    返回:
+    IndicatorResult: 名称为'vol'，包含vol, avg_vol, vol_ratio, daily_increase, surge_days列，按量比降序排列
+    """
+    frame = scan_volume(panel, end_date, lookback_days, vol_surge_ratio, max_vol_ratio, max_daily_vol_increase,
+                        sustained_days, start_date)
+    frame[['name', 'industry']] = frame[['name', 'industry']].fillna('')
+    params = {
+        'lookback_days': lookback_days, 'vol_surge_ratio': vol_surge_ratio, 'max_vol_ratio': max_vol_ratio,
+        'max_daily_vol_increase': max_daily_vol_increase, 'sustained_days': sustained_days, 'start_date': start_date,
+    }
+    return IndicatorResult.from_frame('vol', frame, panel.trade_date(panel.date_position(end_date)), params)
+
+
+def calculate_vol_indicator_from_panel(panel, start_date, end_date, lookback_days, vol_surge_ratio, max_vol_ratio, max_daily_vol_increase):
+    """
+    基于行情面板筛选放量股票，与calculate_vol_indicator的条件一致，不访问数据库，结果按量比降序排列
+
+    参数:
+    panel: 包含vol字段的MarketPanel
+    start_date: 开始日期，均量只统计该日期之后的数据
+    end_date: 结束日期，为空时使用面板中最新日期
+    lookback_days: 计算均量的天数（不含当日）
+    vol_surge_ratio: 当日成交量相对均量的最小倍数
+    max_vol_ratio: 当日成交量相对均量的最大倍数
+    max_daily_vol_increase: 当日成交量相对前一日的最大倍数
+    """
+    result = calculate_vol_result(panel, end_date, lookback_days, vol_surge_ratio, max_vol_ratio, max_daily_vol_increase,
+                                  start_date=start_date)
+    return result.to_rows(['name', 'ts_code'])
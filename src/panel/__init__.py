@@ -0,0 +1,3 @@
+"""
+In-memory market data structures shared by the indicators.
+"""
@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from src.entities.stock_entity import StockEntity
+from src.entities.temp_stock_hq import TempStockHQEntity
+from src.utils.data_processing import parse_date
+
+# 行情表中可以加载到面板的数值字段
+PANEL_FIELDS = [
+    'open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount',
+    'ma5', 'ma_v_5', 'ma10', 'ma_v_10', 'ma20', 'ma_v_20',
+    'ma30', 'ma_v_30', 'ma60', 'ma_v_60', 'ma120', 'ma_v_120',
+]
+
+
+class MarketPanel:
+    """
+    全市场行情面板：股票 × 交易日 × 字段
+    每个字段是一个形状为(股票数, 交易日数)的float64数组，缺失值为NaN，
+    股票和交易日都按升序排列并用整数下标访问，附带股票名称和行业等基础信息
+
+    参数:
+    codes: 股票代码列表（带交易所后缀）
+    dates: 交易日列表
+    data: 字段名到二维数组的字典
+    stock_info: 以ts_code为索引、包含name和industry列的DataFrame
+    """
+
+    def __init__(self, codes, dates, data, stock_info=None):
+        self.codes = np.asarray(codes, dtype=object)
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.data = data
+        self._code_index = {code: i for i, code in enumerate(self.codes)}
+        if stock_info is None:
+            stock_info = pd.DataFrame(columns=['name', 'industry'])
+        self.stock_info = stock_info.reindex(self.codes)
+        for field, values in data.items():
+            if values.shape != (len(self.codes), len(self.dates)):
+                raise ValueError(f"字段 {field} 的形状 {values.shape} 与面板形状 {self.shape} 不一致")
+
+    @classmethod
+    def from_frame(cls, df, stock_info=None, fields=None):
+        """
+        从长表格式（每行一只股票一个交易日）的DataFrame构建面板
+
+        参数:
+        df: 至少包含ts_code和trade_date列的DataFrame
+        stock_info: 股票基础信息，参见构造函数
+        fields: 需要放入面板的字段，默认为df中所有PANEL_FIELDS字段
+        """
+        fields = fields or [field for field in PANEL_FIELDS if field in df.columns]
+        trade_dates = pd.to_datetime(df['trade_date']).values.astype('datetime64[D]')
+        codes, code_pos = np.unique(df['ts_code'].astype(str).values, return_inverse=True)
+        dates, date_pos = np.unique(trade_dates, return_inverse=True)
+
+        data = {}
+        for field in fields:
+            values = np.full((len(codes), len(dates)), np.nan)
+            values[code_pos, date_pos] = pd.to_numeric(df[field], errors='coerce').astype(float).values
+            data[field] = values
+        return cls(codes, dates, data, stock_info)
+
+    @classmethod
+    def load(cls, session, entity=TempStockHQEntity, fields=None, end_date=None, window=None, start_date=None):
+        """
+        一次查询从行情表加载面板，并一次查询附加股票基础信息
+
+        参数:
+        session: 数据库会话
+        entity: 行情表实体，TempStockHQEntity或StockDailyHQEntity
+        fields: 需要加载的字段，默认为全部PANEL_FIELDS
+        end_date: 结束日期，默认为表中最新日期
+        window: 加载截至end_date的最近window个交易日，与start_date二选一
+        start_date: 开始日期
+        """
+        fields = fields or PANEL_FIELDS
+        trade_date = entity.trade_date
+        conditions = []
+        if end_date:
+            conditions.append(trade_date <= parse_date(end_date))
+        if window:
+            # 先找出窗口内最早的交易日，再按日期范围取数，避免逐只股票排序
+            first_date_query = select(trade_date).distinct().where(*conditions) \
+                .order_by(trade_date.desc()).offset(window - 1).limit(1)
+            first_date = session.execute(first_date_query).scalar()
+            if first_date is not None:
+                conditions.append(trade_date >= first_date)
+        elif start_date:
+            conditions.append(trade_date >= parse_date(start_date))
+
+        columns = [entity.ts_code, trade_date] + [getattr(entity, field) for field in fields]
+        query = select(*columns).where(*conditions)
+        rows = session.execute(query).all()
+        df = pd.DataFrame(rows, columns=['ts_code', 'trade_date'] + list(fields))
+        return cls.from_frame(df, load_stock_info(session), fields)
+
+    @property
+    def shape(self):
+        return len(self.codes), len(self.dates)
+
+    @property
+    def fields(self):
+        return list(self.data.keys())
+
+    def __getitem__(self, field):
+        return self.data[field]
+
+    def __contains__(self, field):
+        return field in self.data
+
+    def date_position(self, end_date=None):
+        """
+        返回不晚于end_date的最后一个交易日的下标，end_date为空时返回最新交易日的下标
+        """
+        if len(self.dates) == 0:
+            raise ValueError("面板中没有任何交易日数据")
+        if not end_date:
+            return len(self.dates) - 1
+        position = np.searchsorted(self.dates, np.datetime64(parse_date(end_date), 'D'), side='right') - 1
+        if position < 0:
+            raise ValueError(f"面板中没有 {end_date} 及之前的交易日数据")
+        return int(position)
+
+    def trade_date(self, position):
+        """
+        返回指定下标的交易日（datetime.date）
+        """
+        return self.dates[position].astype(object)
+
+    def code_position(self, ts_code):
+        """
+        返回股票代码的下标，不存在时返回None
+        """
+        return self._code_index.get(ts_code)
+
+    def window_start(self, end_position, length):
+        """
+        返回以end_position结束、长度为length的交易日窗口的起始下标（不足时从0开始）
+        """
+        return max(0, end_position - length + 1)
+
+    def exclude_mask(self, pattern='BJ'):
+        """
+        返回股票代码中不包含pattern的布尔掩码，默认排除北交所股票
+        """
+        return np.array([pattern not in code for code in self.codes], dtype=bool)
+
+    def has_row(self, position=None):
+        """
+        返回股票在交易日是否有行情记录的布尔数组（以收盘价非空判断）
+        """
+        present = ~np.isnan(self.data['close'])
+        return present if position is None else present[:, position]
+
+    def stock_meta(self, ts_code, default=('', '')):
+        """
+        返回股票的(名称, 行业)
+        """
+        if ts_code not in self.stock_info.index:
+            return default
+        name, industry = self.stock_info.loc[ts_code, ['name', 'industry']]
+        if pd.isna(name) and pd.isna(industry):
+            return default
+        return name, industry
+
+    def slice_dates(self, start_position, end_position):
+        """
+        返回包含[start_position, end_position]交易日的子面板，数组为原面板的视图，不复制数据
+        """
+        window = slice(start_position, end_position + 1)
+        data = {field: values[:, window] for field, values in self.data.items()}
+        return MarketPanel(self.codes, self.dates[window], data, self.stock_info)
+
+
+def load_stock_info(session):
+    """
+    一次查询获取全部股票的名称和行业
+
+    返回:
+    DataFrame: 以ts_code为索引，包含name和industry列
+    """
+    rows = session.execute(select(StockEntity.ts_code, StockEntity.name, StockEntity.industry)).all()
+    return pd.DataFrame(rows, columns=['ts_code', 'name', 'industry']).set_index('ts_code')
+
+
+def required_window(*lengths):
+    """
+    多个指标共用一个面板时需要加载的交易日数量
+    """
+    return max(int(length) for length in lengths if length)
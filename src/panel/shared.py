@@ -0,0 +1,66 @@
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from src.panel.market_panel import MarketPanel
+
+
+class SharedPanel:
+    """
+    把面板的数值字段复制到一块共享内存中，供进程池中的多个工作进程只读使用：
+    主进程只复制一次，各工作进程通过descriptor按名称映射同一块内存，不会为每个进程复制面板
+
+    参数:
+    panel: MarketPanel
+    fields: 需要共享的字段，默认为面板中的全部字段
+    """
+
+    def __init__(self, panel, fields=None):
+        fields = list(fields or panel.fields)
+        stock_count, date_count = panel.shape
+        size = max(len(fields) * stock_count * date_count * np.dtype(np.float64).itemsize, 1)
+        self._shm = SharedMemory(create=True, size=size)
+        values = np.ndarray((len(fields), stock_count, date_count), dtype=np.float64, buffer=self._shm.buf)
+        for i, field in enumerate(fields):
+            values[i] = panel[field]
+        del values
+        self.descriptor = {
+            'name': self._shm.name,
+            'fields': fields,
+            'codes': panel.codes,
+            'dates': panel.dates,
+            'stock_info': panel.stock_info,
+        }
+
+    def close(self):
+        """
+        释放共享内存，所有使用该内存的进程结束后调用
+        """
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+
+def attach_shared_panel(descriptor):
+    """
+    在工作进程中按descriptor映射共享内存并构建只读的MarketPanel，数组直接引用共享内存，不复制数据
+
+    返回:
+    (panel, shm)：调用方需要在使用panel期间持有shm的引用
+    """
+    try:
+        # Python 3.13起可以关闭资源跟踪，避免工作进程退出时误删主进程创建的共享内存
+        shm = SharedMemory(name=descriptor['name'], track=False)
+    except TypeError:
+        shm = SharedMemory(name=descriptor['name'])
+    fields = descriptor['fields']
+    shape = (len(fields), len(descriptor['codes']), len(descriptor['dates']))
+    values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    values.flags.writeable = False
+    data = {field: values[i] for i, field in enumerate(fields)}
+    return MarketPanel(descriptor['codes'], descriptor['dates'], data, descriptor['stock_info']), shm
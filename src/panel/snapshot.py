@@ -0,0 +1,150 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from src.entities.temp_stock_hq import TempStockHQEntity
+from src.panel.market_panel import MarketPanel, PANEL_FIELDS
+from src.utils.data_processing import get_data_version
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def get_snapshot_dir():
+    """
+    快照根目录，可通过环境变量STOCKS_SNAPSHOT_DIR修改，默认为当前目录下的.cache/snapshots
+    """
+    return os.environ.get('STOCKS_SNAPSHOT_DIR', os.path.join(os.getcwd(), '.cache', 'snapshots'))
+
+
+def _snapshot_name(table_name, window, last_trade_date):
+    return f"{table_name}-{window or 'all'}-{last_trade_date}"
+
+
+def write_snapshot(panel, path, data_version, window=None):
+    """
+    将面板写成列式快照：每个字段一个.npy文件，代码、日期和基础信息写入manifest.json
+    先写入临时目录再整体替换，读取方不会看到写了一半的快照
+
+    参数:
+    panel: 要保存的MarketPanel
+    path: 快照目录
+    data_version: 生成快照时的数据版本，参见get_data_version
+    window: 面板对应的交易日窗口长度
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    for field in panel.fields:
+        np.save(os.path.join(tmp_path, f"{field}.npy"), np.ascontiguousarray(panel[field], dtype=np.float64))
+    stock_info = panel.stock_info.astype(object).where(pd.notnull(panel.stock_info), None)
+    manifest = {
+        'table': data_version['table'],
+        'window': window,
+        'last_trade_date': data_version['max_trade_date'],
+        'data_version': data_version,
+        'fields': panel.fields,
+        'codes': [str(code) for code in panel.codes],
+        'dates': [str(value) for value in panel.dates],
+        'names': stock_info['name'].tolist(),
+        'industries': stock_info['industry'].tolist(),
+    }
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_manifest(path):
+    """
+    读取快照的manifest，快照不存在时返回None
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_snapshot(path, fields=None, manifest=None):
+    """
+    以内存映射方式打开快照，字段数组直接映射文件内容，不做复制
+
+    参数:
+    path: 快照目录
+    fields: 需要的字段，默认为快照中的全部字段
+    manifest: 已读取的manifest，避免重复读取
+    """
+    manifest = manifest or read_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f"快照 {path} 不存在")
+    fields = fields or manifest['fields']
+    data = {field: np.load(os.path.join(path, f"{field}.npy"), mmap_mode='r') for field in fields}
+    stock_info = pd.DataFrame(
+        {'name': manifest['names'], 'industry': manifest['industries']},
+        index=pd.Index(manifest['codes'], name='ts_code'),
+    )
+    return MarketPanel(manifest['codes'], np.array(manifest['dates'], dtype='datetime64[D]'), data, stock_info)
+
+
+def remove_stale_snapshots(table_name, window, keep_path, root=None):
+    """
+    删除同一张表、同一窗口长度下除keep_path以外的旧快照
+    """
+    root = root or get_snapshot_dir()
+    if not os.path.isdir(root):
+        return
+    prefix = f"{table_name}-{window or 'all'}-"
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith(prefix) and os.path.abspath(path) != os.path.abspath(keep_path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def save_table_snapshot(session, entity=TempStockHQEntity, window=None, fields=None, root=None):
+    """
+    从数据库加载面板并写入快照
+
+    返回:
+    (MarketPanel, 快照目录)
+    """
+    root = root or get_snapshot_dir()
+    data_version = get_data_version(session, entity)
+    panel = MarketPanel.load(session, entity, fields=fields or PANEL_FIELDS, window=window)
+    path = os.path.join(root, _snapshot_name(entity.__tablename__, window, data_version['max_trade_date']))
+    os.makedirs(root, exist_ok=True)
+    write_snapshot(panel, path, data_version, window)
+    remove_stale_snapshots(entity.__tablename__, window, path, root)
+    return panel, path
+
+
+def load_market_panel(session, entity=TempStockHQEntity, window=None, end_date=None, fields=None, root=None):
+    """
+    优先从快照加载面板：数据版本（最新交易日、记录数、校验和）与数据库一致时直接内存映射快照，
+    否则从数据库重新加载并刷新快照
+
+    参数:
+    session: 数据库会话
+    entity: 行情表实体
+    window: 快照对应的交易日窗口长度，默认为整张表（临时表本身就是一个窗口）
+    end_date: 返回的面板截至的日期，默认为最新交易日
+    fields: 需要的字段，默认为全部PANEL_FIELDS
+    root: 快照根目录
+    """
+    root = root or get_snapshot_dir()
+    data_version = get_data_version(session, entity)
+    path = os.path.join(root, _snapshot_name(entity.__tablename__, window, data_version['max_trade_date']))
+    manifest = read_manifest(path)
+    needed_fields = fields or PANEL_FIELDS
+
+    if manifest and manifest['data_version'] == data_version and set(needed_fields) <= set(manifest['fields']):
+        panel = load_snapshot(path, needed_fields, manifest)
+    else:
+        panel, path = save_table_snapshot(session, entity, window, needed_fields, root)
+
+    if end_date:
+        panel = panel.slice_dates(0, panel.date_position(end_date))
+    return panel
@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from src.db.database import get_session
+from src.entities.stock_daily_hq import StockDailyHQEntity
+from src.entities.stock_rps import StockRPSEntity
+from src.indicators.rps import calculate_rps_history, RPS_HORIZONS
+from src.panel.market_panel import MarketPanel
+from src.service.stock_service import bulk_upsert_data
+from src.utils.data_processing import parse_date, to_sql_date
+
+# RPS的两种计算方式：区间首日开盘价或前收盘价
+RPS_METHODS = ['open', 'pre_close']
+
+# 计算RPS需要的行情字段
+RPS_FIELDS = ['open', 'pre_close', 'close']
+
+def save_rps_history(panel, horizons=RPS_HORIZONS, methods=RPS_METHODS, start_date=None, batch_size=10000):
+    """
+    计算面板中每个交易日的RPS并写入t_stock_rps，已存在的记录会被更新
+
+    参数:
+    panel: 包含open、pre_close和close的MarketPanel
+    horizons: RPS统计周期列表
+    methods: 计算方式列表，可选值为'open'和'pre_close'
+    start_date: 只写入该日期及之后的交易日，默认为面板中的全部交易日
+    batch_size: 每批提交的行数
+
+    返回:
+    写入的行数
+    """
+    total = 0
+    for method in methods:
+        history = calculate_rps_history(panel, horizons, method == 'pre_close', start_date)
+        if history.empty:
+            continue
+        history['method'] = method
+        history['trade_date'] = pd.to_datetime(history['trade_date']).dt.strftime('%Y-%m-%d')
+        total += bulk_upsert_data(history, StockRPSEntity.__tablename__, batch_size)
+    return total
+
+def backfill_stock_rps(start_date=None, end_date=None, horizons=RPS_HORIZONS, methods=RPS_METHODS, chunk_days=60):
+    """
+    从日线表回填历史RPS：一次加载日线面板，按交易日分段向量化计算并批量写入，
+    每段额外带上最长周期所需的历史交易日，结果与逐日计算一致
+
+    参数:
+    start_date: 回填的开始日期，默认为日线表中最早可计算的日期
+    end_date: 回填的结束日期，默认为日线表中最新日期
+    horizons: RPS统计周期列表
+    methods: 计算方式列表
+    chunk_days: 每段计算的交易日数，用于控制内存占用
+
+    返回:
+    写入的行数
+    """
+    session = get_session()
+    try:
+        panel = MarketPanel.load(session, StockDailyHQEntity, fields=RPS_FIELDS, end_date=end_date)
+    finally:
+        session.close()
+    if len(panel.dates) == 0:
+        print("日线表中没有可用的数据")
+        return 0
+
+    first_pos = 0
+    if start_date:
+        first_pos = int(np.searchsorted(panel.dates, np.datetime64(parse_date(start_date), 'D')))
+    history_days = max(int(horizon) for horizon in horizons) - 1
+
+    total = 0
+    for chunk_start in range(first_pos, len(panel.dates), chunk_days):
+        chunk_end = min(chunk_start + chunk_days, len(panel.dates)) - 1
+        chunk = panel.slice_dates(max(0, chunk_start - history_days), chunk_end)
+        count = save_rps_history(chunk, horizons, methods, start_date=panel.trade_date(chunk_start))
+        total += count
+        print(f"已回填 {panel.trade_date(chunk_start)} 至 {panel.trade_date(chunk_end)} 的RPS，共 {count} 条记录")
+    print(f"RPS回填完成！共写入 {total} 条记录")
+    return total
+
+def update_stock_rps(trade_date=None, horizons=RPS_HORIZONS, methods=RPS_METHODS):
+    """
+    增量更新RPS：只加载最长周期所需的交易日，计算并写入最新（或指定）一个交易日的RPS
+
+    参数:
+    trade_date: 要计算的交易日，默认为日线表中最新日期
+    horizons: RPS统计周期列表
+    methods: 计算方式列表
+
+    返回:
+    写入的行数
+    """
+    session = get_session()
+    try:
+        window = max(int(horizon) for horizon in horizons)
+        panel = MarketPanel.load(session, StockDailyHQEntity, fields=RPS_FIELDS, end_date=trade_date, window=window)
+    finally:
+        session.close()
+    if len(panel.dates) == 0:
+        print("日线表中没有可用的数据")
+        return 0
+
+    latest_date = panel.trade_date(len(panel.dates) - 1)
+    count = save_rps_history(panel, horizons, methods, start_date=latest_date)
+    print(f"RPS增量更新完成！{latest_date} 共写入 {count} 条记录")
+    return count
+
+def get_rps_streaks(session, end_date, rps_interval, rps_threshold=90, use_pre_close=False):
+    """
+    统计截至end_date时RPS不低于阈值的股票已连续达标的天数、本轮进入的日期以及历史上首次进入的日期
+
+    参数:
+    session: 数据库会话
+    end_date: 统计截止日期
+    rps_interval: RPS统计周期
+    rps_threshold: RPS阈值
+    use_pre_close: 为True时使用按前收盘价计算的RPS
+
+    返回:
+    DataFrame: 包含ts_code, rps, streak_days, streak_start, first_entry_date, total_days列，按连续天数降序排列
+    """
+    table_name = StockRPSEntity.__tablename__
+    params = {
+        'end_date': to_sql_date(end_date),
+        'rps_interval': int(rps_interval),
+        'method': 'pre_close' if use_pre_close else 'open',
+        'rps_threshold': rps_threshold,
+    }
+    # 一次查询取出截止日达标股票的全部历史
+    query = f'''
+    SELECT history.ts_code, history.trade_date, history.rps
+    FROM {table_name} history
+    WHERE history.rps_interval = :rps_interval AND history.method = :method
+      AND history.trade_date <= :end_date
+      AND history.ts_code IN (
+          SELECT ts_code FROM {table_name}
+          WHERE trade_date = :end_date AND rps_interval = :rps_interval
+            AND method = :method AND rps >= :rps_threshold
+      )
+    '''
+    rows = session.execute(text(query), params).all()
+    columns = ['ts_code', 'rps', 'streak_days', 'streak_start', 'first_entry_date', 'total_days']
+    if not rows:
+        return pd.DataFrame(columns=columns)
+
+    history = pd.DataFrame(rows, columns=['ts_code', 'trade_date', 'rps'])
+    history['trade_date'] = history['trade_date'].map(parse_date)
+    rps = history.pivot(index='ts_code', columns='trade_date', values='rps').sort_index(axis=1)
+    dates = np.array(rps.columns)
+    above = (rps.values >= rps_threshold)
+
+    # 最后一个未达标（或没有记录）的交易日之后即为本轮连续达标区间
+    positions = np.arange(above.shape[1])
+    last_miss = np.where(~above, positions, -1).max(axis=1)
+    streak_days = above.shape[1] - 1 - last_miss
+    result = pd.DataFrame({
+        'ts_code': rps.index,
+        'rps': rps.values[:, -1],
+        'streak_days': streak_days,
+        'streak_start': dates[last_miss + 1],
+        'first_entry_date': dates[above.argmax(axis=1)],
+        'total_days': above.sum(axis=1),
+    })
+    return result.sort_values(['streak_days', 'rps'], ascending=False, ignore_index=True)
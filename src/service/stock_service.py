@@ -1,33 +1,31 @@
 import tushare as ts
+import numpy as np
 import pandas as pd
 import time
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from sqlalchemy import text
+from sqlalchemy import text, bindparam, inspect, Float, UniqueConstraint
+from src.entities.base import Base
 from src.entities.stock_entity import StockEntity
 from src.entities.stock_daily_hq import StockDailyHQEntity
 from src.entities.temp_stock_hq import TempStockHQEntity
-from src.db.database import engine, execute_query, fetch_all, initialize_database
+from src.db.database import get_engine, get_session, execute_query, fetch_all, initialize_database, bulk_upsert, clear_table, has_unique_key
+from src.utils.data_processing import parse_date
+from src.utils.moving_average import grouped_rolling_mean, RollingMeanState
+from src.service.tushare_fetcher import get_default_fetcher
+from src.panel.snapshot import save_table_snapshot
 
 # 设置Tushare令牌
 # ts.set_token('42f603758aa591c4a8109650c5c69df91e5334236e0d1fd418770d1c')
 ts.set_token('a574d8d3eb4419cebbf1e26f59024b0623d2829456621c48ba25b7ea')
 pro = ts.pro_api()
 
-def clear_table(table_name):
-    """
-    清空指定的数据库表
-    
-    参数:
-    table_name: 要清空的表名
-    """
-    with engine.connect() as connection:
-        connection.execute(text(f"TRUNCATE TABLE {table_name}"))
-        print(f"已清空表 {table_name}")
+# 日线表中需要维护的均线周期
+MA_PERIODS = [5, 10, 20, 30, 60, 120]
 
 def write_data(df, table_name, if_exists='append', chunksize=5000):
     """
     将DataFrame写入数据库，并进行适当的数据类型转换
+    追加写入时使用批量upsert，按表的唯一键更新已存在的记录，重复执行不会产生重复数据
     
     参数:
     df: 要写入的DataFrame
@@ -37,23 +35,66 @@ def write_data(df, table_name, if_exists='append', chunksize=5000):
     """
     if df is not None and not df.empty:
         if 'trade_date' in df.columns:
-            df['trade_date'] = pd.to_datetime(df['trade_date']).dt.strftime('%Y-%m-%d')
-        
-        for col in df.columns:
-            if pd.api.types.is_float_dtype(df[col]):
-                df[col] = df[col].astype(float)
-                df[col] = df[col].where(pd.notnull(df[col]), None)
+            df['trade_date'] = pd.to_datetime(df['trade_date'].astype(str)).dt.strftime('%Y-%m-%d')
         
-        df.to_sql(table_name, con=engine, if_exists=if_exists, index=False, chunksize=chunksize, method='multi')
+        if if_exists == 'replace':
+            for col in df.columns:
+                if pd.api.types.is_float_dtype(df[col]):
+                    df[col] = df[col].astype(float)
+                    df[col] = df[col].where(pd.notnull(df[col]), None)
+            df.to_sql(table_name, con=get_engine(), if_exists=if_exists, index=False, chunksize=chunksize, method='multi')
+        else:
+            bulk_upsert_data(df, table_name, batch_size=max(chunksize, 10000))
         print(f"成功写入 {len(df)} 条记录到 {table_name}")
     else:
         print(f"没有数据可写入 {table_name}")
 
-def fetch_and_save_stock_basic_data():
+def bulk_upsert_data(df, table_name, batch_size=10000):
+    """
+    将DataFrame批量upsert到ORM中定义的表，表中不存在的列会被忽略
+    
+    参数:
+    df: 要写入的DataFrame
+    table_name: 要写入的表名
+    batch_size: 每批提交的行数
+    
+    返回:
+    写入的行数
+    """
+    table = Base.metadata.tables.get(table_name)
+    columns = list(df.columns)
+    key_columns = []
+    if table is not None:
+        # 只写入表中存在的列（例如pro_bar返回的adj_factor不在日线表中）
+        columns = [col for col in df.columns if col in table.columns and table.columns[col].autoincrement is not True]
+        for constraint in table.constraints:
+            if isinstance(constraint, UniqueConstraint):
+                key_columns.extend(col.name for col in constraint.columns)
+    
+    values = df[columns].astype(object).where(pd.notnull(df[columns]), None)
+    rows = list(values.itertuples(index=False, name=None))
+    return bulk_upsert(table_name, columns, rows, key_columns=key_columns, batch_size=batch_size)
+
+def _fetch_pro_bar(ts_code, start_date, end_date):
+    """
+    获取单只股票的日线数据（Tushare pro_bar接口，附带复权因子）
+    pro_bar内部捕获异常后只打印并返回None，这里把None转换为异常，
+    使限流调用器能够退避重试，重试用尽后进入死信列表；没有数据时pro_bar返回空DataFrame
+    """
+    df = ts.pro_bar(ts_code=ts_code, start_date=start_date, end_date=end_date, adjfactor=True)
+    if df is None:
+        raise RuntimeError(f"pro_bar获取 {ts_code} 的数据失败")
+    return df
+
+def fetch_and_save_stock_basic_data(fetcher=None):
     """
     获取并保存股票基本信息
+
+    参数:
+    fetcher: 限流调用器，默认使用共享的RateLimitedFetcher
     """
-    df = pro.stock_basic()
+    fetcher = fetcher or get_default_fetcher()
+    df = fetcher.call(pro.stock_basic)
     write_data(df, StockEntity.__tablename__, 'replace')
 
 def get_latest_trade_dates_for_all_stocks():
@@ -66,10 +107,10 @@ def get_latest_trade_dates_for_all_stocks():
     query = "SELECT ts_code, MAX(trade_date) as latest_date FROM t_stock_daily_hq GROUP BY ts_code"
     results = fetch_all(query)
     
-    latest_dates = {item['ts_code']: item['latest_date'] for item in results}
+    latest_dates = {item['ts_code']: parse_date(item['latest_date']) for item in results}
     return latest_dates
 
-def fetch_and_save_daily_trade_data(start_date, end_date, max_workers=4):
+def fetch_and_save_daily_trade_data(start_date, end_date, max_workers=4, mode='stock', daily_fetcher=None, trade_cal_fetcher=None, fetcher=None):
     """
     获取并保存指定日期范围内的股票日线数据
     
@@ -77,14 +118,35 @@ def fetch_and_save_daily_trade_data(start_date, end_date, max_workers=4):
     start_date: 开始日期，格式为'YYYYMMDD'
     end_date: 结束日期，格式为'YYYYMMDD'
     max_workers: 最大线程数，默认为4
+    mode: 获取模式，'stock'为逐只股票获取，'date'为按交易日获取全市场数据
+    daily_fetcher: 按日模式下的数据源函数，参见fetch_and_save_daily_trade_data_by_date
+    trade_cal_fetcher: 按日模式下的交易日历函数，参见fetch_and_save_daily_trade_data_by_date
+    fetcher: 限流调用器，默认使用共享的RateLimitedFetcher
+
+    返回:
+    list: 本次获取失败的任务。逐只股票模式下为股票代码（死信列表），可通过fetcher.replay_dead_letters()重放；
+          按日模式下为交易日，不进入死信列表，重新执行按日模式即可从已保存的最新交易日继续获取
     """
+    fetcher = fetcher or get_default_fetcher()
+    if mode == 'date':
+        _, failed_dates = _fetch_and_save_by_date(start_date, end_date, daily_fetcher, trade_cal_fetcher, fetcher)
+        return failed_dates
+    if mode != 'stock':
+        raise ValueError(f"不支持的获取模式 '{mode}'，请使用 'stock' 或 'date'")
+
     initialize_database()
     stocks = fetch_all("SELECT ts_code FROM t_stock_basic")
     total_stocks = len(stocks)
     latest_dates = get_latest_trade_dates_for_all_stocks()
+    # 均线在本地计算，每只股票只需要最大均线周期减一条历史记录
+    history_df = get_recent_history_for_all_stocks(None, max(MA_PERIODS) - 1)
+    if not history_df.empty:
+        history_df['trade_date'] = pd.to_datetime(history_df['trade_date']).dt.date
+    history_by_code = dict(tuple(history_df.groupby('ts_code'))) if not history_df.empty else {}
     end_date_dt = datetime.strptime(end_date, '%Y%m%d').date()
     
-    def fetch_data(stock, index):
+    def fetch_data(task):
+        index, stock = task
         ts_code = stock['ts_code']
         print(f"正在处理股票 {ts_code} ({index + 1}/{total_stocks})...")
         
@@ -93,70 +155,264 @@ def fetch_and_save_daily_trade_data(start_date, end_date, max_workers=4):
             print(f"  股票 {ts_code} 的数据已是最新 (最新: {latest_date}, 结束: {end_date_dt}).")
             return
 
-        # 确定实际需要的数据范围
-        actual_start_date = start_date
+        # 只获取数据库中没有的交易日，均线由本地历史数据计算，不再向前多取预热数据
+        fetch_start_date = start_date
         if latest_date:
-            actual_start_date = (latest_date + timedelta(days=1)).strftime('%Y%m%d')
+            fetch_start_date = (latest_date + timedelta(days=1)).strftime('%Y%m%d')
         
-        # 确定获取历史数据的起始日期
-        fetch_start_date = start_date
+        # 异常交由fetcher记录到死信列表
+        df = fetcher.call(_fetch_pro_bar, ts_code, fetch_start_date, end_date)
+        if df.empty:
+            print(f"  没有 {ts_code} 从 {fetch_start_date} 到 {end_date} 的可用数据")
+            return
         
+        # 转换日期列格式以便比较
+        df['trade_date'] = pd.to_datetime(df['trade_date'].astype(str)).dt.date
         if latest_date:
-            # 查询该股票的历史交易日期，降序排序
-            history_query = f"""
-            SELECT trade_date FROM t_stock_daily_hq 
-            WHERE ts_code = '{ts_code}' 
-            ORDER BY trade_date DESC
-            """
-            history_dates = fetch_all(history_query)
-            
-            if history_dates:
-                # 尝试获取第121个交易日的日期（如果存在）
-                if len(history_dates) >= 121:
-                    fetch_start_date_dt = history_dates[120]['trade_date']
-                    fetch_start_date = fetch_start_date_dt.strftime('%Y%m%d')
-                    print(f"  使用第121个交易日 {fetch_start_date} 作为获取数据的起始日期")
-                else:
-                    # 如果不足121个交易日，使用最早的日期
-                    fetch_start_date_dt = history_dates[-1]['trade_date']
-                    fetch_start_date = fetch_start_date_dt.strftime('%Y%m%d')
-                    print(f"  不足121个交易日，使用最早日期 {fetch_start_date} 作为获取数据的起始日期")
-            else:
-                print(f"  未找到 {ts_code} 的历史数据，使用默认起始日期 {fetch_start_date}")
-        else:
-            print(f"  {ts_code} 没有历史数据，使用默认起始日期 {fetch_start_date}")
+            df = df[df['trade_date'] > latest_date]
+        if df.empty:
+            print(f"  股票 {ts_code} 过滤后没有新数据需要保存")
+            return
         
-        try:
-            # 获取更长时间范围的数据以确保MA计算准确
-            df = ts.pro_bar(ts_code=ts_code, start_date=fetch_start_date, end_date=end_date, ma=[5, 10, 20, 30, 60, 120], adjfactor=True)
-            if df is None or df.empty:
-                print(f"  没有 {ts_code} 从 {fetch_start_date} 到 {end_date} 的可用数据")
-                return
-            
-            # 转换日期列格式以便比较
-            if 'trade_date' in df.columns:
-                df['trade_date'] = pd.to_datetime(df['trade_date']).dt.date
-                
-            # 只保留数据库中没有的日期的数据
-            if latest_date:
-                df = df[df['trade_date'] > latest_date]
-            
-            if df.empty:
-                print(f"  股票 {ts_code} 过滤后没有新数据需要保存")
-                return
-                
-            # 转换回字符串格式以便写入数据库
-            df['trade_date'] = df['trade_date'].astype(str)
-            
-            # 写入过滤后的数据
-            write_data(df, StockDailyHQEntity.__tablename__, 'append')
-        except Exception as e:
-            print(f"  获取 {ts_code} 数据时出错: {e}")
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(fetch_data, stock, index): index for index, stock in enumerate(stocks)}
-        for future in as_completed(futures):
-            future.result()
+        df = fill_ma_columns(df, history_by_code.get(ts_code, history_df.iloc[0:0]))
+        # 转换回字符串格式以便写入数据库
+        df['trade_date'] = df['trade_date'].astype(str)
+        
+        # 写入过滤后的数据
+        write_data(df, StockDailyHQEntity.__tablename__, 'append')
+
+    # 共享的调用器中可能有之前执行留下的死信，只返回本次执行失败的股票
+    dead_letter_start = fetcher.dead_letter_count()
+    fetcher.map(fetch_data, list(enumerate(stocks)), key=lambda task: task[1]['ts_code'], max_workers=max_workers)
+    failed_codes = fetcher.failed_keys(dead_letter_start)
+    if failed_codes:
+        print(f"共有 {len(failed_codes)} 支股票获取失败，可调用 fetcher.replay_dead_letters() 重放: {failed_codes[:10]}")
+    return failed_codes
+
+def _default_daily_fetcher(trade_date):
+    """
+    按交易日获取全市场日线数据（Tushare daily接口）
+    """
+    return pro.daily(trade_date=trade_date)
+
+def _default_trade_cal_fetcher(start_date, end_date):
+    """
+    获取指定区间内的交易日列表（Tushare trade_cal接口）
+    """
+    df = pro.trade_cal(exchange='SSE', start_date=start_date, end_date=end_date, is_open='1')
+    if df is None or df.empty:
+        return []
+    return sorted(df['cal_date'].astype(str).tolist())
+
+def get_recent_history_for_all_stocks(before_date, limit):
+    """
+    一次性获取所有股票在指定日期之前最近的若干条收盘价和成交量记录，用于计算均线
+
+    参数:
+    before_date: 截止日期（不含），datetime.date对象，为None时取每只股票最新的记录
+    limit: 每只股票最多获取的记录数
+
+    返回:
+    DataFrame: 包含ts_code, trade_date, close, vol列
+    """
+    where_clause = "WHERE trade_date < :before_date" if before_date else ""
+    query = f"""
+    SELECT ts_code, trade_date, close, vol FROM (
+        SELECT ts_code, trade_date, close, vol,
+               ROW_NUMBER() OVER (PARTITION BY ts_code ORDER BY trade_date DESC) as row_num
+        FROM t_stock_daily_hq
+        {where_clause}
+    ) subquery
+    WHERE row_num <= :limit
+    """
+    params = {'limit': limit}
+    if before_date:
+        params['before_date'] = before_date.strftime('%Y-%m-%d')
+    return pd.read_sql(text(query), con=get_engine(), params=params)
+
+def fill_ma_columns(new_df, history_df):
+    """
+    将新获取的日线数据与历史数据拼接，按股票计算均线和均量列
+    全部股票共用一次累积和计算，参见grouped_rolling_mean
+
+    参数:
+    new_df: 新获取的日线数据，trade_date为datetime.date
+    history_df: 历史数据，至少包含ts_code, trade_date, close, vol列
+
+    返回:
+    DataFrame: 补充了ma{n}和ma_v_{n}列的新数据
+    """
+    history_df = history_df[['ts_code', 'trade_date', 'close', 'vol']].copy()
+    history_df['_is_new'] = False
+    new_df = new_df.copy()
+    new_df['_is_new'] = True
+
+    combined = pd.concat([history_df, new_df], ignore_index=True)
+    combined = combined.sort_values(['ts_code', 'trade_date']).reset_index(drop=True)
+    codes = combined['ts_code'].values
+    for n in MA_PERIODS:
+        combined[f'ma{n}'] = grouped_rolling_mean(codes, combined['close'].values, n)
+        combined[f'ma_v_{n}'] = grouped_rolling_mean(codes, combined['vol'].values, n)
+
+    result = combined[combined['_is_new']].drop(columns=['_is_new'])
+    return result.reset_index(drop=True)
+
+def fill_ma_columns_incremental(new_df, history_df):
+    """
+    按交易日逐日追加新数据并增量更新均线和均量，每只股票每个交易日只需O(1)的计算
+    适用于按日获取全市场数据的场景，结果与fill_ma_columns一致
+
+    参数:
+    new_df: 新获取的日线数据，trade_date为datetime.date
+    history_df: 历史数据，至少包含ts_code, trade_date, close, vol列
+
+    返回:
+    DataFrame: 补充了ma{n}和ma_v_{n}列的新数据
+    """
+    history_df = history_df.sort_values(['ts_code', 'trade_date'])
+    close_state = RollingMeanState.from_history(MA_PERIODS, history_df['ts_code'].values, history_df['close'].values)
+    vol_state = RollingMeanState.from_history(MA_PERIODS, history_df['ts_code'].values, history_df['vol'].values)
+
+    frames = []
+    for _, day_df in new_df.sort_values(['trade_date', 'ts_code']).groupby('trade_date', sort=True):
+        day_df = day_df.copy()
+        codes = day_df['ts_code'].tolist()
+        close_ma = close_state.update(codes, day_df['close'].values)
+        vol_ma = vol_state.update(codes, day_df['vol'].values)
+        for k, n in enumerate(MA_PERIODS):
+            day_df[f'ma{n}'] = close_ma[:, k]
+            day_df[f'ma_v_{n}'] = vol_ma[:, k]
+        frames.append(day_df)
+    return pd.concat(frames, ignore_index=True)
+
+def rebuild_ma_columns(start_date=None, batch_size=10000):
+    """
+    根据日线表中已保存的收盘价和成交量重新计算均线和均量列，无需重新下载历史数据
+    修改MA_PERIODS（并在实体中增加对应列）后执行即可补齐新周期的均线
+    只写入均线列，依赖(ts_code, trade_date)唯一键更新已有记录，缺少唯一键时直接报错
+
+    参数:
+    start_date: 只更新该日期及之后的记录，默认为全部记录；只读取该日期之后的记录以及每只股票之前最近的
+                最大均线周期减一条记录
+    batch_size: 每批提交的行数
+
+    返回:
+    更新的记录数
+    """
+    table_name = StockDailyHQEntity.__tablename__
+    if not has_unique_key(table_name, ['ts_code', 'trade_date']):
+        raise RuntimeError(f"表 {table_name} 缺少(ts_code, trade_date)唯一键，只写入均线列会插入缺少行情的新记录，"
+                           f"请先执行src.db.migrations中的add_daily_hq_unique_key()")
+
+    if start_date:
+        start_date = parse_date(start_date)
+        query = f"SELECT ts_code, trade_date, close, vol FROM {table_name} WHERE trade_date >= :start_date"
+        df = pd.read_sql(text(query), con=get_engine(), params={'start_date': start_date.strftime('%Y-%m-%d')})
+        history_df = get_recent_history_for_all_stocks(start_date, max(MA_PERIODS) - 1)
+        df = pd.concat([history_df, df], ignore_index=True)
+    else:
+        df = pd.read_sql(text(f"SELECT ts_code, trade_date, close, vol FROM {table_name}"), con=get_engine())
+    if df.empty:
+        print("日线表中没有可用的数据")
+        return 0
+    df['trade_date'] = df['trade_date'].map(parse_date)
+    df = df.sort_values(['ts_code', 'trade_date']).reset_index(drop=True)
+    codes = df['ts_code'].values
+    for n in MA_PERIODS:
+        df[f'ma{n}'] = grouped_rolling_mean(codes, df['close'].values, n)
+        df[f'ma_v_{n}'] = grouped_rolling_mean(codes, df['vol'].values, n)
+    if start_date:
+        df = df[df['trade_date'] >= start_date]
+    df = df.drop(columns=['close', 'vol'])
+    df['trade_date'] = df['trade_date'].astype(str)
+    count = bulk_upsert_data(df, table_name, batch_size)
+    print(f"均线重新计算完成！更新了 {count} 条记录")
+    return count
+
+def fetch_and_save_daily_trade_data_by_date(start_date, end_date, daily_fetcher=None, trade_cal_fetcher=None, fetcher=None):
+    """
+    按交易日获取全市场日线数据并保存，每个交易日只发起一次请求
+    从数据库中最新交易日的下一天开始获取，直到结束日期，并基于已有历史数据计算均线
+
+    参数:
+    start_date: 数据库为空时使用的开始日期，格式为'YYYYMMDD'
+    end_date: 结束日期，格式为'YYYYMMDD'
+    daily_fetcher: 数据源函数，接收'YYYYMMDD'格式的交易日，返回该日全市场日线DataFrame，默认使用Tushare daily接口
+    trade_cal_fetcher: 交易日历函数，接收开始和结束日期，返回'YYYYMMDD'格式的交易日列表，默认使用Tushare trade_cal接口
+    fetcher: 限流调用器，默认使用共享的RateLimitedFetcher
+
+    返回:
+    int: 写入的记录数
+
+    获取失败的交易日不会留在死信列表中：均线依赖连续的交易日，单独重放某一天无法计算并写入，
+    重新执行本函数即可从已保存的最新交易日继续获取
+    """
+    return _fetch_and_save_by_date(start_date, end_date, daily_fetcher, trade_cal_fetcher, fetcher)[0]
+
+def _fetch_and_save_by_date(start_date, end_date, daily_fetcher=None, trade_cal_fetcher=None, fetcher=None):
+    """
+    按日获取并保存的实现，参数同fetch_and_save_daily_trade_data_by_date
+
+    返回:
+    (写入的记录数, 获取失败的交易日列表)
+    """
+    daily_fetcher = daily_fetcher or _default_daily_fetcher
+    trade_cal_fetcher = trade_cal_fetcher or _default_trade_cal_fetcher
+    fetcher = fetcher or get_default_fetcher()
+
+    initialize_database()
+    latest_date = parse_date(fetch_all("SELECT MAX(trade_date) as latest_date FROM t_stock_daily_hq")[0]['latest_date'])
+    fetch_start_date = start_date
+    if latest_date:
+        fetch_start_date = (latest_date + timedelta(days=1)).strftime('%Y%m%d')
+    if fetch_start_date > end_date:
+        print(f"日线数据已是最新 (最新: {latest_date}, 结束: {end_date}).")
+        return 0, []
+
+    trade_dates = fetcher.call(trade_cal_fetcher, fetch_start_date, end_date)
+    if not trade_dates:
+        print(f"{fetch_start_date} 到 {end_date} 之间没有交易日")
+        return 0, []
+
+    def fetch_day(trade_date):
+        print(f"正在获取交易日 {trade_date} 的全市场数据...")
+        return fetcher.call(daily_fetcher, trade_date)
+
+    dead_letter_start = fetcher.dead_letter_count()
+    day_frames = fetcher.map(fetch_day, trade_dates)
+    # 单独重放fetch_day只会重新下载而不会保存，失败的交易日由下次执行时继续获取
+    fetcher.remove_dead_letters(dead_letter_start)
+    failed_dates = sorted(trade_date for trade_date in trade_dates if trade_date not in day_frames)
+    if failed_dates:
+        # 中间缺少交易日会导致均线错位，只写入第一个失败日之前的数据
+        print(f"交易日 {failed_dates} 获取失败，本次只保存 {failed_dates[0]} 之前的数据，重新执行按日模式即可继续获取")
+        trade_dates = [trade_date for trade_date in trade_dates if trade_date < failed_dates[0]]
+
+    frames = []
+    for trade_date in trade_dates:
+        df = day_frames.get(trade_date)
+        if df is None or df.empty:
+            print(f"  没有 {trade_date} 的可用数据")
+            continue
+        frames.append(df)
+
+    if not frames:
+        print(f"没有 {fetch_start_date} 到 {end_date} 的可用数据")
+        return 0, failed_dates
+
+    new_df = pd.concat(frames, ignore_index=True)
+    new_df['trade_date'] = pd.to_datetime(new_df['trade_date'].astype(str)).dt.date
+    first_date = new_df['trade_date'].min()
+
+    # 每只股票只需要最大均线周期减一条历史记录即可计算所有均线
+    history_df = get_recent_history_for_all_stocks(first_date, max(MA_PERIODS) - 1)
+    if not history_df.empty:
+        history_df['trade_date'] = pd.to_datetime(history_df['trade_date']).dt.date
+    df = fill_ma_columns_incremental(new_df, history_df)
+    df['trade_date'] = df['trade_date'].astype(str)
+
+    write_data(df, StockDailyHQEntity.__tablename__, 'append')
+    return len(df), failed_dates
 
 def identify_stocks_with_insufficient_data(min_records=5):
     """
@@ -172,9 +428,9 @@ def identify_stocks_with_insufficient_data(min_records=5):
     SELECT ts_code, COUNT(*) as record_count
     FROM t_stock_daily_hq
     GROUP BY ts_code
-    HAVING COUNT(*) <= %s
+    HAVING COUNT(*) <= :min_records
     """
-    results = fetch_all(query, (min_records,))
+    results = fetch_all(query, {'min_records': min_records})
     stocks_with_insufficient_data = [item['ts_code'] for item in results]
     print(f"发现 {len(stocks_with_insufficient_data)} 支股票的日线记录少于 {min_records} 条")
     return stocks_with_insufficient_data
@@ -198,7 +454,7 @@ def get_all_stocks_without_data():
     print(f"发现 {len(stocks_without_data)} 支股票没有日线数据")
     return stocks_without_data
 
-def fetch_and_save_complete_data(stock_list, start_date, end_date):
+def fetch_and_save_complete_data(stock_list, start_date, end_date, max_workers=10, fetcher=None):
     """
     为指定股票列表获取并保存完整的历史日线数据
     
@@ -206,21 +462,35 @@ def fetch_and_save_complete_data(stock_list, start_date, end_date):
     stock_list: 需要获取数据的股票代码列表
     start_date: 开始日期，格式为'YYYYMMDD'
     end_date: 结束日期，格式为'YYYYMMDD'
+    max_workers: 最大线程数，默认为10
+    fetcher: 限流调用器，默认使用共享的RateLimitedFetcher
+
+    返回:
+    list: 获取失败的股票代码（死信列表）
     """
+    fetcher = fetcher or get_default_fetcher()
+    # 开始日期之前已有的记录用于本地计算均线
+    history_df = get_recent_history_for_all_stocks(datetime.strptime(start_date, '%Y%m%d').date(), max(MA_PERIODS) - 1)
+    if not history_df.empty:
+        history_df['trade_date'] = pd.to_datetime(history_df['trade_date']).dt.date
+    history_by_code = dict(tuple(history_df.groupby('ts_code'))) if not history_df.empty else {}
+
     def fetch_data(ts_code):
-        try:
-            df = ts.pro_bar(ts_code=ts_code, start_date=start_date, end_date=end_date, ma=[5, 10, 20, 30, 60, 120],adjfactor=True)
-            if df is None or df.empty:
-                print(f"没有 {ts_code} 从 {start_date} 到 {end_date} 的可用数据")
-                return
-            write_data(df, StockDailyHQEntity.__tablename__, 'append')
-        except Exception as e:
-            print(f"获取 {ts_code} 数据时出错: {e}")
-
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(fetch_data, ts_code) for ts_code in stock_list]
-        for future in as_completed(futures):
-            future.result()
+        df = fetcher.call(_fetch_pro_bar, ts_code, start_date, end_date)
+        if df.empty:
+            print(f"没有 {ts_code} 从 {start_date} 到 {end_date} 的可用数据")
+            return
+        df['trade_date'] = pd.to_datetime(df['trade_date'].astype(str)).dt.date
+        df = fill_ma_columns(df, history_by_code.get(ts_code, history_df.iloc[0:0]))
+        df['trade_date'] = df['trade_date'].astype(str)
+        write_data(df, StockDailyHQEntity.__tablename__, 'append')
+
+    dead_letter_start = fetcher.dead_letter_count()
+    fetcher.map(fetch_data, stock_list, max_workers=max_workers)
+    failed_codes = fetcher.failed_keys(dead_letter_start)
+    if failed_codes:
+        print(f"共有 {len(failed_codes)} 支股票获取失败，可调用 fetcher.replay_dead_letters() 重放: {failed_codes[:10]}")
+    return failed_codes
 
 def complete_stock_data(min_records=5, start_date='20240901', end_date='20250307'):
     """
@@ -243,24 +513,160 @@ def complete_stock_data(min_records=5, start_date='20240901', end_date='20250307
     fetch_and_save_complete_data(stocks_to_process, start_date, end_date)
     print("数据补充完成！")
 
-def init_temp_stock_hq_data(limit=30):
+def _temp_stock_hq_columns():
     """
-    从日线表中更新临时表数据
-    规则是对每一个股票选取n条记录，n默认为30
+    临时表中需要从日线表复制的列（不含自增ID）
     """
+    return [column.name for column in TempStockHQEntity.__table__.columns if column.name != 'id']
+
+def _ensure_temp_stock_hq_schema():
+    """
+    旧版本用to_sql(if_exists='replace')重建过临时表，会丢失索引并多出row_num列，
+    检测到这种情况时按ORM定义重新建表
+
+    返回:
+    bool: 是否新建了表（新建的表为空）
+    """
+    table = TempStockHQEntity.__table__
+    inspector = inspect(get_engine())
+    if inspector.has_table(table.name):
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        if existing_columns == {column.name for column in table.columns}:
+            return False
+        table.drop(bind=get_engine())
+        print(f"表 {table.name} 的结构与ORM定义不一致，已重新创建")
+    table.create(bind=get_engine())
+    return True
+
+def _rebuild_temp_stock_hq_data(limit):
+    """
+    清空临时表并从日线表中为每只股票复制最近limit条记录
+    """
+    _ensure_temp_stock_hq_schema()
     clear_table(TempStockHQEntity.__tablename__)
 
+    columns = ', '.join(_temp_stock_hq_columns())
     query = f"""
-    SELECT * FROM (
+    INSERT INTO {TempStockHQEntity.__tablename__} ({columns})
+    SELECT {columns} FROM (
         SELECT *, ROW_NUMBER() OVER (PARTITION BY ts_code ORDER BY trade_date DESC) as row_num
-        FROM t_stock_daily_hq
+        FROM {StockDailyHQEntity.__tablename__}
     ) subquery
-    WHERE row_num <= {limit}
+    WHERE row_num <= :limit
     """
-    df = pd.read_sql(query, con=engine)
-    if df is None or df.empty:
-        print("没有可用的数据")
-        return
+    with get_engine().begin() as connection:
+        inserted = connection.execute(text(query), {'limit': limit}).rowcount
+    return inserted
+
+def _refresh_temp_stock_hq_data(limit, latest_date):
+    """
+    增量刷新临时表：只追加日线表中晚于latest_date的记录，
+    并删除有新数据的股票中超出最近limit条的旧记录
+
+    返回:
+    (新增记录数, 删除记录数)
+    """
+    table_name = TempStockHQEntity.__tablename__
+    columns = ', '.join(_temp_stock_hq_columns())
+    insert_query = f"""
+    INSERT INTO {table_name} ({columns})
+    SELECT {columns} FROM {StockDailyHQEntity.__tablename__}
+    WHERE trade_date > :latest_date
+    """
+    # 只对本次有新数据的股票排名，需要删除的记录数与新增的交易日数量成正比
+    evict_query = f"""
+    SELECT id FROM (
+        SELECT id, ROW_NUMBER() OVER (PARTITION BY ts_code ORDER BY trade_date DESC) as row_num
+        FROM {table_name}
+        WHERE ts_code IN (SELECT DISTINCT ts_code FROM {table_name} WHERE trade_date > :latest_date)
+    ) ranked
+    WHERE row_num > :limit
+    """
+    delete_query = text(f"DELETE FROM {table_name} WHERE id IN :ids").bindparams(bindparam('ids', expanding=True))
 
-    write_data(df, TempStockHQEntity.__tablename__, 'replace')
-    print("临时表数据更新完成！更新了", len(df), "条记录")
+    with get_engine().begin() as connection:
+        latest_date = latest_date.strftime('%Y-%m-%d')
+        inserted = connection.execute(text(insert_query), {'latest_date': latest_date}).rowcount
+        evict_ids = [row[0] for row in connection.execute(text(evict_query), {'latest_date': latest_date, 'limit': limit})]
+        for start in range(0, len(evict_ids), 10000):
+            connection.execute(delete_query, {'ids': evict_ids[start:start + 10000]})
+    return inserted, len(evict_ids)
+
+def _temp_stock_hq_matches_daily(limit, latest_date):
+    """
+    检查临时表在latest_date及之前的记录是否仍与日线表一致：按股票比较记录数和各浮点列之和
+    日线表补录了更早的交易日、upsert修正了已有记录或之后才补算均线时，增量刷新不会复制这些变化，需要全量重建
+
+    返回:
+    bool: 每只股票的记录数和校验和都与全量重建的结果一致时为True
+    """
+    quote = get_engine().dialect.identifier_preparer.quote
+    sums = [f"SUM({{alias}}{quote(column.name)}) AS {quote(column.name)}"
+            for column in TempStockHQEntity.__table__.columns if isinstance(column.type, Float)]
+    temp_table = TempStockHQEntity.__tablename__
+    temp_query = f"""
+    SELECT ts_code, COUNT(*) AS row_count, {', '.join(item.format(alias='') for item in sums)}
+    FROM {temp_table}
+    WHERE trade_date <= :latest_date
+    GROUP BY ts_code
+    """
+    # 临时表中不足limit条的股票以及不在临时表中的股票，全量重建时会取到更早的记录，需要比较latest_date之前的全部记录
+    daily_query = f"""
+    SELECT d.ts_code, COUNT(*) AS row_count, {', '.join(item.format(alias='d.') for item in sums)}
+    FROM {StockDailyHQEntity.__tablename__} d
+    LEFT JOIN (
+        SELECT ts_code, MIN(trade_date) AS min_date, COUNT(*) AS row_count
+        FROM {temp_table}
+        WHERE trade_date <= :latest_date
+        GROUP BY ts_code
+    ) t ON d.ts_code = t.ts_code
+    WHERE d.trade_date <= :latest_date
+      AND (t.ts_code IS NULL OR t.row_count < :limit OR d.trade_date >= t.min_date)
+    GROUP BY d.ts_code
+    """
+    params = {'latest_date': latest_date.strftime('%Y-%m-%d'), 'limit': limit}
+    temp = pd.read_sql(text(temp_query), con=get_engine(), params=params).set_index('ts_code').sort_index()
+    daily = pd.read_sql(text(daily_query), con=get_engine(), params=params).set_index('ts_code').sort_index()
+    if not temp.index.equals(daily.index) or not (temp['row_count'].values == daily['row_count'].values).all():
+        return False
+    checksum_columns = [column for column in temp.columns if column != 'row_count']
+    return bool(np.isclose(temp[checksum_columns].astype(float).values, daily[checksum_columns].astype(float).values,
+                           rtol=1e-9, equal_nan=True).all())
+
+def init_temp_stock_hq_data(limit=30, incremental=False, snapshot=True):
+    """
+    从日线表中更新临时表数据
+    规则是对每一个股票选取n条记录，n默认为30
+    
+    参数:
+    limit: 每只股票保留的记录数
+    incremental: 为True时只追加临时表最新日期之后的交易日并淘汰窗口外的旧记录；
+                 临时表为空、结构过旧或与日线表不一致（补录了历史数据、修正了已有记录或补算了均线）时自动退化为全量重建
+    snapshot: 更新完成后是否同时生成临时表的列式快照，供指标计算直接内存映射加载
+    """
+    inserted = None
+    # 旧结构的临时表id不会自增，增量插入的记录无法按id淘汰；重新建表后表为空，退化为全量重建
+    if incremental and not _ensure_temp_stock_hq_schema():
+        with get_engine().connect() as connection:
+            latest_date = parse_date(connection.execute(text(f"SELECT MAX(trade_date) FROM {TempStockHQEntity.__tablename__}")).scalar())
+        if latest_date and not _temp_stock_hq_matches_daily(limit, latest_date):
+            print("临时表与日线表已有记录不一致，改为全量重建")
+        elif latest_date:
+            inserted, evicted = _refresh_temp_stock_hq_data(limit, latest_date)
+            print(f"临时表增量更新完成！新增 {inserted} 条记录，淘汰 {evicted} 条记录")
+
+    if inserted is None:
+        inserted = _rebuild_temp_stock_hq_data(limit)
+        if not inserted:
+            print("没有可用的数据")
+            return 0
+        print("临时表数据更新完成！更新了", inserted, "条记录")
+
+    if snapshot:
+        session = get_session()
+        try:
+            _, path = save_table_snapshot(session, TempStockHQEntity)
+        finally:
+            session.close()
+        print(f"临时表快照已写入 {path}")
+    return inserted
@@ -0,0 +1,176 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Tushare默认积分下pro_bar/daily等接口每分钟的调用上限
+DEFAULT_CALLS_PER_MINUTE = 500
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶限流器
+
+    参数:
+    rate: 每秒补充的令牌数
+    capacity: 桶容量，即允许的最大突发调用数，默认等于每秒令牌数
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("令牌补充速率必须大于0")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self, tokens=1):
+        """
+        获取令牌，令牌不足时阻塞等待
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitedFetcher:
+    """
+    Tushare接口调用的统一入口：令牌桶限流、有界并发、带抖动的指数退避重试，
+    多次重试仍失败的任务记录到死信列表中，可稍后单独重放
+
+    参数:
+    calls_per_minute: 每分钟允许的调用次数，应与账号的接口配额一致
+    max_workers: 最大并发线程数
+    max_retries: 单次调用失败后的最大重试次数
+    base_delay: 退避的初始等待秒数
+    max_delay: 退避的最大等待秒数
+    """
+
+    def __init__(self, calls_per_minute=DEFAULT_CALLS_PER_MINUTE, max_workers=4, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.bucket = TokenBucket(calls_per_minute / 60.0, capacity=max(1, min(max_workers, calls_per_minute)))
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.dead_letters = []
+        self._dead_letter_lock = threading.Lock()
+
+    def _backoff(self, attempt):
+        # 全抖动的指数退避，避免多个线程在同一时刻集中重试
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, func, *args, **kwargs):
+        """
+        限流并重试地调用数据接口，重试次数用尽后抛出最后一次的异常
+        """
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                print(f"  调用 {getattr(func, '__name__', func)} 失败: {e}，{delay:.1f}秒后进行第{attempt}次重试")
+                time.sleep(delay)
+
+    def map(self, func, items, key=None, max_workers=None):
+        """
+        以有界并发对每个任务执行func，失败的任务进入死信列表而不是被丢弃
+
+        参数:
+        func: 任务函数，接收单个任务参数，内部的接口调用应通过self.call完成
+        items: 任务参数列表
+        key: 从任务参数中提取标识（如股票代码）的函数，默认使用任务参数本身
+        max_workers: 覆盖实例的最大并发线程数
+
+        返回:
+        dict: 以任务标识为键、任务返回值为值的字典（仅包含成功的任务）
+        """
+        key = key or (lambda item: item)
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            futures = {executor.submit(func, item): item for item in items}
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    results[key(item)] = future.result()
+                except Exception as e:
+                    print(f"  任务 {key(item)} 失败，已加入死信列表: {e}")
+                    with self._dead_letter_lock:
+                        self.dead_letters.append({'key': key(item), 'item': item, 'func': func, 'error': repr(e)})
+        return results
+
+    def dead_letter_count(self):
+        """
+        返回死信列表的当前长度，执行任务前记录，之后传给failed_keys即可只取本次执行的失败任务
+        """
+        with self._dead_letter_lock:
+            return len(self.dead_letters)
+
+    def failed_keys(self, start=0):
+        """
+        返回死信列表中的任务标识
+
+        参数:
+        start: 从死信列表的该位置开始返回，默认为全部
+        """
+        with self._dead_letter_lock:
+            return [entry['key'] for entry in self.dead_letters[start:]]
+
+    def remove_dead_letters(self, start=0):
+        """
+        从死信列表中移除并返回从start位置开始的任务，用于不能单独重放的任务
+        """
+        with self._dead_letter_lock:
+            removed = self.dead_letters[start:]
+            del self.dead_letters[start:]
+        return removed
+
+    def replay_dead_letters(self, max_workers=None):
+        """
+        重放死信列表中的任务，仍然失败的任务会重新进入死信列表
+
+        返回:
+        dict: 本次重放成功的任务结果
+        """
+        with self._dead_letter_lock:
+            entries = self.dead_letters
+            self.dead_letters = []
+        results = {}
+        by_func = {}
+        for entry in entries:
+            by_func.setdefault(entry['func'], []).append(entry)
+        for func, func_entries in by_func.items():
+            keys = {id(entry['item']): entry['key'] for entry in func_entries}
+            results.update(self.map(func, [entry['item'] for entry in func_entries],
+                                    key=lambda item: keys[id(item)], max_workers=max_workers))
+        return results
+
+
+_default_fetcher = None
+_default_fetcher_lock = threading.Lock()
+
+
+def get_default_fetcher():
+    """
+    获取进程内共享的默认限流调用器
+    """
+    global _default_fetcher
+    with _default_fetcher_lock:
+        if _default_fetcher is None:
+            _default_fetcher = RateLimitedFetcher()
+        return _default_fetcher
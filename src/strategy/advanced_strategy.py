@@ -0,0 +1,449 @@
+import ast
+import inspect
+import io
+import os
+import tokenize
+from collections import Counter
+from functools import reduce
+import numpy as np
+import pandas as pd
+from src.entities.temp_stock_hq import TempStockHQEntity
+from src.indicators.cross_ma import cross_signals
+from src.indicators.rps import calculate_rps_matrix
+from src.indicators.result import IndicatorResult
+from src.panel.market_panel import PANEL_FIELDS
+from src.panel.snapshot import load_market_panel
+from src.strategy.signals import SIGNAL_FIELDS, bull_ma_mask, cross_ma_mask, new_high_mask, rolling_count
+from src.utils.moving_average import rolling_mean
+from src.utils.rolling_max import rolling_max
+
+# 常用的选股表达式，可以直接作为screen_stocks的参数
+PRESET_SCREENS = {
+    'trend': 'rps(3) >= 90 & bull_ma & cross_ma(4) & new_high(60)',
+    'trend_pullback': 'rps(20) >= 90 & bull_ma & crossed(close, ma10, within=4) & ~new_high(60)',
+}
+
+
+def _rps(panel, interval=3, use_pre_close=False):
+    return calculate_rps_matrix(panel, interval, use_pre_close)[1]
+
+
+def _crossed(panel, fast, slow, within=1, direction='up'):
+    crossed = np.zeros(panel.shape, dtype=bool)
+    crossed[:, 1:] = cross_signals(fast, slow, direction)
+    return rolling_count(crossed, within) > 0
+
+
+def _highest(panel, values, window):
+    return rolling_max(values, window)
+
+
+def _mean(panel, values, window):
+    return rolling_mean(values, window)
+
+
+def _ref(panel, values, days=1):
+    shifted = np.full(panel.shape, np.nan)
+    if 0 <= days < panel.shape[1]:
+        shifted[:, days:] = values[:, :panel.shape[1] - days]
+    return shifted
+
+
+def _count(panel, condition, window):
+    return rolling_count(condition, window).astype(float)
+
+
+# 表达式中可用的函数：名称 -> (实现, 返回类型, {按表达式求值的参数: 参数类型})
+# 实现的第一个参数为面板，未列出的参数必须是常量；没有必填参数的函数可以省略括号，如bull_ma
+SCREEN_FUNCTIONS = {
+    'rps': (_rps, 'number', {}),                                         # rps(interval, use_pre_close=False)
+    'bull_ma': (bull_ma_mask, 'bool', {}),                               # 均线多头排列
+    'cross_ma': (cross_ma_mask, 'bool', {}),                             # cross_ma(lookback_days=3)，与趋势策略一致
+    'new_high': (new_high_mask, 'bool', {}),                             # new_high(interval=60)
+    'crossed': (_crossed, 'bool', {'fast': 'number', 'slow': 'number'}),  # crossed(fast, slow, within=1, direction='up')
+    'highest': (_highest, 'number', {'values': 'number'}),               # highest(values, window)
+    'mean': (_mean, 'number', {'values': 'number'}),                     # mean(values, window)
+    'ref': (_ref, 'number', {'values': 'number'}),                       # ref(values, days=1)
+    'count': (_count, 'number', {'condition': 'bool'}),                  # count(condition, window)
+}
+
+_BOOLEAN_TOKENS = {'&': 'and', '|': 'or', '~': 'not'}
+_SKIPPED_TOKENS = {tokenize.NEWLINE, tokenize.NL, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT}
+_COMPARE_OPERATORS = {ast.Gt: '>', ast.GtE: '>=', ast.Lt: '<', ast.LtE: '<=', ast.Eq: '==', ast.NotEq: '!='}
+_ARITHMETIC_OPERATORS = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/'}
+_NUMPY_OPERATORS = {
+    '>': np.greater, '>=': np.greater_equal, '<': np.less, '<=': np.less_equal, '==': np.equal, '!=': np.not_equal,
+    '+': np.add, '-': np.subtract, '*': np.multiply, '/': np.divide,
+}
+
+
+def _normalize_operators(expression):
+    """
+    把&、|、~替换为and、or、not：Python中按位运算符的优先级高于比较运算符，
+    直接解析时rps(3)>=90 & bull_ma会变成rps(3) >= (90 & bull_ma)
+    """
+    tokens = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(expression.strip()).readline):
+            if token.type in _SKIPPED_TOKENS:
+                continue
+            if token.type == tokenize.OP and token.string in _BOOLEAN_TOKENS:
+                tokens.append((tokenize.NAME, _BOOLEAN_TOKENS[token.string]))
+            else:
+                tokens.append((token.type, token.string))
+    except tokenize.TokenError as e:
+        raise ValueError(f"选股表达式不完整: {expression}") from e
+    return tokenize.untokenize(tokens)
+
+
+def _node_type(node):
+    kind = node[0]
+    if kind in ('and', 'or', 'not', 'compare'):
+        return 'bool'
+    if kind == 'const':
+        return 'bool' if isinstance(node[1], bool) else 'number'
+    if kind == 'call':
+        return SCREEN_FUNCTIONS[node[1]][1]
+    return 'number'
+
+
+def _children(node):
+    kind = node[0]
+    if kind in ('and', 'or'):
+        return node[1]
+    if kind == 'not':
+        return (node[1],)
+    if kind in ('compare', 'arithmetic'):
+        return (node[2], node[3])
+    if kind == 'call':
+        return tuple(value for _, value in node[2] if isinstance(value, tuple))
+    return ()
+
+
+def _expect(node, expected, expression):
+    if _node_type(node) != expected:
+        description = '布尔条件' if expected == 'bool' else '数值'
+        raise ValueError(f"选股表达式 {expression} 中 {format_screen(node)} 不是{description}")
+    return node
+
+
+def _combine(kind, operands):
+    # 展开嵌套的同类运算并去重排序，使写法不同的相同条件得到同一个节点
+    flat = set()
+    for operand in operands:
+        flat.update(operand[1] if operand[0] == kind else (operand,))
+    if len(flat) == 1:
+        return flat.pop()
+    return (kind, tuple(sorted(flat, key=repr)))
+
+
+class _ScreenCompiler:
+    """
+    把Python语法树转换为规范化的节点元组：相同的子表达式得到相等的节点，可以作为字典键去重
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+
+    def error(self, message):
+        return ValueError(f"选股表达式 {self.expression} 无效: {message}")
+
+    def compile(self, tree):
+        method = getattr(self, f'visit_{type(tree).__name__}', None)
+        if method is None:
+            raise self.error(f"不支持的语法 {ast.unparse(tree)}")
+        return method(tree)
+
+    def visit_Expression(self, tree):
+        return _expect(self.compile(tree.body), 'bool', self.expression)
+
+    def visit_Constant(self, tree):
+        if isinstance(tree.value, bool) or isinstance(tree.value, (int, float, str)):
+            return ('const', tree.value)
+        raise self.error(f"不支持的常量 {tree.value!r}")
+
+    def visit_Name(self, tree):
+        if tree.id in SCREEN_FUNCTIONS:
+            return self._call(tree.id, [], {})
+        if tree.id in PANEL_FIELDS:
+            return ('field', tree.id)
+        raise self.error(f"未知的名称 {tree.id}，可用的字段: {', '.join(PANEL_FIELDS)}，可用的函数: {', '.join(SCREEN_FUNCTIONS)}")
+
+    def visit_Call(self, tree):
+        if not isinstance(tree.func, ast.Name) or tree.func.id not in SCREEN_FUNCTIONS:
+            raise self.error(f"未知的函数 {ast.unparse(tree.func)}，可用的函数: {', '.join(SCREEN_FUNCTIONS)}")
+        args = [self.compile(arg) for arg in tree.args]
+        kwargs = {keyword.arg: self.compile(keyword.value) for keyword in tree.keywords}
+        return self._call(tree.func.id, args, kwargs)
+
+    def _call(self, name, args, kwargs):
+        func, _, series_params = SCREEN_FUNCTIONS[name]
+        try:
+            bound = inspect.signature(func).bind(None, *args, **kwargs)
+        except TypeError as e:
+            raise self.error(f"{name} 的参数错误: {e}") from e
+        # 补全默认值，使rps(3)与rps(3, use_pre_close=False)得到同一个节点
+        bound.apply_defaults()
+        arguments = []
+        for param, value in list(bound.arguments.items())[1:]:
+            if not isinstance(value, tuple):
+                value = ('const', value)
+            if param in series_params:
+                _expect(value, series_params[param], self.expression)
+            elif value[0] != 'const':
+                raise self.error(f"{name} 的参数 {param} 必须是常量")
+            else:
+                value = value[1]
+            arguments.append((param, value))
+        return ('call', name, tuple(arguments))
+
+    def visit_BoolOp(self, tree):
+        kind = 'and' if isinstance(tree.op, ast.And) else 'or'
+        return _combine(kind, [_expect(self.compile(value), 'bool', self.expression) for value in tree.values])
+
+    def visit_UnaryOp(self, tree):
+        operand = self.compile(tree.operand)
+        if isinstance(tree.op, ast.Not):
+            _expect(operand, 'bool', self.expression)
+            return operand[1] if operand[0] == 'not' else ('not', operand)
+        if isinstance(tree.op, ast.USub):
+            _expect(operand, 'number', self.expression)
+            return ('const', -operand[1]) if operand[0] == 'const' else ('arithmetic', '-', ('const', 0), operand)
+        if isinstance(tree.op, ast.UAdd):
+            return _expect(operand, 'number', self.expression)
+        raise self.error(f"不支持的运算 {ast.unparse(tree)}")
+
+    def visit_Compare(self, tree):
+        # 链式比较80 <= rps(3) < 95拆成两个比较的与
+        operands = [_expect(self.compile(value), 'number', self.expression) for value in [tree.left] + tree.comparators]
+        comparisons = []
+        for op, left, right in zip(tree.ops, operands, operands[1:]):
+            if type(op) not in _COMPARE_OPERATORS:
+                raise self.error(f"不支持的比较 {ast.unparse(tree)}")
+            comparisons.append(('compare', _COMPARE_OPERATORS[type(op)], left, right))
+        return _combine('and', comparisons)
+
+    def visit_BinOp(self, tree):
+        if type(tree.op) not in _ARITHMETIC_OPERATORS:
+            raise self.error(f"不支持的运算 {ast.unparse(tree)}")
+        left = _expect(self.compile(tree.left), 'number', self.expression)
+        right = _expect(self.compile(tree.right), 'number', self.expression)
+        return ('arithmetic', _ARITHMETIC_OPERATORS[type(tree.op)], left, right)
+
+
+def parse_screen(expression):
+    """
+    解析选股表达式，返回规范化的节点元组
+
+    表达式由以下部分组成：
+    - 面板字段，如close、pct_chg、vol、ma10
+    - SCREEN_FUNCTIONS中的函数，如rps(3)、new_high(60)、crossed(close, ma10, within=4)，
+      没有必填参数的函数可以省略括号，如bull_ma
+    - 数值常量和+、-、*、/、比较运算，比较可以链式书写，如80 <= rps(3) < 95
+    - &（与）、|（或）、~（非），优先级低于比较运算，也可以写作and、or、not
+
+    参数:
+    expression: 选股表达式，如 'rps(3)>=90 & bull_ma & crossed(close,ma10,within=4) & ~new_high(60)'
+
+    返回:
+    节点元组，相同的子表达式（包括与、或中条件顺序不同的写法）得到相等的节点
+    """
+    try:
+        tree = ast.parse(_normalize_operators(expression), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"选股表达式语法错误: {expression}") from e
+    return _ScreenCompiler(expression).compile(tree)
+
+
+def format_screen(node):
+    """
+    把节点元组还原为表达式字符串
+    """
+    kind = node[0]
+    if kind == 'const':
+        return repr(node[1])
+    if kind == 'field':
+        return node[1]
+    if kind == 'call':
+        arguments = [f"{param}={format_screen(value) if isinstance(value, tuple) else repr(value)}"
+                     for param, value in node[2]]
+        return f"{node[1]}({', '.join(arguments)})"
+    if kind in ('and', 'or'):
+        separator = ' & ' if kind == 'and' else ' | '
+        return '(' + separator.join(format_screen(operand) for operand in node[1]) + ')'
+    if kind == 'not':
+        return f"~{format_screen(node[1])}"
+    return f"({format_screen(node[2])} {node[1]} {format_screen(node[3])})"
+
+
+def screen_fields(nodes):
+    """
+    计算节点需要的面板字段
+    """
+    fields = set()
+    pending = list(nodes)
+    while pending:
+        node = pending.pop()
+        if node[0] == 'field':
+            fields.add(node[1])
+        elif node[0] == 'call' and not SCREEN_FUNCTIONS[node[1]][2]:
+            # 内置的条件函数使用趋势信号的字段
+            fields.update(SIGNAL_FIELDS)
+        pending.extend(_children(node))
+    return fields
+
+
+class ScreenEvaluator:
+    """
+    在一个面板上对一组表达式做整面板的向量化求值：每个不同的子表达式只计算一次，
+    被多个表达式（或同一表达式中多处）引用的结果暂存到最后一次引用之后释放
+
+    参数:
+    panel: MarketPanel
+    nodes: parse_screen返回的节点列表
+    """
+
+    def __init__(self, panel, nodes):
+        self.panel = panel
+        self.evaluations = 0
+        self._references = Counter()
+        self._values = {}
+        for node in nodes:
+            self._count_references(node)
+
+    def _count_references(self, node):
+        self._references[node] += 1
+        if self._references[node] == 1:
+            for child in _children(node):
+                self._count_references(child)
+
+    def evaluate(self, node):
+        """
+        计算节点的值，返回形状为(股票数, 交易日数)的数组，常量返回标量
+        """
+        if node in self._values:
+            value = self._values[node]
+        else:
+            value = self._compute(node)
+            self.evaluations += 1
+            if self._references[node] > 1:
+                self._values[node] = value
+        self._references[node] -= 1
+        if self._references[node] <= 0:
+            self._values.pop(node, None)
+        return value
+
+    def _series(self, node):
+        value = self.evaluate(node)
+        return np.full(self.panel.shape, value) if np.ndim(value) == 0 else value
+
+    def _compute(self, node):
+        kind = node[0]
+        if kind == 'const':
+            return node[1]
+        if kind == 'field':
+            if node[1] not in self.panel:
+                raise ValueError(f"面板中没有字段 {node[1]}")
+            return self.panel[node[1]]
+        if kind == 'call':
+            func, _, series_params = SCREEN_FUNCTIONS[node[1]]
+            arguments = {param: self._series(value) if param in series_params else value for param, value in node[2]}
+            return func(self.panel, **arguments)
+        if kind in ('and', 'or'):
+            combine = np.logical_and if kind == 'and' else np.logical_or
+            return reduce(combine, [self._series(operand) for operand in node[1]])
+        if kind == 'not':
+            return ~self._series(node[1])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return _NUMPY_OPERATORS[node[1]](self.evaluate(node[2]), self.evaluate(node[3]))
+
+
+def _tradable_mask(panel):
+    # 排除北交所股票以及当日没有行情的股票（否则~条件会选中停牌或未上市的股票）
+    mask = np.broadcast_to(panel.exclude_mask()[:, np.newaxis], panel.shape)
+    if 'close' in panel:
+        mask = mask & ~np.isnan(panel['close'])
+    return mask
+
+
+def evaluate_screens(panel, screens):
+    """
+    在面板上计算多个选股表达式每个交易日的选股结果，表达式之间相同的子表达式只计算一次，
+    同时计算十几个表达式的耗时接近只计算其中最复杂的一个
+
+    参数:
+    panel: MarketPanel，需要包含screen_fields返回的字段
+    screens: {名称: 表达式}，值也可以是parse_screen返回的节点
+
+    返回:
+    {名称: 形状为(股票数, 交易日数)的布尔数组}，只包含当日有行情且不在北交所的股票
+    """
+    nodes = {name: parse_screen(screen) if isinstance(screen, str) else screen for name, screen in screens.items()}
+    evaluator = ScreenEvaluator(panel, nodes.values())
+    tradable = _tradable_mask(panel)
+    return {name: evaluator._series(node) & tradable for name, node in nodes.items()}
+
+
+def _rps_nodes(node):
+    # 表达式中出现的RPS，作为结果的数值列输出
+    found = {}
+    pending = [node]
+    while pending:
+        current = pending.pop()
+        if current[0] == 'call' and current[1] == 'rps':
+            params = dict(current[2])
+            found[f"rps{params['interval']}" + ('_pre' if params['use_pre_close'] else '')] = current
+        pending.extend(_children(current))
+    return dict(sorted(found.items()))
+
+
+def screen_stocks(session, screens, end_date=None, panel=None, write_csv=True):
+    """
+    用选股表达式在临时表面板上选股，多个表达式共用一次面板加载和公共子表达式的计算结果
+
+    参数:
+    session: 数据库会话，仅在未提供panel时用于加载临时表面板
+    screens: {名称: 表达式}，也可以是单个表达式字符串（名称为'screen'）或PRESET_SCREENS中的名称列表
+    end_date: 选股日期，默认为面板中最新交易日
+    panel: 已加载的MarketPanel，提供时不再访问数据库
+    write_csv: 是否把每个表达式的结果输出到res/<日期>/screen-<名称>.csv
+
+    返回:
+    {名称: IndicatorResult}，包含close、pct_chg以及表达式中各RPS的数值列（如rps3），
+    按第一个RPS列降序排列，没有RPS时按涨跌幅降序排列
+    """
+    if isinstance(screens, str):
+        screens = {'screen': screens}
+    elif not isinstance(screens, dict):
+        screens = {name: PRESET_SCREENS[name] for name in screens}
+    nodes = {name: parse_screen(expression) for name, expression in screens.items()}
+    if panel is None:
+        fields = sorted(screen_fields(nodes.values()) | {'close', 'pct_chg'})
+        panel = load_market_panel(session, TempStockHQEntity, end_date=end_date, fields=fields)
+
+    end_pos = panel.date_position(end_date)
+    outputs = {name: _rps_nodes(node) for name, node in nodes.items()}
+    # 只计算到选股日期所在列，RPS列与选股条件共用同一次计算
+    panel = panel.slice_dates(0, end_pos)
+    evaluator = ScreenEvaluator(panel, list(nodes.values()) + [rps for columns in outputs.values() for rps in columns.values()])
+    tradable = _tradable_mask(panel)[:, end_pos]
+
+    trade_date = panel.trade_date(end_pos)
+    date_dir = os.path.join(os.getcwd(), 'res', end_date or trade_date.strftime('%Y%m%d'))
+    results = {}
+    for name, node in nodes.items():
+        rows = np.flatnonzero(evaluator._series(node)[:, end_pos] & tradable)
+        values = {'close': panel['close'][rows, end_pos], 'pct_chg': panel['pct_chg'][rows, end_pos]}
+        for column, rps in outputs[name].items():
+            values[column] = evaluator._series(rps)[rows, end_pos]
+        result = IndicatorResult.from_panel(name, panel, rows, values, trade_date, {'expression': screens[name]})
+        result = result.rank(next(iter(outputs[name]), 'pct_chg'))
+        results[name] = result
+
+        if write_csv:
+            os.makedirs(date_dir, exist_ok=True)
+            columns = ['code', 'name', 'close', 'pct_chg'] + list(outputs[name]) + ['industry']
+            df = pd.DataFrame(result.to_rows(columns),
+                              columns=['股票代码', '股票名称', '最新价', '涨跌幅'] + list(outputs[name]) + ['所属行业'])
+            df.to_csv(os.path.join(date_dir, f'screen-{name}.csv'), index=False, encoding='utf-8-sig')
+    return results
@@ -0,0 +1,235 @@
+import os
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from src.entities.stock_daily_hq import StockDailyHQEntity
+from src.panel.market_panel import MarketPanel
+from src.strategy.signals import SIGNAL_FIELDS, bull_ma_mask, trend_mask
+from src.utils.data_processing import parse_date
+
+# 回测需要的行情字段，买卖价格使用其中的open和close
+BACKTEST_FIELDS = SIGNAL_FIELDS
+
+TRADE_COLUMNS = ['ts_code', 'name', 'industry', 'signal_date', 'entry_date', 'entry_price', 'exit_date', 'exit_price',
+                 'hold_days', 'return_pct', 'exit_reason']
+
+
+def load_backtest_panel(session, start_date, end_date=None, warmup_days=250, entity=StockDailyHQEntity, fields=BACKTEST_FIELDS):
+    """
+    一次查询加载回测区间的日线面板，并在开始日期之前多加载warmup_days个交易日用于计算信号
+
+    参数:
+    session: 数据库会话
+    start_date: 回测开始日期
+    end_date: 回测结束日期，默认为表中最新日期
+    warmup_days: 开始日期之前需要的交易日数，应不少于各信号的最长周期
+    entity: 行情表实体
+    fields: 需要加载的字段
+    """
+    trade_date = entity.trade_date
+    first_date_query = select(trade_date).distinct().where(trade_date < parse_date(start_date)) \
+        .order_by(trade_date.desc()).offset(max(warmup_days, 1) - 1).limit(1)
+    first_date = session.execute(first_date_query).scalar()
+    return MarketPanel.load(session, entity, fields=fields, end_date=end_date, start_date=first_date or start_date)
+
+
+def simulate_trades(panel, signals, start_date=None, end_date=None, hold_days=5, stop_loss=None, take_profit=None,
+                    exit_signals=None, entry='next_open', fee=0.0):
+    """
+    按信号矩阵模拟交易：按交易日推进、对全部股票向量化处理，每只股票同一时间最多持有一笔，
+    平仓当日不再开仓，组合按持仓股票的等权平均日收益计算净值
+
+    参数:
+    panel: 包含open和close字段的MarketPanel
+    signals: 形状为(股票数, 交易日数)的布尔数组，True表示当日收盘后出现买入信号
+    start_date: 回测开始日期，之前的信号不开仓，默认为面板第一个交易日
+    end_date: 回测结束日期，默认为面板最后一个交易日
+    hold_days: 最长持有的交易日数（买入当日记为第1天）
+    stop_loss: 止损百分比（如8表示收盘价较买入价下跌8%时卖出），为空时不止损
+    take_profit: 止盈百分比，为空时不止盈
+    exit_signals: 形状与signals相同的布尔数组，持仓股票当日为True时以收盘价卖出，为空时不使用
+    entry: 'next_open'为信号次日开盘价买入，'close'为信号当日收盘价买入
+    fee: 单边交易成本（比例，如0.001）
+
+    返回:
+    (trades, equity)：trades为每笔交易一行的DataFrame（列为TRADE_COLUMNS），回测结束时仍持有的交易
+    exit_reason为'open'、按最后收盘价计算收益；equity为包含trade_date, positions, daily_return, equity列的DataFrame
+    """
+    if entry not in ('next_open', 'close'):
+        raise ValueError(f"不支持的买入方式 '{entry}'，请使用 'next_open' 或 'close'")
+    start_pos = int(np.searchsorted(panel.dates, np.datetime64(parse_date(start_date), 'D'))) if start_date else 0
+    end_pos = panel.date_position(end_date)
+    open_price, close = panel['open'], panel['close']
+    signals = np.asarray(signals, dtype=bool)
+    stock_count = len(panel.codes)
+    no_signal = np.zeros(stock_count, dtype=bool)
+
+    holding = np.zeros(stock_count, dtype=bool)
+    signal_pos = np.zeros(stock_count, dtype=int)
+    entry_pos = np.zeros(stock_count, dtype=int)
+    entry_price = np.full(stock_count, np.nan)
+    last_price = np.full(stock_count, np.nan)
+    days_held = np.zeros(stock_count, dtype=int)
+    trades = []
+    equity_rows = []
+    equity = 1.0
+
+    for t in range(start_pos, end_pos + 1):
+        today_close = close[:, t]
+        traded = ~np.isnan(today_close)
+        daily_return = np.zeros(stock_count)
+
+        # 已有持仓按收盘价计算当日收益，停牌日收益为0
+        days_held[holding] += 1
+        priced = np.flatnonzero(holding & traded)
+        daily_return[priced] = today_close[priced] / last_price[priced] - 1
+        last_price[priced] = today_close[priced]
+
+        # 开仓：昨日信号以今日开盘价买入，或今日信号以今日收盘价买入
+        if entry == 'next_open':
+            prices = open_price[:, t]
+            candidates = signals[:, t - 1] if t > start_pos else no_signal
+        else:
+            prices = today_close
+            candidates = signals[:, t]
+        new = np.flatnonzero(~holding & candidates & traded & ~np.isnan(prices))
+        holding[new] = True
+        signal_pos[new] = t - 1 if entry == 'next_open' else t
+        entry_pos[new] = t
+        entry_price[new] = prices[new] * (1 + fee)
+        days_held[new] = 1
+        last_price[new] = today_close[new]
+        daily_return[new] = today_close[new] / entry_price[new] - 1
+
+        # 平仓：持有期满、止盈、止损或离场信号，均以当日收盘价卖出；回测结束时仍持有的记为open
+        active = np.flatnonzero(holding)
+        position_return = last_price[active] / entry_price[active] - 1
+        reasons = np.full(len(active), '', dtype=object)
+        can_sell = traded[active]
+        reasons[can_sell & (days_held[active] >= hold_days)] = 'hold_days'
+        if take_profit is not None:
+            reasons[can_sell & (reasons == '') & (position_return * 100 >= take_profit)] = 'take_profit'
+        if stop_loss is not None:
+            reasons[can_sell & (reasons == '') & (position_return * 100 <= -stop_loss)] = 'stop_loss'
+        if exit_signals is not None:
+            reasons[can_sell & (reasons == '') & exit_signals[active, t]] = 'exit_signal'
+        if t == end_pos:
+            reasons[reasons == ''] = 'open'
+
+        closing = reasons != ''
+        if closing.any():
+            rows, row_reasons = active[closing], reasons[closing]
+            sold = rows[row_reasons != 'open']
+            daily_return[sold] -= fee
+            trades.append(_trade_frame(panel, rows, row_reasons, signal_pos, entry_pos, entry_price, last_price,
+                                       t, days_held, fee))
+            holding[rows] = False
+
+        portfolio_return = float(daily_return[active].mean()) if len(active) else 0.0
+        equity *= 1 + portfolio_return
+        equity_rows.append((panel.trade_date(t), len(active), portfolio_return, equity))
+
+    trade_frame = pd.concat(trades, ignore_index=True) if trades else pd.DataFrame(columns=TRADE_COLUMNS)
+    equity_frame = pd.DataFrame(equity_rows, columns=['trade_date', 'positions', 'daily_return', 'equity'])
+    return trade_frame, equity_frame
+
+
+def _trade_frame(panel, rows, reasons, signal_pos, entry_pos, entry_price, last_price, exit_pos, days_held, fee):
+    exit_price = last_price[rows]
+    sell_price = np.where(reasons == 'open', exit_price, exit_price * (1 - fee))
+    return pd.DataFrame({
+        'ts_code': panel.codes[rows].astype(str),
+        'name': panel.stock_info['name'].values[rows],
+        'industry': panel.stock_info['industry'].values[rows],
+        'signal_date': [value.item() for value in panel.dates[signal_pos[rows]]],
+        'entry_date': [value.item() for value in panel.dates[entry_pos[rows]]],
+        'entry_price': entry_price[rows],
+        'exit_date': panel.trade_date(exit_pos),
+        'exit_price': exit_price,
+        'hold_days': days_held[rows],
+        'return_pct': (sell_price / entry_price[rows] - 1) * 100,
+        'exit_reason': reasons,
+    }, columns=TRADE_COLUMNS)
+
+
+def summarize_backtest(trades, equity):
+    """
+    汇总回测结果：交易笔数、胜率、平均收益、总收益和最大回撤（百分比）
+    """
+    closed = trades[trades['exit_reason'] != 'open']
+    curve = equity['equity'].values
+    drawdown = (curve / np.maximum.accumulate(curve) - 1).min() * 100 if len(curve) else 0.0
+    return {
+        'trades': int(len(closed)),
+        'open_trades': int(len(trades) - len(closed)),
+        'win_rate': float((closed['return_pct'] > 0).mean() * 100) if len(closed) else 0.0,
+        'avg_return_pct': float(closed['return_pct'].mean()) if len(closed) else 0.0,
+        'total_return_pct': float((curve[-1] - 1) * 100) if len(curve) else 0.0,
+        'max_drawdown_pct': float(drawdown),
+    }
+
+
+def backtest_trend_strategy(session=None, start_date=None, end_date=None, panel=None, rps_interval=3, rps_threshold=90,
+                            lookback_days=4, high_price_interval=60, use_pre_close=False, hold_days=5, stop_loss=None,
+                            take_profit=None, exit_on_signal_loss=False, entry='next_open', fee=0.0, write_csv=True):
+    """
+    趋势策略的历史回测：一次加载日线面板，用整面板布尔矩阵得到每个交易日的选股结果，再按持有规则模拟交易
+
+    参数:
+    session: 数据库会话，仅在未提供panel时用于加载t_stock_daily_hq
+    start_date: 回测开始日期，未提供panel时必填
+    end_date: 回测结束日期，默认为最新日期
+    panel: 已加载的MarketPanel，需要包含BACKTEST_FIELDS以及开始日期之前足够的交易日
+    rps_interval: RPS统计周期
+    rps_threshold: RPS阈值
+    lookback_days: 均线上穿的回看天数
+    high_price_interval: 创新高的统计周期
+    use_pre_close: 为True时RPS按前收盘价计算
+    hold_days: 最长持有的交易日数
+    stop_loss: 止损百分比
+    take_profit: 止盈百分比
+    exit_on_signal_loss: 为True时持仓股票不再满足均线多头排列时卖出
+    entry: 'next_open'或'close'，参见simulate_trades
+    fee: 单边交易成本
+    write_csv: 是否把选股记录、交易明细和净值曲线输出到res/backtest目录
+
+    返回:
+    dict: 包含hits（每日选股记录）、trades（交易明细）、equity（净值曲线）和summary（汇总指标）
+    """
+    if panel is None:
+        warmup_days = max(rps_interval, lookback_days, high_price_interval)
+        panel = load_backtest_panel(session, start_date, end_date, warmup_days)
+    start_pos = int(np.searchsorted(panel.dates, np.datetime64(parse_date(start_date), 'D'))) if start_date else 0
+    end_pos = panel.date_position(end_date)
+
+    signals, rps = trend_mask(panel, rps_interval, rps_threshold, lookback_days, high_price_interval, use_pre_close)
+    exit_signals = None
+    if exit_on_signal_loss:
+        exit_signals = ~bull_ma_mask(panel)
+    trades, equity = simulate_trades(panel, signals, start_date, end_date, hold_days, stop_loss, take_profit,
+                                     exit_signals, entry, fee)
+
+    rows, columns = np.nonzero(signals[:, start_pos:end_pos + 1])
+    columns = columns + start_pos
+    order = np.lexsort((-rps[rows, columns], columns))
+    rows, columns = rows[order], columns[order]
+    hits = pd.DataFrame({
+        'trade_date': [value.item() for value in panel.dates[columns]],
+        'ts_code': panel.codes[rows].astype(str),
+        'name': panel.stock_info['name'].values[rows],
+        'industry': panel.stock_info['industry'].values[rows],
+        'close': panel['close'][rows, columns],
+        'rps': rps[rows, columns],
+    })
+    summary = summarize_backtest(trades, equity)
+
+    if write_csv and len(panel.dates):
+        output_dir = os.path.join(os.getcwd(), 'res', 'backtest',
+                                  f"trend-{panel.trade_date(start_pos).strftime('%Y%m%d')}-{panel.trade_date(end_pos).strftime('%Y%m%d')}")
+        os.makedirs(output_dir, exist_ok=True)
+        hits.to_csv(os.path.join(output_dir, 'hits.csv'), index=False, encoding='utf-8-sig')
+        trades.to_csv(os.path.join(output_dir, 'trades.csv'), index=False, encoding='utf-8-sig')
+        equity.to_csv(os.path.join(output_dir, 'equity.csv'), index=False, encoding='utf-8-sig')
+        print(f"回测完成：{summary['trades']} 笔交易，胜率 {summary['win_rate']:.1f}%，"
+              f"总收益 {summary['total_return_pct']:.2f}%，最大回撤 {summary['max_drawdown_pct']:.2f}%，结果已保存到 {output_dir}")
+    return {'hits': hits, 'trades': trades, 'equity': equity, 'summary': summary}
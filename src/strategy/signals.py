@@ -0,0 +1,94 @@
+import numpy as np
+from src.indicators.cross_ma import cross_signals
+from src.indicators.rps import calculate_rps_matrix
+from src.utils.rolling_max import rolling_max
+
+# 整面板信号计算需要的行情字段
+SIGNAL_FIELDS = ['open', 'pre_close', 'close', 'ma5', 'ma10', 'ma20', 'ma30', 'ma120']
+
+
+def rolling_count(mask, window):
+    """
+    按行统计最近window个交易日（含当日）内为True的个数，前window-1列的窗口从第0列开始
+
+    参数:
+    mask: 形状为(股票数, 交易日数)的布尔数组
+    window: 窗口长度，小于1时结果全为0
+    """
+    counts = np.concatenate([np.zeros((mask.shape[0], 1), dtype=int), np.cumsum(mask, axis=1)], axis=1)
+    ends = np.arange(1, mask.shape[1] + 1)
+    starts = np.maximum(ends - max(int(window), 0), 0)
+    return counts[:, ends] - counts[:, starts]
+
+
+def rps_mask(panel, rps_interval=3, rps_threshold=90, use_pre_close=False):
+    """
+    每个交易日RPS不低于阈值的股票，与calculate_rps_indicator_from_panel逐日计算的结果一致
+    （面板开头不足rps_interval个交易日的日期为False）
+
+    返回:
+    (mask, rps)，形状均为(股票数, 交易日数)
+    """
+    _, rps = calculate_rps_matrix(panel, rps_interval, use_pre_close)
+    with np.errstate(invalid='ignore'):
+        return rps >= rps_threshold, rps
+
+
+def bull_ma_mask(panel):
+    """
+    每个交易日均线多头排列的股票，条件与calculate_ma_indicator一致，缺失的均线按0处理
+    """
+    close = panel['close']
+    ma = {n: np.nan_to_num(panel[f'ma{n}'], nan=0.0) for n in (5, 10, 20, 30, 120)}
+    with np.errstate(invalid='ignore'):
+        mask = ((close > ma[5]) & (ma[5] >= ma[10]) & (ma[10] >= ma[20])
+                & (ma[20] >= ma[30]) & (ma[30] >= ma[120]))
+    return mask & panel.exclude_mask()[:, np.newaxis]
+
+
+def cross_ma_mask(panel, lookback_days=3):
+    """
+    每个交易日在最近lookback_days个交易日内上穿MA5（或站上MA5的同时上穿MA10）的股票，
+    与calculate_cross_ma_indicator_from_panel逐日计算的结果一致
+    """
+    close, ma5, ma10 = panel['close'], panel['ma5'], panel['ma10']
+    # 第t列表示第t个交易日是否发生上穿，第0列没有前一日
+    crossed = np.zeros(close.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        crossed[:, 1:] = cross_signals(close, ma5) | (cross_signals(close, ma10) & (close[:, 1:] > ma5[:, 1:]))
+    # 窗口内的交叉发生在窗口首日之后的lookback_days-1个交易日，且窗口内至少有两天数据
+    has_cross = rolling_count(crossed, lookback_days - 1) > 0
+    enough_rows = rolling_count(~np.isnan(close), lookback_days) >= 2
+    return has_cross & enough_rows & panel.exclude_mask()[:, np.newaxis]
+
+
+def new_high_mask(panel, interval=60):
+    """
+    每个交易日收盘价为最近interval个交易日最高收盘价的股票，与calculate_high_price_indicator_from_panel一致
+    """
+    close = panel['close']
+    with np.errstate(invalid='ignore'):
+        mask = close == rolling_max(close, interval)
+    return mask & panel.exclude_mask()[:, np.newaxis]
+
+
+def trend_mask(panel, rps_interval=3, rps_threshold=90, lookback_days=4, high_price_interval=60, use_pre_close=False):
+    """
+    趋势策略在每个交易日的选股结果：RPS强势、均线多头排列、近期上穿均线、创阶段新高同时满足
+
+    参数:
+    panel: 包含SIGNAL_FIELDS的MarketPanel
+    rps_interval: RPS统计周期
+    rps_threshold: RPS阈值
+    lookback_days: 均线上穿的回看天数
+    high_price_interval: 创新高的统计周期
+    use_pre_close: 为True时RPS按前收盘价计算
+
+    返回:
+    (mask, rps)，形状均为(股票数, 交易日数)，mask[i, t]表示第i只股票在第t个交易日入选
+    """
+    mask, rps = rps_mask(panel, rps_interval, rps_threshold, use_pre_close)
+    mask &= bull_ma_mask(panel)
+    mask &= cross_ma_mask(panel, lookback_days)
+    mask &= new_high_mask(panel, high_price_interval)
+    return mask, rps
@@ -0,0 +1,149 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import numpy as np
+import pandas as pd
+from src.indicators.rps import calculate_rps_matrix
+from src.panel.shared import SharedPanel, attach_shared_panel
+from src.strategy.backtest import BACKTEST_FIELDS, load_backtest_panel, simulate_trades, summarize_backtest
+from src.strategy.signals import bull_ma_mask, cross_ma_mask, new_high_mask
+from src.utils.data_processing import parse_date
+
+# 默认的参数网格，键为backtest_trend_strategy的参数名
+DEFAULT_SWEEP_GRID = {
+    'rps_interval': [3, 5, 10, 20],
+    'rps_threshold': [80, 85, 90, 95],
+    'lookback_days': [3, 4, 5],
+    'high_price_interval': [20, 60, 120],
+    'hold_days': [5, 10],
+}
+
+# 各参数未出现在网格中时使用的默认值
+SWEEP_DEFAULTS = {
+    'rps_interval': 3, 'rps_threshold': 90, 'ma_interval': 3, 'lookback_days': 4, 'high_price_interval': 60,
+    'use_pre_close': False, 'hold_days': 5, 'stop_loss': None, 'take_profit': None, 'entry': 'next_open', 'fee': 0.0,
+}
+
+
+def expand_grid(grid):
+    """
+    把{参数名: 取值列表}展开为参数组合列表，未出现的参数使用SWEEP_DEFAULTS，
+    组合按信号参数排序，相邻组合可以复用同一工作进程中已计算的信号矩阵
+    """
+    unknown = set(grid) - set(SWEEP_DEFAULTS)
+    if unknown:
+        raise ValueError(f"不支持的参数: {', '.join(sorted(unknown))}，可用的参数: {', '.join(SWEEP_DEFAULTS)}")
+    names = list(grid)
+    combinations = [dict(SWEEP_DEFAULTS, **dict(zip(names, values))) for values in product(*(grid[name] for name in names))]
+    combinations.sort(key=lambda params: (params['rps_interval'], params['use_pre_close'], params['lookback_days'],
+                                          params['high_price_interval'], params['rps_threshold']))
+    return combinations
+
+
+class _SignalCache:
+    """
+    单个进程内的信号矩阵缓存：各条件的矩阵只依赖自身的参数，在参数组合之间复用
+    """
+
+    def __init__(self, panel):
+        self.panel = panel
+        self._rps = {}
+        self._cross = {}
+        self._high = {}
+        self._bull = None
+
+    def trend_mask(self, params):
+        rps_key = (params['rps_interval'], params['use_pre_close'])
+        if rps_key not in self._rps:
+            # RPS矩阵为浮点数组，只保留最近使用的一个，组合已按周期排序
+            self._rps = {rps_key: calculate_rps_matrix(self.panel, *rps_key)[1]}
+        if self._bull is None:
+            self._bull = bull_ma_mask(self.panel)
+        if params['lookback_days'] not in self._cross:
+            self._cross[params['lookback_days']] = cross_ma_mask(self.panel, params['lookback_days'])
+        if params['high_price_interval'] not in self._high:
+            self._high[params['high_price_interval']] = new_high_mask(self.panel, params['high_price_interval'])
+
+        with np.errstate(invalid='ignore'):
+            mask = self._rps[rps_key] >= params['rps_threshold']
+        return mask & self._bull & self._cross[params['lookback_days']] & self._high[params['high_price_interval']]
+
+
+def _start_position(panel, start_date):
+    return int(np.searchsorted(panel.dates, np.datetime64(parse_date(start_date), 'D'))) if start_date else 0
+
+
+def _evaluate(cache, params, start_date, end_date):
+    signals = cache.trend_mask(params)
+    trades, equity = simulate_trades(cache.panel, signals, start_date, end_date, params['hold_days'], params['stop_loss'],
+                                     params['take_profit'], entry=params['entry'], fee=params['fee'])
+    start_pos = _start_position(cache.panel, start_date)
+    summary = summarize_backtest(trades, equity)
+    summary['hits'] = int(signals[:, start_pos:cache.panel.date_position(end_date) + 1].sum())
+    return dict(params, **summary)
+
+
+# 工作进程中映射的共享面板及其信号缓存
+_worker_shm = None
+_worker_cache = None
+
+def _init_worker(descriptor):
+    global _worker_shm, _worker_cache
+    panel, _worker_shm = attach_shared_panel(descriptor)
+    _worker_cache = _SignalCache(panel)
+
+def _evaluate_in_worker(params, start_date, end_date):
+    return _evaluate(_worker_cache, params, start_date, end_date)
+
+
+def sweep_trend_strategy(session=None, grid=None, start_date=None, end_date=None, panel=None, sort_by='total_return_pct',
+                         ascending=False, max_workers=None, write_csv=True):
+    """
+    趋势策略参数扫描：对参数网格中的每个组合做一次历史回测，按回测指标排序
+    面板只加载一次并复制到共享内存，进程池中的工作进程映射同一块内存，不为每个进程复制数据；
+    每个工作进程缓存已计算的条件矩阵，不同组合之间只重新计算参数变化的条件
+
+    参数:
+    session: 数据库会话，仅在未提供panel时用于加载t_stock_daily_hq
+    grid: {参数名: 取值列表}，参数名见SWEEP_DEFAULTS，默认为DEFAULT_SWEEP_GRID；
+          ma_interval与calculate_trend_strategy中一样不影响选股
+    start_date: 回测开始日期，未提供panel时必填
+    end_date: 回测结束日期
+    panel: 已加载的MarketPanel，需要包含BACKTEST_FIELDS以及开始日期之前足够的交易日
+    sort_by: 排序使用的指标，如total_return_pct、win_rate、avg_return_pct、max_drawdown_pct
+    ascending: 是否升序排列
+    max_workers: 工作进程数，默认为CPU核数，为1时在当前进程中计算
+    write_csv: 是否把结果输出到res/backtest目录
+
+    返回:
+    DataFrame: 每个参数组合一行，包含参数、hits以及summarize_backtest的各项指标
+    """
+    combinations = expand_grid(grid or DEFAULT_SWEEP_GRID)
+    if panel is None:
+        warmup_days = max(max(params['rps_interval'], params['lookback_days'], params['high_price_interval'])
+                          for params in combinations)
+        panel = load_backtest_panel(session, start_date, end_date, warmup_days)
+    max_workers = min(max_workers or os.cpu_count() or 1, len(combinations))
+
+    if max_workers <= 1:
+        cache = _SignalCache(panel)
+        rows = [_evaluate(cache, params, start_date, end_date) for params in combinations]
+    else:
+        with SharedPanel(panel, BACKTEST_FIELDS) as shared:
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                     initargs=(shared.descriptor,)) as executor:
+                # 连续的组合分到同一个进程，尽量复用信号矩阵
+                chunksize = max(1, len(combinations) // (max_workers * 4))
+                rows = list(executor.map(_evaluate_in_worker, combinations, [start_date] * len(combinations),
+                                         [end_date] * len(combinations), chunksize=chunksize))
+
+    result = pd.DataFrame(rows).sort_values(sort_by, ascending=ascending, kind='stable', ignore_index=True)
+    if write_csv and len(panel.dates):
+        output_dir = os.path.join(os.getcwd(), 'res', 'backtest')
+        os.makedirs(output_dir, exist_ok=True)
+        first_date = panel.trade_date(_start_position(panel, start_date))
+        last_date = panel.trade_date(panel.date_position(end_date))
+        output_file = os.path.join(output_dir, f"sweep-{first_date.strftime('%Y%m%d')}-{last_date.strftime('%Y%m%d')}.csv")
+        result.to_csv(output_file, index=False, encoding='utf-8-sig')
+        print(f"参数扫描完成：{len(result)} 组参数，结果已保存到 {output_file}")
+    return result
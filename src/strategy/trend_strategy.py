@@ -1,62 +1,51 @@
 import os
+import numpy as np
 import pandas as pd
-from sqlalchemy import text
 from src.entities.temp_stock_hq import TempStockHQEntity
-from src.entities.stock_entity import StockEntity
-from src.utils.data_processing import get_end_date
-from src.indicators.rps import calculate_rps_indicator
-from src.indicators.ma import calculate_ma_indicator
-from src.indicators.cross_ma import calculate_cross_ma_indicator
-from src.indicators.high_price import calculate_high_price_indicator
+from src.entities.stock_rps import StockRPSEntity
+from src.indicators.rps import calculate_rps_result_from_table
+from src.indicators.registry import IndicatorTask, run_indicators
+from src.indicators.result import IndicatorResult
+from src.panel.snapshot import load_market_panel
+from src.strategy.signals import SIGNAL_FIELDS, trend_mask
+from src.utils.data_processing import get_data_version, parse_date
 from typing import List, Tuple
 
-def calculate_trend_strategy(session, end_date, rps_interval=3, rps_threshold=90, ma_interval=3, lookback_days=4, high_price_interval=60):
-    # 获取RPS指标结果
-    rps_result = calculate_rps_indicator(session, end_date, rps_interval, rps_threshold)
-    rps_codes = set(item[0] for item in rps_result)
-    
-    # 获取均线指标结果
-    ma_result = calculate_ma_indicator(session, end_date, ma_interval)
-    ma_codes = set(item[0] for item in ma_result)
-    
-    # 获取均线上穿指标结果
-    cross_ma_result = calculate_cross_ma_indicator(session, end_date, lookback_days)
-    cross_ma_codes = set(item[0] for item in cross_ma_result)
-    
-    # 获取创新高指标结果
-    high_price_result = calculate_high_price_indicator(session, end_date, high_price_interval)
-    high_price_codes = set(item[0] for item in high_price_result)
-    
-    # 取四个指标的交集
-    trend_codes = rps_codes.intersection(ma_codes).intersection(cross_ma_codes).intersection(high_price_codes)
-    
-    # 获取股票基本信息
-    code_list = [f"{code}.SZ" if code.startswith('0') or code.startswith('3') else f"{code}.SH" for code in trend_codes]
-    base_entity_list = session.query(StockEntity).filter(StockEntity.ts_code.in_(code_list)).all()
-    code_info_map = {entity.ts_code.split('.')[0]: (entity.name, entity.industry) for entity in base_entity_list}
-    
-    # 获取最新价格和涨跌幅
-    table_name = TempStockHQEntity.__tablename__
-    price_sql = f"""
-    SELECT ts_code, close, pct_chg
-    FROM {table_name}
-    WHERE trade_date = :end_date
-      AND ts_code IN :code_list
+def calculate_trend_strategy(session, end_date, rps_interval=3, rps_threshold=90, ma_interval=3, lookback_days=4, high_price_interval=60, panel=None, use_rps_table=False, volume_params=None, cache=None):
     """
-    price_result = session.execute(text(price_sql), {'end_date': end_date, 'code_list': tuple(code_list)}).fetchall()
-    price_map = {row[0].split('.')[0]: (row[1], row[2]) for row in price_result}
-    
-    # 整理输出结果
-    trend_output = []
-    for code in trend_codes:
-        name, industry = code_info_map.get(code, ('', ''))
-        close, pct_chg = price_map.get(code, (0, 0))
-        # 获取RPS值
-        rps_value = next((item[3] for item in rps_result if item[0] == code), 0)
-        trend_output.append((code, name, close, pct_chg, rps_value, industry))
-    
-    # 按RPS值排序
-    trend_output.sort(key=lambda x: x[4], reverse=True)
+    趋势策略：RPS强势、均线多头排列、近期上穿均线、创阶段新高四个条件同时满足
+    
+    参数:
+    session: 数据库会话，仅在未提供panel时用于加载临时表面板（数据未变化时直接使用快照）
+    end_date: 结束日期
+    rps_interval: RPS统计周期
+    rps_threshold: RPS阈值
+    ma_interval: 均线指标周期
+    lookback_days: 均线上穿的回看天数
+    high_price_interval: 创新高的统计周期
+    panel: 已加载的MarketPanel，提供时不再访问数据库
+    use_rps_table: 为True时从t_stock_rps表读取已保存的RPS，而不是重新计算
+    volume_params: 放量条件，为scan_volume的参数字典（如{'lookback_days': 5, 'vol_surge_ratio': 1.5, 'sustained_days': 2}），
+                   提供时额外要求满足放量条件，使用同一个面板计算
+    cache: ResultCache，提供时相同参数且数据版本未变化的选股结果直接从缓存读取，不再加载面板和计算指标；
+           提供panel时不使用缓存
+    """
+    params = {
+        'rps_interval': rps_interval, 'rps_threshold': rps_threshold, 'ma_interval': ma_interval,
+        'lookback_days': lookback_days, 'high_price_interval': high_price_interval,
+        'use_rps_table': use_rps_table, 'volume_params': volume_params,
+    }
+    # 调用方提供的面板不一定来自临时表，不能用临时表的数据版本判断缓存是否失效，此时不使用缓存
+    if cache is not None and panel is None:
+        data_version = [get_data_version(session, TempStockHQEntity)]
+        if use_rps_table:
+            # t_stock_rps以upsert写入，重算或回填已有日期时交易日和记录数都不变，需要对rps列求和才能发现变化
+            data_version.append(get_data_version(session, StockRPSEntity, [StockRPSEntity.rps]))
+        trend = cache.get_or_compute('trend_result', params, end_date, data_version,
+                                     lambda: _select_trend_stocks(session, end_date, panel=panel, **params))
+    else:
+        trend = _select_trend_stocks(session, end_date, panel=panel, **params)
+    trend_output = trend.to_rows(['code', 'name', 'close', 'pct_chg', 'rps', 'industry'])
     
     # 创建日期目录
     date_dir = os.path.join(os.getcwd(), 'res', end_date)
@@ -72,6 +61,124 @@ def calculate_trend_strategy(session, end_date, rps_interval=3, rps_threshold=90
     
     return trend_output
 
+def _select_trend_stocks(session, end_date, rps_interval, rps_threshold, ma_interval, lookback_days, high_price_interval,
+                         panel=None, use_rps_table=False, volume_params=None):
+    """
+    计算趋势策略的选股结果，参数同calculate_trend_strategy
+    
+    返回:
+    IndicatorResult: 名称为'trend'，以完整ts_code为索引，包含close、pct_chg和rps列，按RPS值降序排列
+    """
+    if panel is None:
+        panel = load_market_panel(session, TempStockHQEntity, end_date=end_date)
+    
+    # 各指标共用同一个面板并行计算
+    tasks = [
+        IndicatorTask('ma', {'ma_interval': ma_interval}),
+        IndicatorTask('cross_ma', {'lookback_days': lookback_days}),
+        IndicatorTask('high_price', {'interval': high_price_interval}),
+    ]
+    if volume_params is not None:
+        tasks.append(IndicatorTask('volume_scan', volume_params))
+    if not use_rps_table:
+        tasks.append(IndicatorTask('rps', {'rps_interval': rps_interval, 'rps_threshold': rps_threshold}))
+    results = run_indicators(session, end_date, tasks, panel=panel)
+    
+    # 获取RPS指标结果
+    if use_rps_table:
+        rps_result = calculate_rps_result_from_table(session, end_date, rps_interval, rps_threshold)
+    else:
+        rps_result = results['rps']
+    
+    # 按完整代码取各指标的交集，保持RPS的降序，只保留RPS列
+    conditions = [results['ma'], results['cross_ma'], results['high_price']]
+    if volume_params is not None:
+        conditions.append(IndicatorResult.from_frame('vol', results['volume_scan']))
+    trend = rps_result.intersect(*conditions, name='trend', columns={condition.name: [] for condition in conditions})
+    
+    # 从面板中一次取出最新价格和涨跌幅，不在面板中的股票为0
+    end_pos = panel.date_position(end_date)
+    rows = pd.Index(panel.codes).get_indexer(trend.codes)
+    in_panel = rows >= 0
+    frame = trend.frame[['name', 'industry']].copy()
+    frame['close'] = np.where(in_panel, panel['close'][rows, end_pos], 0)
+    frame['pct_chg'] = np.where(in_panel, panel['pct_chg'][rows, end_pos], 0)
+    frame['rps'] = trend['rps']
+    params = {
+        'rps_interval': rps_interval, 'rps_threshold': rps_threshold, 'ma_interval': ma_interval,
+        'lookback_days': lookback_days, 'high_price_interval': high_price_interval,
+    }
+    return IndicatorResult('trend', frame, panel.trade_date(end_pos), params).rank('rps')
+
+def calculate_trend_strategy_history(session, start_date=None, end_date=None, rps_interval=3, rps_threshold=90, lookback_days=4,
+                                     high_price_interval=60, panel=None, write_csv=True):
+    """
+    对临时表中的每个交易日一次计算趋势策略的选股结果，以及与前一交易日相比新入选和移出的股票
+    整个面板只加载一次，四个条件各计算一次全部交易日的矩阵，耗时只与数据量有关，与交易日数无关；
+    每个交易日的结果与以该日为end_date调用calculate_trend_strategy一致
+
+    参数:
+    session: 数据库会话，仅在未提供panel时用于加载临时表面板
+    start_date: 开始日期，默认为临时表中的第一个交易日
+    end_date: 结束日期，默认为最新交易日
+    rps_interval: RPS统计周期
+    rps_threshold: RPS阈值
+    lookback_days: 均线上穿的回看天数
+    high_price_interval: 创新高的统计周期
+    panel: 已加载的MarketPanel，提供时不再访问数据库
+    write_csv: 是否把结果输出到res/trend-<开始日期>-<结束日期>目录
+
+    返回:
+    dict: hits为每日选股记录（同一交易日按RPS降序），changes为每日新入选（entry）和移出（exit）的股票，
+          daily为每日的入选、新入选和移出数量；面板第一个交易日没有前一交易日，当日的入选股票均记为新入选
+    """
+    if panel is None:
+        panel = load_market_panel(session, TempStockHQEntity, end_date=end_date, fields=SIGNAL_FIELDS + ['pct_chg'])
+    start_pos = int(np.searchsorted(panel.dates, np.datetime64(parse_date(start_date), 'D'))) if start_date else 0
+    end_pos = panel.date_position(end_date)
+    mask, rps = trend_mask(panel, rps_interval, rps_threshold, lookback_days, high_price_interval)
+
+    # 每个交易日与前一交易日的选股结果比较，第一个交易日与空集比较
+    previous = np.zeros(mask.shape, dtype=bool)
+    previous[:, 1:] = mask[:, :-1]
+    window = slice(start_pos, end_pos + 1)
+    changes = {'entry': mask[:, window] & ~previous[:, window], 'exit': previous[:, window] & ~mask[:, window]}
+
+    def records(selected, **extra):
+        rows, columns = np.nonzero(selected)
+        columns = columns + start_pos
+        order = np.lexsort((-np.nan_to_num(rps[rows, columns], nan=-1.0), columns))
+        rows, columns = rows[order], columns[order]
+        return pd.DataFrame(dict({
+            'trade_date': [value.item() for value in panel.dates[columns]],
+            'ts_code': panel.codes[rows].astype(str),
+            'name': panel.stock_info['name'].values[rows],
+            'industry': panel.stock_info['industry'].values[rows],
+            'close': panel['close'][rows, columns],
+            'pct_chg': panel['pct_chg'][rows, columns],
+            'rps': rps[rows, columns],
+        }, **extra))
+
+    hits = records(mask[:, window])
+    change_frames = [records(selected, change=kind) for kind, selected in changes.items()]
+    changes_df = pd.concat(change_frames, ignore_index=True).sort_values(['trade_date', 'change'], kind='stable', ignore_index=True)
+    daily = pd.DataFrame({
+        'trade_date': [value.item() for value in panel.dates[window]],
+        'hits': mask[:, window].sum(axis=0),
+        'entries': changes['entry'].sum(axis=0),
+        'exits': changes['exit'].sum(axis=0),
+    })
+
+    if write_csv and len(daily):
+        output_dir = os.path.join(os.getcwd(), 'res',
+                                  f"trend-{panel.trade_date(start_pos).strftime('%Y%m%d')}-{panel.trade_date(end_pos).strftime('%Y%m%d')}")
+        os.makedirs(output_dir, exist_ok=True)
+        hits.to_csv(os.path.join(output_dir, 'hits.csv'), index=False, encoding='utf-8-sig')
+        changes_df.to_csv(os.path.join(output_dir, 'changes.csv'), index=False, encoding='utf-8-sig')
+        daily.to_csv(os.path.join(output_dir, 'daily.csv'), index=False, encoding='utf-8-sig')
+        print(f"趋势策略多日选股完成：{len(daily)} 个交易日，共 {len(hits)} 条入选记录，结果已保存到 {output_dir}")
+    return {'hits': hits, 'changes': changes_df, 'daily': daily}
+
 def generate_stock_codes_svg(trend_output: List[Tuple], date_dir: str) -> None:
     """生成股票代码图片
     
@@ -1,7 +1,35 @@
-from sqlalchemy import text, func, desc
-from src.db.database import Session
+from sqlalchemy import text, func, desc, Float
 from src.entities.temp_stock_hq import TempStockHQEntity
-from datetime import datetime
+from datetime import datetime, date
+
+def parse_date(value):
+    """
+    将各种日期表示统一转换为datetime.date对象
+    支持date/datetime对象以及 YYYYMMDD、YYYY-MM-DD 格式的字符串（SQLite中日期以字符串返回）
+    
+    参数:
+    value: 日期值，为None时返回None
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    value = str(value)
+    for fmt in ('%Y%m%d', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"日期 '{value}' 格式无效，请使用 'YYYYMMDD' 或 'YYYY-MM-DD' 格式")
+
+def to_sql_date(value):
+    """
+    转换为SQL查询参数使用的 YYYY-MM-DD 字符串，MySQL和SQLite都能按日期比较
+    """
+    parsed = parse_date(value)
+    return parsed.strftime('%Y-%m-%d') if parsed else None
 
 def get_end_date(session, query_date_column, end_date=None):
     """
@@ -58,9 +86,41 @@ def get_trade_date_list(session, query_date_column, end_date, days_count):
     # 查询指定日期之前的若干个交易日
     trade_dates = session.query(query_date_column) \
         .distinct() \
-        .filter(query_date_column <= end_date) \
+        .filter(query_date_column <= parse_date(end_date)) \
         .order_by(desc(query_date_column)) \
         .limit(days_count) \
         .all()
     
     return trade_dates
+
+def get_data_version(session, entity, checksum_columns=None):
+    """
+    获取行情表的数据版本，用于判断缓存是否失效
+    一次聚合查询得到最新交易日、记录数以及各数值列之和（作为校验和）
+    
+    参数:
+    session: 数据库会话
+    entity: 行情表实体，TempStockHQEntity或StockDailyHQEntity，也可以是其他带trade_date的表
+    checksum_columns: 计算校验和的数值列，默认为表中全部浮点列（开高低收、成交量、均线等），
+                      重算均线或修正任一价格都会改变版本；传入空列表时不计算校验和，
+                      只使用交易日和记录数，不需要对数值列做全表求和
+    
+    返回:
+    dict: 包含max_trade_date, min_trade_date, row_count, checksum的字典
+    """
+    if checksum_columns is None:
+        checksum_columns = [column for column in entity.__table__.columns if isinstance(column.type, Float)]
+    row = session.query(
+        func.max(entity.trade_date),
+        func.min(entity.trade_date),
+        func.count(entity.id),
+        *[func.sum(column) for column in checksum_columns],
+    ).one()
+    max_trade_date, min_trade_date, row_count = row[:3]
+    return {
+        'table': entity.__tablename__,
+        'max_trade_date': to_sql_date(max_trade_date),
+        'min_trade_date': to_sql_date(min_trade_date),
+        'row_count': int(row_count or 0),
+        'checksum': ':'.join(f"{float(value or 0):.6f}" for value in row[3:]),
+    }
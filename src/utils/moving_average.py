@@ -0,0 +1,195 @@
+import numpy as np
+
+
+def rolling_mean(values, window, min_periods=None):
+    """
+    按行计算简单移动平均（每行一只股票，按交易日升序），用累积和一次得到所有窗口的和
+    与pandas的rolling(window, min_periods=min_periods).mean()一致：窗口内的NaN被忽略，
+    有效值少于min_periods个时结果为NaN
+
+    参数:
+    values: 一维或二维数组，二维时形状为(股票数, 交易日数)
+    window: 均线周期
+    min_periods: 窗口内最少的有效值个数，默认为window（窗口内不能有NaN）
+
+    返回:
+    与values形状相同的数组
+    """
+    values = np.asarray(values, dtype=float)
+    squeeze = values.ndim == 1
+    values = np.atleast_2d(values)
+    valid = ~np.isnan(values)
+    zeros = np.zeros((values.shape[0], 1))
+    sums = np.concatenate([zeros, np.cumsum(np.where(valid, values, 0.0), axis=1)], axis=1)
+    counts = np.concatenate([zeros, np.cumsum(valid, axis=1)], axis=1)
+
+    min_periods = window if min_periods is None else min_periods
+    # 窗口起点不早于每行的开头，前window-1列的窗口较短
+    ends = np.arange(1, values.shape[1] + 1)
+    starts = np.maximum(ends - window, 0)
+    window_sums = sums[:, ends] - sums[:, starts]
+    window_counts = counts[:, ends] - counts[:, starts]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.where(window_counts >= max(min_periods, 1), window_sums / window_counts, np.nan)
+    return result[0] if squeeze else result
+
+
+def grouped_rolling_mean(groups, values, window):
+    """
+    对按(股票, 交易日)排序的长表数据分组计算简单移动平均，全部股票共用一次累积和
+
+    参数:
+    groups: 每行的股票代码，同一股票的行必须相邻且按交易日升序
+    values: 每行的数值
+    window: 均线周期
+
+    返回:
+    与values等长的数组，每只股票前window-1行以及窗口内含NaN的行为NaN
+    """
+    groups = np.asarray(groups)
+    values = np.asarray(values, dtype=float)
+    result = np.full(len(values), np.nan)
+    if len(values) < window:
+        return result
+
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    lengths = np.diff(np.r_[starts, len(values)])
+    group_position = np.arange(len(values)) - np.repeat(starts, lengths)
+
+    valid = ~np.isnan(values)
+    sums = np.r_[0.0, np.cumsum(np.where(valid, values, 0.0))]
+    counts = np.r_[0, np.cumsum(valid)]
+    ends = np.flatnonzero(group_position >= window - 1)
+    window_sums = sums[ends + 1] - sums[ends + 1 - window]
+    window_counts = counts[ends + 1] - counts[ends + 1 - window]
+    result[ends] = np.where(window_counts == window, window_sums / window, np.nan)
+    return result
+
+
+def ema(values, span):
+    """
+    按行计算指数移动平均，alpha = 2 / (span + 1)，以每行第一个有效值为初值，
+    NaN处沿用上一个值，与pandas的ewm(span=span, adjust=False, ignore_na=True).mean()一致
+    对交易日循环、对全部股票向量化计算
+
+    参数:
+    values: 一维或二维数组，二维时形状为(股票数, 交易日数)
+    span: 周期
+    """
+    values = np.asarray(values, dtype=float)
+    squeeze = values.ndim == 1
+    values = np.atleast_2d(values)
+    alpha = 2.0 / (span + 1)
+
+    result = np.full(values.shape, np.nan)
+    current = np.full(values.shape[0], np.nan)
+    for column in range(values.shape[1]):
+        value = values[:, column]
+        current = np.where(np.isnan(current), value,
+                           np.where(np.isnan(value), current, alpha * value + (1 - alpha) * current))
+        result[:, column] = current
+    return result[0] if squeeze else result
+
+
+class RollingMeanState:
+    """
+    多周期滚动均值的增量状态：每只股票保存最近max(periods)个值的环形缓冲区和各周期的滚动和，
+    新交易日到来时每只股票每个周期只需一次加减即可得到新的均值
+
+    参数:
+    periods: 均线周期列表
+    """
+
+    def __init__(self, periods):
+        self.periods = [int(period) for period in periods]
+        self.size = max(self.periods)
+        self._index = {}
+        self._buffer = np.full((0, self.size), np.nan)
+        self._head = np.zeros(0, dtype=int)
+        self._count = np.zeros(0, dtype=int)
+        self._sums = np.zeros((0, len(self.periods)))
+        self._nans = np.zeros((0, len(self.periods)), dtype=int)
+
+    @classmethod
+    def from_history(cls, periods, groups, values):
+        """
+        从按(股票, 交易日)排序的历史数据初始化状态，每只股票只回放最近max(periods)个值
+
+        参数:
+        periods: 均线周期列表
+        groups: 每行的股票代码
+        values: 每行的数值
+        """
+        state = cls(periods)
+        groups = np.asarray(groups)
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return state
+
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        lengths = np.diff(np.r_[starts, len(values)])
+        # 每只股票只回放最近size条记录，第step步回放每只股票其中的第step条
+        replay = np.minimum(lengths, state.size)
+        first = starts + lengths - replay
+        for step in range(int(replay.max())):
+            active = np.flatnonzero(replay > step)
+            state.update(groups[starts[active]], values[first[active] + step])
+        return state
+
+    def _rows(self, codes):
+        new_codes = [code for code in dict.fromkeys(codes) if code not in self._index]
+        if new_codes:
+            for code in new_codes:
+                self._index[code] = len(self._index)
+            extra = len(new_codes)
+            self._buffer = np.vstack([self._buffer, np.full((extra, self.size), np.nan)])
+            self._head = np.r_[self._head, np.zeros(extra, dtype=int)]
+            self._count = np.r_[self._count, np.zeros(extra, dtype=int)]
+            self._sums = np.vstack([self._sums, np.zeros((extra, len(self.periods)))])
+            self._nans = np.vstack([self._nans, np.zeros((extra, len(self.periods)), dtype=int)])
+        return np.array([self._index[code] for code in codes], dtype=int)
+
+    def update(self, codes, values):
+        """
+        为每只股票追加一个新交易日的值，一次调用中每只股票最多出现一次
+
+        参数:
+        codes: 股票代码列表
+        values: 与codes对应的数值
+
+        返回:
+        形状为(len(codes), len(periods))的数组，为各股票更新后各周期的均值
+        """
+        rows = self._rows(codes)
+        values = np.asarray(values, dtype=float)
+        value_nan = np.isnan(values)
+        head = self._head[rows]
+        count = self._count[rows]
+
+        for k, period in enumerate(self.periods):
+            # 离开窗口的是period次更新之前写入的值
+            leaving = self._buffer[rows, (head - period) % self.size]
+            full = count >= period
+            leaving_nan = full & np.isnan(leaving)
+            self._sums[rows, k] += np.where(value_nan, 0.0, values) - np.where(full & ~leaving_nan, leaving, 0.0)
+            self._nans[rows, k] += value_nan.astype(int) - leaving_nan.astype(int)
+
+        self._buffer[rows, head] = values
+        self._head[rows] = (head + 1) % self.size
+        self._count[rows] = count + 1
+        return self._means(rows)
+
+    def means(self, codes):
+        """
+        返回各股票当前各周期的均值，未出现过的股票为NaN
+        """
+        result = np.full((len(codes), len(self.periods)), np.nan)
+        known = [i for i, code in enumerate(codes) if code in self._index]
+        if known:
+            result[known] = self._means(np.array([self._index[codes[i]] for i in known], dtype=int))
+        return result
+
+    def _means(self, rows):
+        periods = np.array(self.periods)
+        ready = (self._count[rows, np.newaxis] >= periods) & (self._nans[rows] == 0)
+        return np.where(ready, self._sums[rows] / periods, np.nan)
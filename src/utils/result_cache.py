@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from src.utils.data_processing import to_sql_date
+
+# 缓存未命中时get返回的默认值，与缓存的None结果区分
+CACHE_MISS = object()
+
+
+def get_cache_dir():
+    """
+    指标结果缓存的磁盘目录，可通过环境变量STOCKS_CACHE_DIR修改，默认为当前目录下的.cache/results
+    """
+    return os.environ.get('STOCKS_CACHE_DIR', os.path.join(os.getcwd(), '.cache', 'results'))
+
+
+def make_cache_key(indicator, params, end_date, data_version):
+    """
+    由(指标, 参数, 结束日期, 数据版本)生成缓存键，参数按键排序后序列化，日期统一为YYYY-MM-DD
+
+    参数:
+    indicator: 指标名称
+    params: 参数字典
+    end_date: 结束日期，可以为空
+    data_version: 数据版本，参见get_data_version
+    """
+    payload = json.dumps(
+        [indicator, params or {}, to_sql_date(end_date) if end_date else None, data_version],
+        sort_keys=True, default=str, ensure_ascii=False,
+    )
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    指标结果的两级缓存：进程内按最近使用淘汰的内存层，以及按总大小淘汰的磁盘层（每个结果一个pickle文件，
+    以修改时间作为最近使用时间）。数据版本是缓存键的一部分，行情数据更新后旧结果自然失效，
+    旧文件在磁盘超出上限时被淘汰。缓存返回的是共享对象，调用方不应修改
+
+    参数:
+    max_entries: 内存层最多保存的结果数
+    directory: 磁盘层目录，为空时只使用内存层
+    max_disk_bytes: 磁盘层的总大小上限
+    """
+
+    def __init__(self, max_entries=64, directory=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key, default=None):
+        """
+        按内存层、磁盘层的顺序查找，磁盘命中的结果会放入内存层
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+        if self.directory:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    value = pickle.load(f)
+                os.utime(path)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                value = CACHE_MISS
+            if value is not CACHE_MISS:
+                self._remember(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """
+        写入两级缓存，磁盘文件先写临时文件再替换，写入后按总大小淘汰最久未使用的文件
+        """
+        self._remember(key, value)
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def get_or_compute(self, indicator, params, end_date, data_version, compute):
+        """
+        命中时直接返回缓存结果，否则调用compute()计算并写入缓存
+
+        参数:
+        indicator: 指标名称
+        params: 参数字典
+        end_date: 结束日期
+        data_version: 数据版本
+        compute: 无参数的计算函数
+        """
+        key = make_cache_key(indicator, params, end_date, data_version)
+        value = self.get(key, CACHE_MISS)
+        if value is CACHE_MISS:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self, disk=False):
+        """
+        清空内存层，disk为True时同时删除磁盘层的文件
+        """
+        with self._lock:
+            self._memory.clear()
+        if disk and self.directory and os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.pkl'):
+                    os.remove(entry.path)
+
+
+_default_cache = None
+
+def get_result_cache():
+    """
+    返回进程内共享的默认缓存，磁盘层位于get_cache_dir()
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResultCache(directory=get_cache_dir())
+    return _default_cache
@@ -0,0 +1,158 @@
+import json
+from bisect import bisect_left
+from collections import deque
+import numpy as np
+
+
+def rolling_max(values, window):
+    """
+    按行计算滚动最大值（每行一只股票，按交易日升序），忽略NaN，窗口内全部为NaN时结果为NaN，
+    前window-1列的窗口从第0列开始
+    用倍增法计算：先得到长度为2^k（不超过window）的窗口最大值，再用两个相互重叠的2^k窗口覆盖整个窗口，
+    耗时与log(window)成正比，不需要(股票数, 交易日数, window)的滑动窗口视图
+
+    参数:
+    values: 一维或二维数组，二维时形状为(股票数, 交易日数)
+    window: 窗口长度
+
+    返回:
+    与values形状相同的数组
+    """
+    values = np.asarray(values, dtype=float)
+    squeeze = values.ndim == 1
+    values = np.atleast_2d(values)
+    window = max(int(window), 1)
+
+    power = 1
+    current = values.copy()
+    while power * 2 <= window:
+        shifted = np.full(current.shape, np.nan)
+        if power < current.shape[1]:
+            shifted[:, power:] = current[:, :-power]
+        current = np.fmax(current, shifted)
+        power *= 2
+    # current[:, t]为[t-power+1, t]的最大值，再与[t-window+1, t-window+power]的最大值合并
+    offset = window - power
+    result = current.copy()
+    if offset and values.shape[1]:
+        starts = np.maximum(np.arange(values.shape[1]) - offset, 0)
+        result = np.fmax(result, current[:, starts])
+    return result[0] if squeeze else result
+
+
+class RollingMaxState:
+    """
+    多周期滚动最高价的增量状态：每只股票保存一个单调递减队列，元素为(交易日序号, 价格)，
+    只保留之后没有出现更高（或相同）价格的交易日，队列长度不超过最长周期。
+    任意周期n的最高价是队列中第一个落在最近n个交易日内的元素，新交易日到来时每只股票均摊O(1)更新，
+    不需要重新扫描窗口；状态可以保存为JSON文件，次日加载后继续更新
+
+    参数:
+    windows: 周期列表
+    """
+
+    def __init__(self, windows):
+        self.windows = [int(window) for window in windows]
+        self.size = max(self.windows)
+        self.day = -1
+        self.last_trade_date = None
+        self._queues = {}
+
+    @classmethod
+    def from_panel(cls, panel, windows, end_date=None, field='close'):
+        """
+        从面板中截至end_date的最近max(windows)个交易日直接构建状态：
+        倒序累积最大值后，严格高于其后所有价格的交易日即为队列中的元素
+        """
+        state = cls(windows)
+        end_pos = panel.date_position(end_date)
+        start_pos = panel.window_start(end_pos, state.size)
+        recent = panel[field][:, start_pos:end_pos + 1][:, ::-1]
+        later_max = np.full(recent.shape, -np.inf)
+        later_max[:, 1:] = np.fmax.accumulate(np.where(np.isnan(recent), -np.inf, recent), axis=1)[:, :-1]
+        with np.errstate(invalid='ignore'):
+            keep = recent > later_max
+
+        state.day = end_pos - start_pos
+        state.last_trade_date = str(panel.trade_date(end_pos))
+        rows, offsets = np.nonzero(keep[:, ::-1])
+        values = recent[:, ::-1][rows, offsets]
+        for row, offset, value in zip(rows, offsets, values):
+            state._queues.setdefault(panel.codes[row], deque()).append((int(offset), float(value)))
+        return state
+
+    def update(self, trade_date, codes, values):
+        """
+        追加一个新交易日的价格，当日没有价格的股票不需要传入
+
+        参数:
+        trade_date: 交易日
+        codes: 股票代码列表
+        values: 与codes对应的价格
+
+        返回:
+        (highs, days_since_high)，形状均为(len(codes), len(windows))，参见highs
+        """
+        self.day += 1
+        self.last_trade_date = str(trade_date)
+        expired = self.day - self.size
+        for code, value in zip(codes, values):
+            if value is None or np.isnan(value):
+                continue
+            queue = self._queues.setdefault(code, deque())
+            while queue and queue[-1][1] <= value:
+                queue.pop()
+            queue.append((self.day, float(value)))
+            while queue[0][0] <= expired:
+                queue.popleft()
+        return self.highs(codes)
+
+    def highs(self, codes):
+        """
+        返回各股票各周期的最高价及最近一次达到该最高价距今的交易日数，周期内没有价格时为NaN
+        """
+        highs = np.full((len(codes), len(self.windows)), np.nan)
+        days_since = np.full((len(codes), len(self.windows)), np.nan)
+        for i, code in enumerate(codes):
+            queue = self._queues.get(code)
+            if not queue:
+                continue
+            for k, window in enumerate(self.windows):
+                # 队列按交易日升序，二分查找第一个落在周期内的元素
+                position = bisect_left(queue, self.day - window + 1, key=lambda item: item[0])
+                if position < len(queue):
+                    day, value = queue[position]
+                    highs[i, k] = value
+                    days_since[i, k] = self.day - day
+        return highs, days_since
+
+    def to_dict(self):
+        return {
+            'windows': self.windows,
+            'day': self.day,
+            'last_trade_date': self.last_trade_date,
+            'queues': {code: [list(item) for item in queue] for code, queue in self._queues.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['windows'])
+        state.day = data['day']
+        state.last_trade_date = data['last_trade_date']
+        state._queues = {code: deque((int(day), float(value)) for day, value in items) for code, items in data['queues'].items()}
+        return state
+
+    def save(self, path):
+        """
+        保存状态到JSON文件
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        从JSON文件加载状态
+        """
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))